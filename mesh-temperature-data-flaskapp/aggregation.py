@@ -0,0 +1,261 @@
+import bisect
+import math
+import sqlite3
+import time
+from collections.abc import Sequence
+from datetime import UTC, datetime
+from functools import lru_cache
+
+from partitions import partitions_for_range
+from rollups import aggregate_from_rollups, pick_resolution, snap_bucket_seconds
+
+AGGREGATE_MODES = ("buckets", "lttb")
+
+
+def _range_conditions(device_ids: list[int], readings_from: str | None, readings_to: str | None) -> tuple[str, list]:
+    conditions = [f"device_id IN ({','.join(['?'] * len(device_ids))})"]
+    args: list = list(device_ids)
+    if readings_from:
+        conditions.append("timestamp >= ?")
+        args.append(readings_from)
+    if readings_to:
+        conditions.append("timestamp <= ?")
+        args.append(readings_to)
+    return " AND ".join(conditions), args
+
+
+def get_epoch_range(
+    db: sqlite3.Connection, table: str, device_ids: list[int], readings_from: str | None, readings_to: str | None
+) -> tuple[int, int] | None:
+    # Actual span of the readings, used to size buckets when the caller gives an open range
+    where, args = _range_conditions(device_ids, readings_from, readings_to)
+    min_epoch, max_epoch = None, None
+    for partition in partitions_for_range(db, table, readings_from, readings_to):
+        row = db.execute(
+            f"SELECT CAST(strftime('%s', MIN(timestamp)) AS INTEGER), CAST(strftime('%s', MAX(timestamp)) AS INTEGER) "
+            f"FROM {partition} WHERE {where}",
+            args,
+        ).fetchone()
+        if row[0] is None:
+            continue
+        min_epoch = row[0] if min_epoch is None else min(min_epoch, row[0])
+        max_epoch = row[1] if max_epoch is None else max(max_epoch, row[1])
+    if min_epoch is None:
+        return None
+    return min_epoch, max_epoch
+
+
+def bucket_seconds_for_points(epoch_range: tuple[int, int], points: int) -> int:
+    # Snapped to whole minutes/hours/days once wide enough, so the rollups can serve the buckets
+    return snap_bucket_seconds(max(1, math.ceil((epoch_range[1] - epoch_range[0] + 1) / points)))
+
+
+def _parse_epoch(timestamp: str | None) -> int | None:
+    if timestamp is None:
+        return None
+    return int(datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").replace(tzinfo=UTC).timestamp())
+
+
+def aggregate_buckets(
+    db: sqlite3.Connection,
+    table: str,
+    value_col: str,
+    device_ids: list[int],
+    readings_from: str | None,
+    readings_to: str | None,
+    bucket_seconds: int,
+) -> dict[int, list[dict]]:
+    """min/max/avg/count of readings per device and fixed-width time bucket, aligned on the unix epoch.
+
+    Served from the coarsest rollup that exactly tiles the buckets and range, raw readings otherwise.
+    """
+    try:
+        from_epoch, to_epoch = _parse_epoch(readings_from or None), _parse_epoch(readings_to or None)
+        resolution = pick_resolution(bucket_seconds, from_epoch, to_epoch)
+    except ValueError:
+        # Partial timestamps like 'YYYY-MM-DD' still work as string bounds on the raw readings
+        resolution = None
+
+    if resolution is not None:
+        rows = aggregate_from_rollups(db, table, device_ids, resolution, from_epoch, to_epoch, bucket_seconds)
+    else:
+        rows = _aggregate_raw(db, table, value_col, device_ids, readings_from, readings_to, bucket_seconds)
+
+    buckets: dict[int, list[dict]] = {device_id: [] for device_id in device_ids}
+    for device_id, bucket, min_value, max_value, avg_value, count in rows:
+        buckets[device_id].append(
+            {
+                "timestamp": epoch_to_str(bucket),
+                "min": min_value,
+                "max": max_value,
+                "avg": avg_value,
+                "count": count,
+            }
+        )
+    return buckets
+
+
+def _aggregate_raw(
+    db: sqlite3.Connection,
+    table: str,
+    value_col: str,
+    device_ids: list[int],
+    readings_from: str | None,
+    readings_to: str | None,
+    bucket_seconds: int,
+) -> list[tuple]:
+    # GROUP BY each partition, buckets wider than a day can straddle two months so partials are merged
+    where, args = _range_conditions(device_ids, readings_from, readings_to)
+    merged: dict[tuple[int, int], list] = {}
+    for partition in partitions_for_range(db, table, readings_from, readings_to):
+        stmt = (
+            f"SELECT device_id, (CAST(strftime('%s', timestamp) AS INTEGER) / ?) * ? AS bucket, "
+            f"MIN({value_col}), MAX({value_col}), TOTAL({value_col}), COUNT(*) "
+            f"FROM {partition} WHERE {where} GROUP BY device_id, bucket"
+        )
+        for device_id, bucket, min_value, max_value, sum_value, count in db.execute(
+            stmt, (bucket_seconds, bucket_seconds, *args)
+        ):
+            agg = merged.get((device_id, bucket))
+            if agg is None:
+                merged[(device_id, bucket)] = [min_value, max_value, sum_value, count]
+            else:
+                agg[0], agg[1] = min(agg[0], min_value), max(agg[1], max_value)
+                agg[2] += sum_value
+                agg[3] += count
+    return [
+        (device_id, bucket, min_value, max_value, sum_value / count, count)
+        for (device_id, bucket), (min_value, max_value, sum_value, count) in sorted(merged.items())
+    ]
+
+
+def series_epoch_range(series: dict[int, tuple[Sequence[int], Sequence]]) -> tuple[int, int] | None:
+    # get_epoch_range of (epochs, values) series sorted by epoch, i.e. from the hot window
+    ranges = [(epochs[0], epochs[-1]) for epochs, _ in series.values() if epochs]
+    if not ranges:
+        return None
+    return min(first for first, _ in ranges), max(last for _, last in ranges)
+
+
+def aggregate_series_buckets(
+    series: dict[int, tuple[Sequence[int], Sequence]], bucket_seconds: int
+) -> dict[int, list[dict]]:
+    """aggregate_buckets of (epochs, values) series sorted by epoch, each bucket is one slice of the arrays."""
+    buckets: dict[int, list[dict]] = {}
+    for device_id, (epochs, values) in series.items():
+        points = buckets[device_id] = []
+        start, end = 0, len(epochs)
+        while start < end:
+            bucket = epochs[start] - epochs[start] % bucket_seconds
+            stop = bisect.bisect_left(epochs, bucket + bucket_seconds, start, end)
+            count = stop - start
+            if count == 1:
+                # Usual for recent ranges, bucketed finer than the readings interval to get enough points
+                value = values[start]
+                points.append(
+                    {"timestamp": epoch_to_str(bucket), "min": value, "max": value, "avg": float(value), "count": 1}
+                )
+                start = stop
+                continue
+            chunk = values[start:stop]
+            points.append(
+                {
+                    "timestamp": epoch_to_str(bucket),
+                    "min": min(chunk),
+                    "max": max(chunk),
+                    # Exactly rounded sum, the average does not depend on the order of the readings
+                    "avg": math.fsum(chunk) / count,
+                    "count": count,
+                }
+            )
+            start = stop
+    return buckets
+
+
+def lttb(points: list[tuple[int, float]], threshold: int) -> list[tuple[int, float]]:
+    """Largest-Triangle-Three-Buckets downsampling of (x, y) points sorted by x, keeps the visual shape."""
+    n_points = len(points)
+    if threshold >= n_points:
+        return list(points)
+    # Fewer points than the two ends and one per bucket: the first point, then the last one
+    if threshold < 3:
+        return [points[0], points[-1]][:threshold]
+
+    sampled = [points[0]]
+    bucket_size = (n_points - 2) / (threshold - 2)
+    a = 0  # index of the previously selected point
+    for i in range(threshold - 2):
+        # Average of the next bucket is the third vertex of the triangle
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n_points)
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        avg_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        ax, ay = points[a]
+        max_area, max_index = -1.0, start
+        for j in range(start, end):
+            x, y = points[j]
+            area = abs((ax - avg_x) * (y - ay) - (ax - x) * (avg_y - ay))
+            if area > max_area:
+                max_area, max_index = area, j
+        sampled.append(points[max_index])
+        a = max_index
+
+    sampled.append(points[-1])
+    return sampled
+
+
+def downsample_lttb(
+    db: sqlite3.Connection,
+    table: str,
+    value_col: str,
+    device_ids: list[int],
+    readings_from: str | None,
+    readings_to: str | None,
+    points: int,
+) -> dict[int, list[dict]]:
+    """At most `points` readings per device, selected with LTTB."""
+    downsampled = {}
+    partitions = partitions_for_range(db, table, readings_from, readings_to)
+    for device_id in device_ids:
+        where, args = _range_conditions([device_id], readings_from, readings_to)
+        series = []
+        for partition in partitions:
+            series.extend(
+                db.execute(
+                    f"SELECT CAST(strftime('%s', timestamp) AS INTEGER), {value_col} FROM {partition} "
+                    f"WHERE {where} ORDER BY timestamp",
+                    args,
+                )
+            )
+        downsampled[device_id] = [
+            {"timestamp": epoch_to_str(epoch), value_col: value} for epoch, value in lttb(series, points)
+        ]
+    return downsampled
+
+
+def downsample_series_lttb(
+    series: dict[int, tuple[Sequence[int], Sequence]], value_col: str, points: int
+) -> dict[int, list[dict]]:
+    """downsample_lttb of (epochs, values) series sorted by epoch."""
+    return {
+        device_id: [
+            {"timestamp": epoch_to_str(epoch), value_col: value}
+            for epoch, value in lttb(list(zip(epochs, values)), points)
+        ]
+        for device_id, (epochs, values) in series.items()
+    }
+
+
+@lru_cache(maxsize=4096)
+def _minute_str(minute_epoch: int) -> str:
+    return time.strftime("%Y-%m-%d %H:%M", time.gmtime(minute_epoch))
+
+
+def epoch_to_str(epoch: int) -> str:
+    # Stored timestamps are naive 'YYYY-MM-DD HH:MM:SS', strftime('%s') treats them as UTC so format back the same way.
+    # The points of a response share few minutes, each is formatted once
+    return f"{_minute_str(epoch - epoch % 60)}:{epoch % 60:02d}"
@@ -1,12 +1,15 @@
-from flask import Flask, Request, render_template, request, g
+from flask import Flask, Request, Response, render_template, request, g
+from flask.cli import AppGroup
 from flask_mqtt import Mqtt
 
+import atexit
+import click
 import logging
 from datetime import datetime
-import sqlite3
 import json
 from typing import Any
 import random
+import time
 
 ###### CONFIGURE APP WITH ENV VARIABLES ######
 from config import (
@@ -20,11 +23,94 @@ from config import (
     MQTT_TLS_ENABLED,
     MQTT_GATEWAY_TOPIC,
     MQTT_TEMPERATURE_TOPIC,
+    MQTT_SUBSCRIBE_IN_WEB,
     HOST_URL,
     PORT,
     DEBUG_MODE,
     DATABASE_PATH,
+    INGEST_MAX_BATCH,
+    INGEST_FLUSH_INTERVAL,
+    INGEST_QUEUE_SIZE,
+    INGEST_FULL_POLICY,
+    INGEST_BLOCK_TIMEOUT,
+    INGEST_BULK_MAX_ITEMS,
+    INGEST_BULK_TIMEOUT,
+    DEVICE_REGISTRY_REFRESH_INTERVAL,
+    DEVICE_REGISTRY_NEGATIVE_TTL,
+    EXPORT_CHUNK_SIZE,
+    AGGREGATE_DEFAULT_POINTS,
+    AGGREGATE_MAX_POINTS,
+    RETENTION_CHECK_INTERVAL,
+    LIVE_BUFFER_SIZE,
+    LIVE_MAX_CLIENTS,
+    LIVE_KEEPALIVE_INTERVAL,
+    LIVE_INITIAL_WINDOW,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_SYNCHRONOUS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_MMAP_SIZE,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_POOL_SIZE,
+    METRICS_ENABLED,
+    LOG_MESSAGE_SAMPLE_RATE,
+    RESPONSE_CACHE_MAX_MB,
+    RESPONSE_CACHE_OPEN_TTL,
+    HOT_WINDOW_SIZE,
 )
+import database
+from database import ConnectionPool, SQLiteSettings
+from aggregation import (
+    AGGREGATE_MODES,
+    aggregate_buckets,
+    aggregate_series_buckets,
+    bucket_seconds_for_points,
+    downsample_lttb,
+    downsample_series_lttb,
+    get_epoch_range,
+    series_epoch_range,
+)
+from cache import ResponseCache
+from bulk import BULK_CONTENT_TYPES, parse_bulk_body, validate_readings
+from export import EXPORT_FORMATS, iter_csv, iter_gzip, iter_ndjson, iter_readings_rows
+from hub import EventStream, HubFull, ReadingsHub
+from ingest import IngestQueue, IngestQueueFull, IngestWriteError
+import metrics
+from metrics import (
+    CONTENT_TYPE,
+    ENQUEUE_SECONDS,
+    HTTP_REQUEST_SECONDS,
+    INGEST_QUEUE_DEPTH,
+    LIVE_SUBSCRIBERS,
+    PARSE_SECONDS,
+    REGISTRY,
+    REJECTED,
+    TOPIC_MESSAGES,
+    message_log,
+)
+from migrations import migrate
+from payloads import (
+    BINARY_TOPIC_SUFFIX,
+    decode_frame,
+    encode_frame,
+    frame_rows,
+    is_binary,
+    received_timestamp,
+)
+from retention import run_retention
+from rollups import ROLLUP_TABLES, backfill_rollups, verify_rollups
+import readings
+from readings import (
+    GATEWAY_READINGS,
+    TEMPERATURE_READINGS,
+    ReadingKind,
+    get_readings,
+    lookup_device,
+    reading_accepted,
+    readings_cache_key,
+    validate_reading,
+)
+from registry import GATEWAY, TEMPERATURE, DeviceRegistry
+from window import HotWindow
 
 
 def configure_logger(name: str, log_level: int = logging.INFO) -> logging.Logger:
@@ -56,18 +142,160 @@ app.config["MQTT_KEEPALIVE"] = MQTT_KEEPALIVE
 app.config["MQTT_TLS_ENABLED"] = MQTT_TLS_ENABLED
 app.config["DATABASE"] = DATABASE_PATH
 
-mqtt_client = Mqtt(app)
+# Connected by init_app once its handlers are registered, see below
+mqtt_client = Mqtt()
 logger.debug(f"Flask app config: {app.config}")
 
+###### Metrics and per-message log sampling ######
+metrics.configure(enabled=METRICS_ENABLED, log_sample_rate=LOG_MESSAGE_SAMPLE_RATE)
+
+###### SQLite tuning, set before the migrations, ingest writer and registry open connections ######
+database.configure(
+    SQLiteSettings(
+        journal_mode=SQLITE_JOURNAL_MODE,
+        synchronous=SQLITE_SYNCHRONOUS,
+        cache_size_kb=SQLITE_CACHE_SIZE_KB,
+        mmap_size=SQLITE_MMAP_SIZE,
+        busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+    )
+)
+
+###### Schema migrations, applied before anything touches the db ######
+configure_logger("migrations", getattr(logging, LOG_LEVEL))
+migrate(DATABASE_PATH)
+
+
+@app.cli.command("migrate")
+def migrate_command():
+    """Apply pending schema migrations to the database."""
+    migrate(app.config["DATABASE"])
+
+
+rollups_cli = AppGroup("rollups", help="Maintain the per minute/hour/day readings rollups.")
+app.cli.add_command(rollups_cli)
+
+
+@rollups_cli.command("backfill")
+@click.option("--table", type=click.Choice(list(ROLLUP_TABLES)), help="Only rebuild this readings table.")
+def rollups_backfill_command(table):
+    """Rebuild rollups from the raw readings."""
+    db = database.connect(app.config["DATABASE"])
+    try:
+        with db:
+            for readings_table in [table] if table else ROLLUP_TABLES:
+                backfill_rollups(db, readings_table)
+    finally:
+        db.close()
+
+
+@rollups_cli.command("verify")
+def rollups_verify_command():
+    """Check rollups against an aggregation of the raw readings, exits non-zero on mismatch."""
+    db = database.connect(app.config["DATABASE"], readonly=True)
+    try:
+        mismatches = [mismatch for table in ROLLUP_TABLES for mismatch in verify_rollups(db, table)]
+    finally:
+        db.close()
+    for mismatch in mismatches:
+        click.echo(mismatch, err=True)
+    if mismatches:
+        raise SystemExit(f"{len(mismatches)} rollup buckets do not match the raw readings")
+    click.echo("Rollups match the raw readings")
+
+
+###### Retention of raw readings partitions and rollups ######
+configure_logger("partitions", getattr(logging, LOG_LEVEL))
+
+
+@app.cli.command("retention")
+def retention_command():
+    """Drop expired readings partitions and rollups now."""
+    db = database.connect(app.config["DATABASE"])
+    try:
+        run_retention(db)
+    finally:
+        db.close()
+
+
+###### Live readings hub, fed by the ingest writer after each commit ######
+configure_logger("hub", getattr(logging, LOG_LEVEL))
+readings_hub = ReadingsHub(buffer_size=LIVE_BUFFER_SIZE, max_subscribers=LIVE_MAX_CLIENTS)
+
+###### Readings responses cache ######
+# Readings ingested by consumer.py don't go through this process' writer, open ranges then expire instead
+response_cache = ResponseCache(
+    max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+    open_ttl=None if MQTT_SUBSCRIBE_IN_WEB else RESPONSE_CACHE_OPEN_TTL,
+)
+
+###### Hot window of the newest readings per device, for recent-range aggregations ######
+# Warmed at startup before the ingest writer, it would miss the readings committed by consumer.py
+hot_window = HotWindow(size=HOT_WINDOW_SIZE if MQTT_SUBSCRIBE_IN_WEB else 0)
+
+
+def readings_committed(batch: list[tuple]) -> None:
+    # Stale responses are dropped before live clients hear of the new readings and reload
+    hot_window.add(batch)
+    response_cache.invalidate(batch)
+    readings_hub.publish(batch)
+
+
+def run_maintenance(db) -> None:
+    run_retention(db)
+    # Cached historical ranges may have lost their readings
+    response_cache.clear()
+    hot_window.refresh(db)
+
+
+###### Write-behind ingestion queue ######
+configure_logger("ingest", getattr(logging, LOG_LEVEL))
+ingest_queue = IngestQueue(
+    DATABASE_PATH,
+    max_batch=INGEST_MAX_BATCH,
+    flush_interval=INGEST_FLUSH_INTERVAL,
+    max_size=INGEST_QUEUE_SIZE,
+    full_policy=INGEST_FULL_POLICY,
+    block_timeout=INGEST_BLOCK_TIMEOUT,
+    # Retention runs on the writer connection so it never waits on the ingest write lock
+    maintenance=run_maintenance,
+    maintenance_interval=RETENTION_CHECK_INTERVAL,
+    on_commit=readings_committed,
+)
+if hot_window.size > 0:
+    # Before the writer commits anything and before serving, the window then holds every reading committed since
+    start = time.perf_counter()
+    warm_db = database.connect(DATABASE_PATH, readonly=True)
+    try:
+        hot_window.warm(warm_db)
+    finally:
+        warm_db.close()
+    logger.info(f"Warmed hot window in {(time.perf_counter() - start) * 1000:.0f}ms: {hot_window.stats()}")
+ingest_queue.start()
+atexit.register(ingest_queue.stop)
+INGEST_QUEUE_DEPTH.set_function(lambda: ingest_queue.depth)
+LIVE_SUBSCRIBERS.set_function(lambda: readings_hub.stats()["subscribers"])
+
+###### Device registry (MAC -> device cache) ######
+configure_logger("registry", getattr(logging, LOG_LEVEL))
+configure_logger("readings", getattr(logging, LOG_LEVEL))
+device_registry = DeviceRegistry(
+    DATABASE_PATH,
+    refresh_interval=DEVICE_REGISTRY_REFRESH_INTERVAL,
+    negative_ttl=DEVICE_REGISTRY_NEGATIVE_TTL,
+)
+device_registry.load()
+
 
 ###### SQLITE DB Conn/Query helpers ######
+# HTTP API only reads, writes go through the ingest writer
+# Rows come back as plain tuples with timestamps as stored, serialized straight to JSON without datetime round trips
+read_pool = ConnectionPool(DATABASE_PATH, readonly=True, max_idle=SQLITE_POOL_SIZE)
+
+
 def get_db():
-    # Singleton db conn
+    # One pooled read-only conn per app context
     if "db" not in g:
-        db_path = app.config["DATABASE"]
-        logger.debug(f"Connecting to database: {db_path}")
-        g.db = sqlite3.connect(str(db_path), detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = read_pool.acquire()
 
     return g.db
 
@@ -81,10 +309,6 @@ def query_db(query, args=(), one=False):
     return (rv[0] if rv else None) if one else rv
 
 
-def row_obj_to_dict(obj: sqlite3.Row) -> dict:
-    return {col: obj[col] for col in obj.keys()}
-
-
 ###### flask helpers ######
 def get_json_from_req(request: Request) -> Any | None:
     content_type = request.headers.get("Content-Type")
@@ -94,135 +318,228 @@ def get_json_from_req(request: Request) -> Any | None:
         return None
 
 
-# Processing gateway data logic from /api endpoints or handle_mqtt_message
-def process_gateway_data(data: dict) -> str:
-    gateway_mac = data.get("macAddress")
-    if gateway_mac is None:
-        return json.dumps({"statusCode": 400, "error": "'macAddress' required in body"})
-
-    # Gateway id from mac address
-    stmt = "SELECT id FROM devices WHERE mac_address = ? AND info LIKE '%GATEWAY%'"
-    gateway_id_row = query_db(stmt, (gateway_mac,), one=True)
-    if gateway_id_row is None:
-        return json.dumps({"statusCode": 404, "error": f"Gateway with MAC_address={gateway_mac} not found"})
-    else:
-        gateway_id = gateway_id_row[0]
-
-    # Validate its a gateway
-
-    # Insert a new reading
-    timestamp, rssi = data.get("timestamp"), data.get("rssi")
-    if timestamp is None or rssi is None:
-        return json.dumps({"statusCode": 400, "error": "Missing either of 'timestamp' or 'rssi' in body"})
-    # Data validation of timestamp and rssi
+def live_page_args() -> tuple[dict, bool]:
+    # Readings pages load a small window once, the newest page then gets new readings pushed (see stream_readings)
+    args = request.args.to_dict()
+    args.setdefault("limit", str(LIVE_INITIAL_WINDOW))
+    live = not any(args.get(key) for key in ("before", "after", "readingsTo"))
+    return args, live
+
+
+def cached_readings(kind: ReadingKind, args) -> tuple[str, str | None]:
+    """Readings response body from the response cache or the db, and its ETag (None for errors)."""
+    device_id, error = lookup_device(device_registry, kind, args)
+    if error is not None:
+        return error, None
+    key, upper_bound = readings_cache_key(kind, device_id, args)
+    cached = response_cache.get(key)
+    if cached is None:
+        generation = response_cache.generation(key)
+        body = get_readings(get_db(), device_registry, kind, args)
+        cached = response_cache.put(key, body, upper_bound, generation)
+        if cached is None:
+            return body, None
+    return cached.body, cached.etag
+
+
+def readings_api_response(kind: ReadingKind) -> Response | str:
+    body, etag = cached_readings(kind, request.args)
+    if etag is None:
+        return body
+    # Browsers revalidate every time and get a 304 without the body while the readings are unchanged
+    response = Response(body, mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+def enqueue_reading(table: str, device_id: int, timestamp: str, value, seq: int | None) -> str | None:
+    # Hand the reading to the writer thread, returns an error response if it could not be queued
+    start = time.perf_counter()
     try:
-        timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
-        return json.dumps(
-            {
-                "statusCode": 400,
-                "error": f"Invalid datetime format: {timestamp}. Required format: 'YYYY-MM-DD HH:MM:SS'",
-            }
-        )
-    try:
-        rssi = int(rssi)
-    except ValueError:
-        return json.dumps({"statusCode": 400, "error": f"Invalid rssi format. Could not convert {rssi} to int."})
+        queued = ingest_queue.put(table, device_id, timestamp, value, seq)
+    except IngestQueueFull as e:
+        return json.dumps({"statusCode": 503, "error": str(e)})
+    finally:
+        ENQUEUE_SECONDS.observe(time.perf_counter() - start)
+    if not queued:
+        return json.dumps({"statusCode": 503, "error": "Ingest queue full, reading dropped"})
+    return None
 
-    logger.info(f"Inserting new reading for gatewayId={gateway_id} of rssi={rssi}")
-    stmt = "INSERT INTO gateway_readings (device_id, timestamp, rssi) VALUES (?, ?, ?)"
-    query_db(stmt, (gateway_id, timestamp, rssi))
 
-    return json.dumps({"statusCode": 200, "device_id": gateway_id})
+# Processing readings logic from /api endpoints or handle_mqtt_message
+def process_reading_data(kind: ReadingKind, data: dict, received_time: str | None = None) -> str:
+    row, error = validate_reading(kind, data, device_registry, received_time)
+    if error:
+        return error
 
+    error = enqueue_reading(kind.table, *row)
+    if error:
+        return error
 
-def process_sensor_temp_data(data: dict) -> str:
-    sensor_mac = data.get("macAddress")
-    if sensor_mac is None:
-        return json.dumps({"statusCode": 400, "error": "'macAddress' required in body"})
+    return reading_accepted(row[0])
 
-    # Sensor id from mac address
-    stmt = "SELECT id FROM devices WHERE mac_address = ? AND info LIKE '%TEMPERATURE%'"
-    sensor_id_row = query_db(stmt, (sensor_mac,), one=True)
-    if sensor_id_row is None:
-        return json.dumps({"statusCode": 404, "error": f"Sensor with MAC_address={sensor_mac} not found"})
-    else:
-        sensor_id = sensor_id_row[0]
 
-    # Insert a new reading
-    timestamp, temperature = data.get("timestamp"), data.get("temperature")
-    if timestamp is None or temperature is None:
-        return json.dumps({"statusCode": 400, "error": "Missing either of 'timestamp' or 'temperature' in body"})
-    # Data validation of timestamp and temp
+def process_reading_frame(kind: ReadingKind, payload: bytes) -> str:
+    # Binary frame of many readings relayed by one gateway, see payloads.py
+    start = time.perf_counter()
     try:
-        timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S")
-    except ValueError:
+        frame = decode_frame(payload, kind.table)
+    except ValueError as e:
+        REJECTED["invalid_payload"].inc()
+        return json.dumps({"statusCode": 400, "error": str(e)})
+    PARSE_SECONDS.observe(time.perf_counter() - start)
+
+    def lookup_device_id(mac_address: str) -> int | None:
+        device = device_registry.lookup(mac_address, kind.device_type)
+        return device.id if device is not None else None
+
+    # FIX: No real time clock in gateway for now, readings without a timestamp get the received time
+    rows, rejected = frame_rows(frame, lookup_device_id, received_timestamp())
+    for row in rows:
+        error = enqueue_reading(kind.table, *row)
+        if error:
+            return error
+    return json.dumps({"statusCode": 200, "accepted": len(rows), "rejected": rejected})
+
+
+def process_mqtt_frame(topic: str, payload: bytes) -> str | None:
+    if MQTT_GATEWAY_TOPIC in topic:
+        TOPIC_MESSAGES["gateway"].inc()
+        return process_reading_frame(GATEWAY_READINGS, payload)
+    if MQTT_TEMPERATURE_TOPIC in topic:
+        TOPIC_MESSAGES["temperature"].inc()
+        return process_reading_frame(TEMPERATURE_READINGS, payload)
+    TOPIC_MESSAGES["unknown"].inc()
+    REJECTED["unknown_topic"].inc()
+    logger.warning(f"Not processing topic {topic}")
+    return None
+
+
+def process_bulk_readings(kind: ReadingKind) -> str:
+    # Batch variant of process_gateway_data/process_sensor_temp_data for a JSON array or NDJSON body
+    if request.mimetype not in BULK_CONTENT_TYPES:
+        return json.dumps({"statusCode": 400, "error": f"Expected Content-Type one of {list(BULK_CONTENT_TYPES)}"})
+    try:
+        items = parse_bulk_body(request.get_data(), request.mimetype)
+    except ValueError as e:
+        return json.dumps({"statusCode": 400, "error": str(e)})
+    if len(items) > INGEST_BULK_MAX_ITEMS:
         return json.dumps(
             {
-                "statusCode": 400,
-                "error": f"Invalid datetime format: {timestamp}. Required format: 'YYYY-MM-DD HH:MM:SS'",
+                "statusCode": 413,
+                "error": f"Too many readings: {len(items)}. At most {INGEST_BULK_MAX_ITEMS} per request",
             }
         )
-    try:
-        temperature = float(temperature)
-    except ValueError:
-        return json.dumps(
-            {"statusCode": 400, "error": f"Invalid temp format. Could not convert {temperature} to float."}
-        )
 
-    logger.info(f"Inserting new reading for sensorId={sensor_id} of rssi={temperature}")
-    stmt = "INSERT INTO sensor_temperature_readings (device_id, timestamp, temperature) VALUES (?, ?, ?)"
-    query_db(stmt, (sensor_id, timestamp, temperature))
+    def lookup_device_id(mac_address: str) -> int | None:
+        device = device_registry.lookup(mac_address, kind.device_type)
+        return device.id if device is not None else None
+
+    rows, errors = validate_readings(items, kind.value_col, kind.convert, lookup_device_id)
+    inserted = 0
+    if rows:
+        # Valid readings are committed together, the response is only sent once they are stored
+        try:
+            inserted = ingest_queue.put_many(kind.table, rows, timeout=INGEST_BULK_TIMEOUT)
+        except (IngestQueueFull, IngestWriteError, TimeoutError) as e:
+            return json.dumps({"statusCode": 503, "error": str(e), "accepted": 0, "errors": errors})
+
+    # Re-uploading readings is safe, they are keyed by their seq or timestamp (see payloads.reading_seq): those already
+    # stored are accepted but counted as duplicates
+    logger.info(
+        f"Bulk ingested {inserted} readings into {kind.table}, {len(rows) - inserted} duplicates, rejected {len(errors)}"
+    )
+    return json.dumps(
+        {
+            "statusCode": 200 if rows or not errors else 400,
+            "accepted": len(rows),
+            "duplicates": len(rows) - inserted,
+            "rejected": len(errors),
+            "errors": errors,
+        }
+    )
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
-    return json.dumps({"statusCode": 200, "device_id": sensor_id})
+
+@app.after_request
+def observe_request_latency(response: Response) -> Response:
+    # Labelled by route pattern, not path, so device MACs and ids do not each become a series
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    start = g.get("request_start")
+    if start is not None:
+        HTTP_REQUEST_SECONDS.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+    return response
 
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, "db", None)
+    db = g.pop("db", None)
     if db is not None:
-        db.close()
+        read_pool.release(db)
 
 
 ### MQTT FUNCS ###
 @mqtt_client.on_message()
 def handle_mqtt_message(client, userdata, message):
     # OPTIMIZE: ALL devices known upfront, no insert into 'devices' table if message contains new MAC
-    with app.app_context():
-        processed_message = None
-        try:
-            payload = message.payload.decode()
+    # Device lookups go through the registry and inserts through the ingest queue, no app context needed
+    processed_message = None
+    # Per-message INFO logs are sampled (LOG_MESSAGE_SAMPLE_RATE), a message is logged all the way or not at all
+    log_message = message_log.enabled(logger)
+    try:
+        if is_binary(message):
+            processed_message = process_mqtt_frame(message.topic, message.payload)
+            if log_message:
+                logger.info(f"Processed binary frame with db operation: {processed_message}")
+            return
+        start = time.perf_counter()
+        payload = message.payload.decode()
+        if log_message:
             logger.info(f"Received message with payload={payload}")
-            data = json.loads(payload)
+        data = json.loads(payload)
+        PARSE_SECONDS.observe(time.perf_counter() - start)
 
-            if MQTT_GATEWAY_TOPIC in message.topic:
+        if MQTT_GATEWAY_TOPIC in message.topic:
+            TOPIC_MESSAGES["gateway"].inc()
+            if log_message:
                 logger.info(f"Processing message from gateway topic: {message.topic}")
-                # Preparing payload
-                # FIX: No real time clock in gateway for now, lets use received time as timestamp, overriding
-                data["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
+            if log_message:
                 logger.info(data)
-                processed_message = process_gateway_data(data)
-            elif MQTT_TEMPERATURE_TOPIC in message.topic:
+            # FIX: No real time clock in gateway for now, received time as timestamp unless the device sent its own
+            processed_message = process_reading_data(GATEWAY_READINGS, data, received_timestamp())
+        elif MQTT_TEMPERATURE_TOPIC in message.topic:
+            TOPIC_MESSAGES["temperature"].inc()
+            if log_message:
                 logger.info(f"Processing message from temperature topic: {message.topic}")
-                # FIX: No real time clock in gateway for now, lets use received time as timestamp, overriding
-                data["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                processed_message = process_sensor_temp_data(data)
-            else:
-                logger.warning(f"Not processing topic {message.topic}")
-        except json.JSONDecodeError:
-            logger.error(f"Failed to parse JSON payload from: {message.payload}")
-        except Exception as e:
-            logger.error(f"Error processing MQTT message: {str(e)}")
-
-        if processed_message:
-            logger.info(f"Processed message with db operation: {processed_message}")
+            # FIX: No real time clock in gateway for now, received time as timestamp unless the device sent its own
+            processed_message = process_reading_data(TEMPERATURE_READINGS, data, received_timestamp())
+        else:
+            TOPIC_MESSAGES["unknown"].inc()
+            REJECTED["unknown_topic"].inc()
+            logger.warning(f"Not processing topic {message.topic}")
+    except (UnicodeDecodeError, json.JSONDecodeError):
+        REJECTED["invalid_payload"].inc()
+        logger.error(f"Failed to parse JSON payload from: {message.payload}")
+    except Exception as e:
+        logger.error(f"Error processing MQTT message: {str(e)}")
+
+    if processed_message and log_message:
+        logger.info(f"Processed message with db operation: {processed_message}")
 
 
 @mqtt_client.on_connect()
 def handle_connect(client, userdata, flags, rc):
     if rc == 0:
         logger.info("Connected successfully")
+        if not MQTT_SUBSCRIBE_IN_WEB:
+            # Readings are consumed by consumer.py, the connection is only used to publish
+            logger.info("Not subscribing to readings topics, MQTT_SUBSCRIBE_IN_WEB is off")
+            return
         # Subscribe to all sensors and gateways
         mqtt_client.subscribe(f"{MQTT_GATEWAY_TOPIC}/#")
         mqtt_client.subscribe(f"{MQTT_TEMPERATURE_TOPIC}/#")
@@ -231,6 +548,10 @@ def handle_connect(client, userdata, flags, rc):
         logger.error(f"Bad connection to MQTT broker. Code: {rc}")
 
 
+# A CONNACK handled before handle_connect is registered would leave the readings topics unsubscribed
+mqtt_client.init_app(app)
+
+
 ###### Flask routes ######
 @app.route("/", methods=["GET"])
 def index():
@@ -241,20 +562,20 @@ def index():
 @app.route("/gateway-readings", methods=["GET"])
 def gateway_readings():
     # Get available gateway devices for selection
-    devices_response = json.loads(get_devices())
-    all_devices = devices_response.get("devices", [])
-    gateway_devices = [device for device in all_devices if "GATEWAY" in device.get("info", "").upper()]
+    gateway_devices = device_registry.devices(GATEWAY)
 
     # Get gateway readings if a specific gateway is selected
     gateway_mac = request.args.get("macAddress")
     gateway_readings = {"statusCode": 200, "gatewayReadings": []}
 
     # Update readings data when selected
+    args, live = live_page_args()
     if gateway_mac:
-        api_resp_gateway = get_gateway_readings()
+        api_resp_gateway, _ = cached_readings(GATEWAY_READINGS, args)
         gateway_readings = json.loads(api_resp_gateway)
 
-    logger.info(gateway_readings)
+    if message_log.enabled(logger):
+        logger.info(gateway_readings)
     # Format date for the template
     now = datetime.now().strftime("%Y-%m-%d %H:%M")
 
@@ -269,6 +590,8 @@ def gateway_readings():
         selected_device=gateway_mac,
         readings_from=readings_from,
         readings_to=readings_to,
+        live=live,
+        live_window=int(args["limit"]) if args["limit"].isdigit() else LIVE_INITIAL_WINDOW,
         now=now,
     )
 
@@ -276,20 +599,20 @@ def gateway_readings():
 @app.route("/sensor-temperature-readings", methods=["GET"])
 def sensor_temperature_readings():
     # Get available temperature devices for selection
-    devices_response = json.loads(get_devices())
-    all_devices = devices_response.get("devices", [])
-    temp_devices = [device for device in all_devices if "TEMPERATURE" in device.get("info", "").upper()]
+    temp_devices = device_registry.devices(TEMPERATURE)
 
     # Get temperature readings if a specific device is selected
     sensor_mac = request.args.get("macAddress")
     temp_readings = {"statusCode": 200, "sensorTemperatureReadings": []}
 
+    args, live = live_page_args()
     if sensor_mac:
-        api_resp_temp = get_sensor_temp_readings()
+        api_resp_temp, _ = cached_readings(TEMPERATURE_READINGS, args)
         temp_readings = json.loads(api_resp_temp)
 
     # Format date for the template
-    logger.info(temp_readings)
+    if message_log.enabled(logger):
+        logger.info(temp_readings)
     now = datetime.now().strftime("%Y-%m-%d %H:%M")
 
     # Optional date range filters
@@ -303,6 +626,8 @@ def sensor_temperature_readings():
         selected_device=sensor_mac,
         readings_from=readings_from,
         readings_to=readings_to,
+        live=live,
+        live_window=int(args["limit"]) if args["limit"].isdigit() else LIVE_INITIAL_WINDOW,
         now=now,
     )
 
@@ -323,27 +648,24 @@ def get_devices():
     # Filter by internal_id
     internal_ids = request.args.get("internal_id", "")
     internal_ids = internal_ids.split(",") if internal_ids else []
-    logger.info(f"Retrieving devices with {internal_ids=} from db...")
+    return readings.get_devices(get_db(), internal_ids)
 
-    if internal_ids:
-        placeholders = ",".join(["?"] * len(internal_ids))
-        stmt = f"SELECT * FROM devices WHERE internal_id IN ({placeholders})"
-        devices_obj = query_db(stmt, internal_ids)
-    else:
-        stmt = "SELECT * FROM devices"
-        devices_obj = query_db(stmt)
 
-    # Return all fetched devices
-    devices = []
-    if devices_obj:
-        for device_obj in devices_obj:
-            device = {
-                k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v
-                for k, v in row_obj_to_dict(device_obj).items()
-            }
-            devices.append(device)
-    logger.debug(f"Retrieved devices: {devices}")
-    return json.dumps({"statusCode": 200, "devices": devices})
+def fleet_readings(kind: ReadingKind) -> str:
+    # Filter by internal_id, like /api/devices
+    internal_ids = request.args.get("internal_id", "")
+    internal_ids = internal_ids.split(",") if internal_ids else []
+    return readings.get_fleet(get_db(), kind, internal_ids, request.args)
+
+
+@app.route("/api/gateway-readings/latest", methods=["GET"])
+def get_latest_gateway_readings():
+    return fleet_readings(GATEWAY_READINGS)
+
+
+@app.route("/api/sensor-temperature-readings/latest", methods=["GET"])
+def get_latest_sensor_temp_readings():
+    return fleet_readings(TEMPERATURE_READINGS)
 
 
 @app.route("/api/gateway-readings", methods=["POST"])
@@ -353,148 +675,253 @@ def insert_gateway_reading():
     if data is None:
         return json.dumps({"statusCode": 400, "error": "Expected Content-Type: application/json"})
 
-    return process_gateway_data(data)
+    return process_reading_data(GATEWAY_READINGS, data)
 
 
 @app.route("/api/gateway-readings", methods=["GET"])
 def get_gateway_readings():
+    return readings_api_response(GATEWAY_READINGS)
+
+
+@app.route("/api/sensor-temperature-readings", methods=["GET"])
+def get_sensor_temp_readings():
+    return readings_api_response(TEMPERATURE_READINGS)
+
+
+@app.route("/api/sensor-temperature-readings", methods=["POST"])
+def insert_sensor_temp_readings():
     # Filter by mac address first
-    gateway_mac = request.args.get("macAddress")
-    if gateway_mac is None:
-        return json.dumps({"statusCode": 400, "error": "required 'macAddress' in params"})
+    data = get_json_from_req(request)
+    if data is None:
+        return json.dumps({"statusCode": 400, "error": "Expected Content-Type: application/json"})
 
-    # Gateway id from mac address
-    stmt = "SELECT id FROM devices WHERE mac_address = ?"
-    gateway_id_row = query_db(stmt, (gateway_mac,), one=True)
-    if gateway_id_row is None:
-        return json.dumps({"statusCode": 404, "error": f"Gateway with MAC_address={gateway_mac} not found"})
-    else:
-        device_id = gateway_id_row[0]
+    return process_reading_data(TEMPERATURE_READINGS, data)
 
-    # If no from-to range provided, return all readings otherwise filter
-    readings_from = request.args.get("readingsFrom")
-    readings_to = request.args.get("readingsTo")
 
-    # stmt builder with filters
-    logger.debug(f"request arguments: {request.args}")
-
-    if readings_from and readings_to:
-        stmt = "SELECT * from gateway_readings WHERE device_id = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (device_id, readings_from, readings_to))
-
-    elif readings_from:
-        stmt = "SELECT * from gateway_readings WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (device_id, readings_from))
-    elif readings_to:
-        stmt = "SELECT * from gateway_readings WHERE device_id = ? AND timestamp <= ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (device_id, readings_to))
-    else:  # all readings
-        stmt = "SELECT * from gateway_readings WHERE device_id = ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (device_id,))
-
-    readings = []
-    if readings_obj:
-        for reading_obj in readings_obj:
-            reading = {
-                k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v
-                for k, v in row_obj_to_dict(reading_obj).items()
-            }
-            readings.append(reading)
+def stream_readings(kind: ReadingKind) -> Response | str:
+    # Server-Sent Events of a device's readings as they are committed, one thread per connected client
+    device_id, error = lookup_device(device_registry, kind, request.args)
+    if error is not None:
+        return error
+    try:
+        stream = EventStream(readings_hub, kind.table, device_id, keepalive_interval=LIVE_KEEPALIVE_INTERVAL)
+    except HubFull as e:
+        return json.dumps({"statusCode": 503, "error": str(e)})
+
+    logger.info(f"Streaming live readings of device_id={device_id} from {kind.table}")
+    return Response(
+        stream,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-    logger.info(f"Retrieved {len(readings)} readings for device_id={device_id}")
-    return json.dumps({"statusCode": 200, "gatewayReadings": readings})
 
+@app.route("/api/gateway-readings/stream", methods=["GET"])
+def stream_gateway_readings():
+    return stream_readings(GATEWAY_READINGS)
 
-@app.route("/api/sensor-temperature-readings", methods=["GET"])
-def get_sensor_temp_readings():
-    # Filter by mac address first
-    sensor_mac = request.args.get("macAddress")
-    if sensor_mac is None:
-        return json.dumps({"statusCode": 400, "error": "required 'macAddress' in params"})
 
-    # Sensor id from mac address
-    stmt = "SELECT id FROM devices WHERE mac_address = ?"
-    sensor_id_row = query_db(stmt, (sensor_mac,), one=True)
-    if sensor_id_row is None:
-        return json.dumps({"statusCode": 404, "error": f"Sensor with MAC_address={sensor_mac} not found"})
+@app.route("/api/sensor-temperature-readings/stream", methods=["GET"])
+def stream_sensor_temp_readings():
+    return stream_readings(TEMPERATURE_READINGS)
+
+
+@app.route("/api/gateway-readings/bulk", methods=["POST"])
+def insert_gateway_readings_bulk():
+    return process_bulk_readings(GATEWAY_READINGS)
+
+
+@app.route("/api/sensor-temperature-readings/bulk", methods=["POST"])
+def insert_sensor_temp_readings_bulk():
+    return process_bulk_readings(TEMPERATURE_READINGS)
+
+
+def export_readings(kind: ReadingKind) -> Response | str:
+    # Devices to export, comma separated MACs or every device of that type
+    mac_addresses = request.args.get("macAddress", "")
+    mac_addresses = mac_addresses.split(",") if mac_addresses else []
+    if mac_addresses:
+        devices = []
+        for mac in mac_addresses:
+            device = device_registry.lookup(mac, kind.device_type)
+            if device is None:
+                return json.dumps({"statusCode": 404, "error": f"Device with MAC_address={mac} not found"})
+            devices.append(device.row)
     else:
-        sensor_id = sensor_id_row[0]
+        devices = device_registry.devices(kind.device_type)
+    if not devices:
+        return json.dumps({"statusCode": 404, "error": f"No {kind.device_type} devices to export"})
+
+    export_format = request.args.get("format", "ndjson").lower()
+    if export_format not in EXPORT_FORMATS:
+        return json.dumps(
+            {"statusCode": 400, "error": f"Invalid format={export_format}. Expected one of {list(EXPORT_FORMATS)}"}
+        )
+
+    device_macs = {device["id"]: device["mac_address"] for device in devices}
+    chunks = iter_readings_rows(
+        app.config["DATABASE"],
+        kind.table,
+        kind.value_col,
+        list(device_macs),
+        request.args.get("readingsFrom"),
+        request.args.get("readingsTo"),
+        chunk_size=EXPORT_CHUNK_SIZE,
+    )
+    body = (
+        iter_csv(chunks, kind.value_col, device_macs)
+        if export_format == "csv"
+        else iter_ndjson(chunks, kind.value_col, device_macs)
+    )
+
+    headers = {"Content-Disposition": f"attachment; filename={kind.table}.{export_format}"}
+    if request.args.get("gzip", "false").lower() in ("1", "true"):
+        body = iter_gzip(body)
+        headers["Content-Encoding"] = "gzip"
+    logger.info(f"Streaming {export_format} export of {kind.table} for {len(device_macs)} devices")
+    return Response(body, mimetype=EXPORT_FORMATS[export_format], headers=headers)
+
+
+@app.route("/api/gateway-readings/export", methods=["GET"])
+def export_gateway_readings():
+    return export_readings(GATEWAY_READINGS)
+
+
+@app.route("/api/sensor-temperature-readings/export", methods=["GET"])
+def export_sensor_temp_readings():
+    return export_readings(TEMPERATURE_READINGS)
+
+
+def aggregate_readings(kind: ReadingKind) -> str:
+    mac_addresses = request.args.get("macAddress", "")
+    mac_addresses = mac_addresses.split(",") if mac_addresses else []
+    if not mac_addresses:
+        return json.dumps({"statusCode": 400, "error": "required 'macAddress' in params"})
+    devices = []
+    for mac in mac_addresses:
+        device = device_registry.lookup(mac, kind.device_type)
+        if device is None:
+            return json.dumps({"statusCode": 404, "error": f"Device with MAC_address={mac} not found"})
+        devices.append(device)
+    device_ids = [device.id for device in devices]
+
+    mode = request.args.get("mode", "buckets").lower()
+    if mode not in AGGREGATE_MODES:
+        return json.dumps({"statusCode": 400, "error": f"Invalid mode={mode}. Expected one of {AGGREGATE_MODES}"})
+    try:
+        points = int(request.args.get("points", AGGREGATE_DEFAULT_POINTS))
+        bucket_seconds = request.args.get("bucket")
+        bucket_seconds = int(bucket_seconds) if bucket_seconds is not None else None
+    except ValueError:
+        return json.dumps({"statusCode": 400, "error": "'points' and 'bucket' must be integers"})
+    if not 1 <= points <= AGGREGATE_MAX_POINTS:
+        return json.dumps(
+            {"statusCode": 400, "error": f"Invalid points={points}. Must be between 1 and {AGGREGATE_MAX_POINTS}"}
+        )
+    if bucket_seconds is not None and bucket_seconds < 1:
+        return json.dumps({"statusCode": 400, "error": f"Invalid bucket={bucket_seconds}. Must be >= 1 second"})
 
-    # If no from-to range provided, return all readings otherwise filter
     readings_from = request.args.get("readingsFrom")
     readings_to = request.args.get("readingsTo")
+    # Recent ranges are answered from the hot window when it holds all of their readings
+    recent = hot_window.series(kind.table, device_ids, readings_from, readings_to)
+    db = get_db() if recent is None else None
+
+    series = {device_id: [] for device_id in device_ids}
+    if mode == "lttb":
+        if recent is not None:
+            series = downsample_series_lttb(recent, kind.value_col, points)
+        else:
+            series = downsample_lttb(db, kind.table, kind.value_col, device_ids, readings_from, readings_to, points)
+    else:
+        # Bucket width sized from the span of the actual readings when not given
+        if bucket_seconds is None:
+            if recent is not None:
+                epoch_range = series_epoch_range(recent)
+            else:
+                epoch_range = get_epoch_range(db, kind.table, device_ids, readings_from, readings_to)
+            bucket_seconds = bucket_seconds_for_points(epoch_range, points) if epoch_range else None
+        if bucket_seconds is not None and recent is not None:
+            series = aggregate_series_buckets(recent, bucket_seconds)
+        elif bucket_seconds is not None:
+            series = aggregate_buckets(
+                db, kind.table, kind.value_col, device_ids, readings_from, readings_to, bucket_seconds
+            )
+
+    logger.info(f"Aggregated {kind.table} for device_ids={device_ids} with {mode=} and {bucket_seconds=}")
+    return json.dumps(
+        {
+            "statusCode": 200,
+            "mode": mode,
+            "bucketSeconds": bucket_seconds,
+            "series": [
+                {"device_id": device.id, "macAddress": device.mac_address, "points": series[device.id]}
+                for device in devices
+            ],
+        }
+    )
 
-    # stmt builder with filters
-    logger.debug(f"request arguments: {request.args}")
-    logger.debug(f"Querying temps for sensor with device_id={sensor_id}")
 
-    if readings_from and readings_to:
-        stmt = "SELECT * from sensor_temperature_readings WHERE device_id = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (sensor_id, readings_from, readings_to))
+@app.route("/api/gateway-readings/aggregate", methods=["GET"])
+def aggregate_gateway_readings():
+    return aggregate_readings(GATEWAY_READINGS)
 
-    elif readings_from:
-        stmt = (
-            "SELECT * from sensor_temperature_readings WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp DESC"
-        )
-        readings_obj = query_db(stmt, (sensor_id, readings_from))
-    elif readings_to:
-        stmt = (
-            "SELECT * from sensor_temperature_readings WHERE device_id = ? AND timestamp <= ? ORDER BY timestamp DESC"
-        )
-        readings_obj = query_db(stmt, (sensor_id, readings_to))
-    else:  # all readings
-        stmt = "SELECT * from sensor_temperature_readings WHERE device_id = ? ORDER BY timestamp DESC"
-        readings_obj = query_db(stmt, (sensor_id,))
-
-    readings = []
-    if readings_obj:
-        for reading_obj in readings_obj:
-            reading = {
-                k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v
-                for k, v in row_obj_to_dict(reading_obj).items()
-            }
-            readings.append(reading)
 
-    logger.info(f"Retrieved {len(readings)} readings for sensor_id={sensor_id}")
-    return json.dumps({"statusCode": 200, "sensorTemperatureReadings": readings})
+@app.route("/api/sensor-temperature-readings/aggregate", methods=["GET"])
+def aggregate_sensor_temp_readings():
+    return aggregate_readings(TEMPERATURE_READINGS)
 
 
-@app.route("/api/sensor-temperature-readings", methods=["POST"])
-def insert_sensor_temp_readings():
-    # Filter by mac address first
-    data = get_json_from_req(request)
-    if data is None:
-        return json.dumps({"statusCode": 400, "error": "Expected Content-Type: application/json"})
+@app.route("/api/ingest-stats", methods=["GET"])
+def get_ingest_stats():
+    return json.dumps(
+        {
+            "statusCode": 200,
+            "ingest": ingest_queue.stats(),
+            "live": readings_hub.stats(),
+            "responseCache": response_cache.stats(),
+            "hotWindow": hot_window.stats(),
+        }
+    )
 
-    return process_sensor_temp_data(data)
 
+@app.route("/metrics", methods=["GET"])
+def get_metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
 
-@app.route("/api/publish-gateway-test", methods=["POST"])
-def publish_gateway_test():
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    data = {"macAddress": "3C:E9:0E:72:12:4C", "timestamp": now, "rssi": random.randint(10, 100)}
-    data_to_pub = json.dumps(data)
-    topic = f"{MQTT_GATEWAY_TOPIC}/{data['macAddress']}"
+
+def publish_test_reading(topic: str, table: str, data: dict, value_key: str) -> str:
+    # JSON message by default, ?format=binary publishes the reading as a binary frame on <topic>/bin instead
+    payload_format = request.args.get("format", "json")
+    if payload_format == "json":
+        data_to_pub = bytes(json.dumps(data), "utf-8")
+    elif payload_format == "binary":
+        topic += BINARY_TOPIC_SUFFIX
+        data_to_pub = encode_frame(table, [(data["macAddress"], int(time.time()), data[value_key])])
+    else:
+        return json.dumps({"statusCode": 400, "error": f"Invalid format={payload_format}. Must be json or binary"})
     logger.info(f"Publishing on {topic=} with data: {data_to_pub}")
-    success, msg_id = mqtt_client.publish(topic, bytes(data_to_pub, "utf-8"))
+    success, msg_id = mqtt_client.publish(topic, data_to_pub)
     if success == 0:
         return json.dumps({"statusCode": 200, "msgId": msg_id})
     else:
         return json.dumps({"statusCode": 400, "error": f"Could not connect to broker. Code: {success}"})
 
 
+@app.route("/api/publish-gateway-test", methods=["POST"])
+def publish_gateway_test():
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    data = {"macAddress": "3C:E9:0E:72:12:4C", "timestamp": now, "rssi": random.randint(10, 100)}
+    topic = f"{MQTT_GATEWAY_TOPIC}/{data['macAddress']}"
+    return publish_test_reading(topic, "gateway_readings", data, "rssi")
+
+
 @app.route("/api/publish-temperature-test", methods=["POST"])
 def publish_temperature_test():
     now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     data = {"macAddress": "E0:5A:1B:30:B3:38", "timestamp": now, "temperature": random.uniform(15, 25)}
-    data_to_pub = json.dumps(data)
     topic = f"{MQTT_TEMPERATURE_TOPIC}/{data['macAddress']}"
-    logger.info(f"Publishing on {topic=} with data: {data_to_pub}")
-    success, msg_id = mqtt_client.publish(topic, bytes(data_to_pub, "utf-8"))
-    if success == 0:
-        return json.dumps({"statusCode": 200, "msgId": msg_id})
-    else:
-        return json.dumps({"statusCode": 400, "error": f"Could not connect to broker. Code: {success}"})
+    return publish_test_reading(topic, "sensor_temperature_readings", data, "temperature")
 
 
 if __name__ == "__main__":
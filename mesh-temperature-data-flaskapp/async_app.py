@@ -0,0 +1,673 @@
+"""Optional asyncio runtime: MQTT ingest, the readings API and the ingest writer on one event loop.
+
+    pip install '.[async]'
+    python async_app.py
+
+Serves the JSON API of app.py for devices and readings (`/api/devices`, `GET`/`POST` `/api/gateway-readings` and
+`/api/sensor-temperature-readings`, their live `/stream`s and `/latest` fleet views, `/api/ingest-stats`) with the
+same responses, without a thread per connection.
+The paho client is driven by the loop's socket callbacks instead of its network thread, SQLite reads run on a
+small executor with pooled read-only connections and writes on the single ingest writer thread. The HTML views,
+exports, aggregates and bulk uploads stay on the Flask app.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import paho.mqtt.client as mqtt
+
+try:
+    from aiohttp import web
+except ImportError:
+    raise ImportError("async_app.py needs aiohttp, install the 'async' extra: pip install '.[async]'") from None
+
+import database
+import metrics
+from cache import ResponseCache
+from config import (
+    DATABASE_PATH,
+    DEVICE_REGISTRY_NEGATIVE_TTL,
+    DEVICE_REGISTRY_REFRESH_INTERVAL,
+    HOST_URL,
+    INGEST_BLOCK_TIMEOUT,
+    INGEST_FLUSH_INTERVAL,
+    INGEST_FULL_POLICY,
+    INGEST_MAX_BATCH,
+    INGEST_QUEUE_SIZE,
+    LIVE_BUFFER_SIZE,
+    LIVE_KEEPALIVE_INTERVAL,
+    LIVE_MAX_CLIENTS,
+    LOG_LEVEL,
+    LOG_MESSAGE_SAMPLE_RATE,
+    METRICS_ENABLED,
+    MQTT_BROKER_PORT,
+    MQTT_BROKER_URL,
+    MQTT_CONSUMER_KEEPALIVE,
+    MQTT_GATEWAY_TOPIC,
+    MQTT_PASSWORD,
+    MQTT_SUBSCRIBE_IN_WEB,
+    MQTT_TEMPERATURE_TOPIC,
+    MQTT_TLS_ENABLED,
+    MQTT_USERNAME,
+    PORT,
+    RESPONSE_CACHE_MAX_MB,
+    RESPONSE_CACHE_OPEN_TTL,
+    RETENTION_CHECK_INTERVAL,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_POOL_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
+from database import ConnectionPool, SQLiteSettings
+from hub import KEEPALIVE_EVENT, RETRY_EVENT, HubFull, ReadingsHub, pending_events
+from ingest import AsyncIngestQueue, IngestQueueFull
+from metrics import (
+    CONTENT_TYPE,
+    ENQUEUE_SECONDS,
+    HTTP_REQUEST_SECONDS,
+    INGEST_QUEUE_DEPTH,
+    LIVE_SUBSCRIBERS,
+    PARSE_SECONDS,
+    REGISTRY,
+    REJECTED,
+    TOPIC_MESSAGES,
+    message_log,
+)
+from migrations import migrate
+from payloads import decode_frame, frame_macs, frame_rows, is_binary, received_timestamp
+from readings import (
+    GATEWAY_READINGS,
+    TEMPERATURE_READINGS,
+    ReadingKind,
+    get_devices,
+    get_fleet,
+    get_readings,
+    lookup_device,
+    reading_accepted,
+    readings_cache_key,
+    validate_reading,
+)
+from registry import DeviceRegistry
+from retention import run_retention
+
+logger = logging.getLogger("async_app")
+
+# MQTT packets handled per read of the socket, paho's default of one would starve MQTT behind busy HTTP traffic
+MQTT_READ_PACKETS = 100
+
+# Same topic matching as the Flask MQTT handler, with the topic label of the messages counter
+TOPIC_KINDS = {
+    MQTT_GATEWAY_TOPIC: (GATEWAY_READINGS, TOPIC_MESSAGES["gateway"]),
+    MQTT_TEMPERATURE_TOPIC: (TEMPERATURE_READINGS, TOPIC_MESSAGES["temperature"]),
+}
+
+# Same SQLite tuning as app.py
+database.configure(
+    SQLiteSettings(
+        journal_mode=SQLITE_JOURNAL_MODE,
+        synchronous=SQLITE_SYNCHRONOUS,
+        cache_size_kb=SQLITE_CACHE_SIZE_KB,
+        mmap_size=SQLITE_MMAP_SIZE,
+        busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+    )
+)
+
+
+class AsyncMqttClient:
+    """paho client run by the event loop: the socket is watched with add_reader/add_writer and keepalives are sent
+    by a loop task, so messages are handled on the loop thread.
+
+    Reading pauses while `should_pause()` is true (the ingest queue has no room for another read) until `resume()`
+    returns, leaving the backlog in the socket buffers and at the broker.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, on_message, should_pause, resume):
+        self.loop = loop
+        self._loop_thread = threading.get_ident()
+        self.should_pause = should_pause
+        self.resume = resume
+        self._sock = None
+        self._fd = -1
+        self._misc_task: asyncio.Task | None = None
+        self._reconnect_task: asyncio.Task | None = None
+        self._stopping = False
+
+        self.client = mqtt.Client(client_id=f"mesh-async-app-{os.getpid()}")
+        if MQTT_USERNAME:
+            self.client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        if MQTT_TLS_ENABLED:
+            self.client.tls_set()
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_message = on_message
+        self.client.on_socket_open = lambda client, userdata, sock: self._on_loop(self._watch, sock)
+        self.client.on_socket_close = lambda client, userdata, sock: self._on_loop(self._unwatch, sock)
+        self.client.on_socket_register_write = lambda client, userdata, sock: self._on_loop(self._watch_write, sock)
+        self.client.on_socket_unregister_write = lambda client, userdata, sock: self._on_loop(self._unwatch_write, sock)
+
+    def _on_loop(self, callback, sock) -> None:
+        # Socket callbacks come from the executor thread running connect() too, those hop onto the loop.
+        # On the loop thread they run right away, while paho has not closed the socket yet
+        if self._loop_thread == threading.get_ident():
+            callback(sock)
+        else:
+            self.loop.call_soon_threadsafe(callback, sock)
+
+    ### Socket callbacks ###
+    def _watch(self, sock) -> None:
+        self._sock, self._fd = sock, sock.fileno()
+        self.loop.add_reader(self._fd, self._read)
+        if self._misc_task is None or self._misc_task.done():
+            self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _unwatch(self, sock) -> None:
+        if sock is self._sock:
+            self.loop.remove_reader(self._fd)
+            self.loop.remove_writer(self._fd)
+            self._sock = None
+
+    def _watch_write(self, sock) -> None:
+        if sock is self._sock:
+            self.loop.add_writer(self._fd, self.client.loop_write)
+
+    def _unwatch_write(self, sock) -> None:
+        if sock is self._sock:
+            self.loop.remove_writer(self._fd)
+
+    def _read(self) -> None:
+        self.client.loop_read(MQTT_READ_PACKETS)
+        if self._sock is not None and self.should_pause():
+            self.loop.remove_reader(self._fd)
+            self.loop.create_task(self._resume_reading(self._sock))
+
+    async def _resume_reading(self, sock) -> None:
+        await self.resume()
+        if sock is self._sock:
+            self.loop.add_reader(self._fd, self._read)
+
+    async def _misc_loop(self) -> None:
+        # Keepalive pings and timeouts, what paho's loop() does besides reading and writing
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    ### Connection ###
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            logger.error(f"Bad connection to MQTT broker. Code: {rc}")
+            return
+        logger.info("Connected successfully")
+        if not MQTT_SUBSCRIBE_IN_WEB:
+            logger.info("Not subscribing to readings topics, MQTT_SUBSCRIBE_IN_WEB is off")
+            return
+        client.subscribe(f"{MQTT_GATEWAY_TOPIC}/#")
+        client.subscribe(f"{MQTT_TEMPERATURE_TOPIC}/#")
+        logger.info(f"Subscribed to topics: {MQTT_GATEWAY_TOPIC}/# and {MQTT_TEMPERATURE_TOPIC}/#")
+
+    def _on_disconnect(self, client, userdata, rc):
+        if rc != mqtt.MQTT_ERR_SUCCESS and not self._stopping:
+            logger.warning(f"Lost MQTT connection ({mqtt.error_string(rc)}), reconnecting")
+            if self._reconnect_task is None or self._reconnect_task.done():
+                self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        # Subscriptions are made again by on_connect
+        delay = 1.0
+        while not self._stopping:
+            try:
+                await self.loop.run_in_executor(None, self.client.reconnect)
+                return
+            except OSError as e:
+                logger.error(f"MQTT reconnect failed: {e}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+
+    async def connect(self) -> None:
+        # Long keepalive as in consumer.py, under load the PINGRESP waits behind a backlog of readings
+        try:
+            await self.loop.run_in_executor(
+                None, self.client.connect, MQTT_BROKER_URL, MQTT_BROKER_PORT, MQTT_CONSUMER_KEEPALIVE
+            )
+        except OSError as e:
+            logger.error(f"Could not connect to MQTT broker: {e}, retrying in the background")
+            self._reconnect_task = self.loop.create_task(self._reconnect())
+
+    async def disconnect(self) -> None:
+        self._stopping = True
+        for task in (self._reconnect_task, self._misc_task):
+            if task is not None:
+                task.cancel()
+        self.client.disconnect()
+
+
+###### Shared state, created on startup ######
+registry_key = web.AppKey("registry", DeviceRegistry)
+read_pool_key = web.AppKey("read_pool", ConnectionPool)
+read_executor_key = web.AppKey("read_executor", ThreadPoolExecutor)
+ingest_queue_key = web.AppKey("ingest_queue", AsyncIngestQueue)
+readings_hub_key = web.AppKey("readings_hub", ReadingsHub)
+response_cache_key = web.AppKey("response_cache", ResponseCache)
+live_streams_key = web.AppKey("live_streams", set)  # handler tasks of the open live streams
+
+
+async def run_read(app: web.Application, func, *args):
+    # Blocking SQLite reads on the executor, each with a pooled read-only connection
+    def call():
+        db = app[read_pool_key].acquire()
+        try:
+            return func(db, *args)
+        finally:
+            app[read_pool_key].release(db)
+
+    return await asyncio.get_running_loop().run_in_executor(app[read_executor_key], call)
+
+
+def is_cached(registry: DeviceRegistry, data: dict) -> bool:
+    mac_address = data.get("macAddress")
+    return isinstance(mac_address, str) and registry.is_cached(mac_address)
+
+
+async def validate(
+    app: web.Application, kind: ReadingKind, data: dict, received_time: str | None = None
+) -> tuple[tuple | None, str | None]:
+    # Devices known to the registry are validated in place, unknown MACs may need a db lookup on the executor
+    registry = app[registry_key]
+    if is_cached(registry, data):
+        return validate_reading(kind, data, registry, received_time)
+    return await asyncio.get_running_loop().run_in_executor(
+        app[read_executor_key], validate_reading, kind, data, registry, received_time
+    )
+
+
+def text_response(body: str) -> web.Response:
+    # Flask serves the str returned by its views as text/html with a 200 status, statusCode is in the body
+    return web.Response(text=body, content_type="text/html")
+
+
+###### MQTT ######
+def mqtt_message_handler(app: web.Application):
+    loop = asyncio.get_running_loop()
+    ingest_queue = app[ingest_queue_key]
+
+    def enqueue(kind: ReadingKind, row: tuple | None, error: str | None) -> None:
+        if error:
+            if message_log.enabled(logger):
+                logger.info(f"Processed message with db operation: {error}")
+            return
+        start = time.perf_counter()
+        queued = ingest_queue.put_nowait(kind.table, *row)
+        ENQUEUE_SECONDS.observe(time.perf_counter() - start)
+        if not queued:
+            logger.error(f"Ingest queue full, dropped reading of device_id={row[0]}")
+
+    async def validate_and_enqueue(kind: ReadingKind, data: dict, received_time: str) -> None:
+        enqueue(kind, *await validate(app, kind, data, received_time))
+
+    def enqueue_frame(kind: ReadingKind, frame: list) -> None:
+        def lookup_device_id(mac_address: str) -> int | None:
+            device = app[registry_key].lookup(mac_address, kind.device_type)
+            return device.id if device is not None else None
+
+        # FIX: No real time clock in gateway for now, readings without a timestamp get the received time
+        rows, rejected = frame_rows(frame, lookup_device_id, received_timestamp())
+        if rejected and message_log.enabled(logger):
+            logger.info(f"Rejected {rejected} readings of unknown devices in binary frame")
+        for row in rows:
+            enqueue(kind, row, None)
+
+    async def lookup_and_enqueue_frame(kind: ReadingKind, frame: list) -> None:
+        # Unknown MACs are looked up in the db on the executor, then found in the registry
+        registry = app[registry_key]
+        for mac_address in frame_macs(frame):
+            if not registry.is_cached(mac_address):
+                await loop.run_in_executor(app[read_executor_key], registry.lookup, mac_address)
+        enqueue_frame(kind, frame)
+
+    def handle_frame(kind: ReadingKind, payload: bytes) -> None:
+        # Binary frame of many readings relayed by one gateway, see payloads.py
+        start = time.perf_counter()
+        try:
+            frame = decode_frame(payload, kind.table)
+        except ValueError as e:
+            REJECTED["invalid_payload"].inc()
+            logger.error(f"Failed to decode binary frame: {e}")
+            return
+        PARSE_SECONDS.observe(time.perf_counter() - start)
+        if all(app[registry_key].is_cached(mac_address) for mac_address in frame_macs(frame)):
+            enqueue_frame(kind, frame)
+        else:
+            loop.create_task(lookup_and_enqueue_frame(kind, frame))
+
+    def handle_mqtt_message(client, userdata, message):
+        try:
+            for topic, (kind, messages_counter) in TOPIC_KINDS.items():
+                if topic in message.topic:
+                    break
+            else:
+                TOPIC_MESSAGES["unknown"].inc()
+                REJECTED["unknown_topic"].inc()
+                logger.warning(f"Not processing topic {message.topic}")
+                return
+            messages_counter.inc()
+            if is_binary(message):
+                handle_frame(kind, message.payload)
+                return
+            start = time.perf_counter()
+            data = json.loads(message.payload)
+            PARSE_SECONDS.observe(time.perf_counter() - start)
+            # FIX: No real time clock in gateway for now, received time as timestamp unless the device sent its own
+            received_time = received_timestamp()
+            if is_cached(app[registry_key], data):
+                enqueue(kind, *validate_reading(kind, data, app[registry_key], received_time))
+            else:
+                loop.create_task(validate_and_enqueue(kind, data, received_time))
+        except (UnicodeDecodeError, json.JSONDecodeError):
+            REJECTED["invalid_payload"].inc()
+            logger.error(f"Failed to parse JSON payload from: {message.payload}")
+        except Exception:
+            logger.exception("Error processing MQTT message")
+
+    return handle_mqtt_message
+
+
+###### Routes ######
+routes = web.RouteTableDef()
+
+
+@routes.get("/api/devices")
+async def devices_handler(request: web.Request) -> web.Response:
+    # Filter by internal_id
+    internal_ids = request.query.get("internal_id", "")
+    internal_ids = internal_ids.split(",") if internal_ids else []
+    return text_response(await run_read(request.app, get_devices, internal_ids))
+
+
+async def fleet_handler(request: web.Request, kind: ReadingKind) -> web.Response:
+    # Filter by internal_id, like /api/devices
+    internal_ids = request.query.get("internal_id", "")
+    internal_ids = internal_ids.split(",") if internal_ids else []
+    return text_response(await run_read(request.app, get_fleet, kind, internal_ids, request.query))
+
+
+@routes.get("/api/gateway-readings/latest")
+async def latest_gateway_readings_handler(request: web.Request) -> web.Response:
+    return await fleet_handler(request, GATEWAY_READINGS)
+
+
+@routes.get("/api/sensor-temperature-readings/latest")
+async def latest_sensor_temp_readings_handler(request: web.Request) -> web.Response:
+    return await fleet_handler(request, TEMPERATURE_READINGS)
+
+
+async def readings_handler(request: web.Request, kind: ReadingKind) -> web.Response:
+    # Same response cache and ETags as the Flask app, cache hits never leave the loop
+    registry = request.app[registry_key]
+    if is_cached(registry, request.query):
+        device_id, error = lookup_device(registry, kind, request.query)
+    else:
+        device_id, error = await asyncio.get_running_loop().run_in_executor(
+            request.app[read_executor_key], lookup_device, registry, kind, request.query
+        )
+    if error is not None:
+        return text_response(error)
+
+    cache = request.app[response_cache_key]
+    key, upper_bound = readings_cache_key(kind, device_id, request.query)
+    cached = cache.get(key)
+    if cached is None:
+        generation = cache.generation(key)
+        body = await run_read(request.app, get_readings, registry, kind, request.query)
+        cached = cache.put(key, body, upper_bound, generation)
+        if cached is None:
+            return text_response(body)
+
+    headers = {"ETag": f'"{cached.etag}"', "Cache-Control": "no-cache"}
+    if any(etag.value in (cached.etag, "*") for etag in request.if_none_match or ()):
+        return web.Response(status=304, headers=headers)
+    return web.Response(text=cached.body, content_type="text/html", headers=headers)
+
+
+async def insert_reading_handler(request: web.Request, kind: ReadingKind) -> web.Response:
+    if request.headers.get("Content-Type") != "application/json":
+        return text_response(json.dumps({"statusCode": 400, "error": "Expected Content-Type: application/json"}))
+    try:
+        data = await request.json()
+    except ValueError:
+        raise web.HTTPBadRequest(text="Failed to decode JSON object") from None
+    if not isinstance(data, dict):
+        raise web.HTTPBadRequest(text="Expected a JSON object")
+
+    row, error = await validate(request.app, kind, data)
+    if error:
+        return text_response(error)
+    start = time.perf_counter()
+    try:
+        queued = await request.app[ingest_queue_key].put(kind.table, *row)
+    except IngestQueueFull as e:
+        return text_response(json.dumps({"statusCode": 503, "error": str(e)}))
+    finally:
+        ENQUEUE_SECONDS.observe(time.perf_counter() - start)
+    if not queued:
+        return text_response(json.dumps({"statusCode": 503, "error": "Ingest queue full, reading dropped"}))
+    return text_response(reading_accepted(row[0]))
+
+
+@routes.get("/api/gateway-readings")
+async def gateway_readings_handler(request: web.Request) -> web.Response:
+    return await readings_handler(request, GATEWAY_READINGS)
+
+
+@routes.get("/api/sensor-temperature-readings")
+async def sensor_temp_readings_handler(request: web.Request) -> web.Response:
+    return await readings_handler(request, TEMPERATURE_READINGS)
+
+
+@routes.post("/api/gateway-readings")
+async def insert_gateway_reading_handler(request: web.Request) -> web.Response:
+    return await insert_reading_handler(request, GATEWAY_READINGS)
+
+
+@routes.post("/api/sensor-temperature-readings")
+async def insert_sensor_temp_reading_handler(request: web.Request) -> web.Response:
+    return await insert_reading_handler(request, TEMPERATURE_READINGS)
+
+
+async def stream_readings_handler(request: web.Request, kind: ReadingKind) -> web.StreamResponse:
+    # Server-Sent Events of a device's readings as they are committed, woken up by the hub on the loop
+    registry = request.app[registry_key]
+    if is_cached(registry, request.query):
+        device_id, error = lookup_device(registry, kind, request.query)
+    else:
+        device_id, error = await asyncio.get_running_loop().run_in_executor(
+            request.app[read_executor_key], lookup_device, registry, kind, request.query
+        )
+    if error is not None:
+        return text_response(error)
+
+    hub = request.app[readings_hub_key]
+    wakeup = asyncio.Event()
+    try:
+        subscription = hub.subscribe(kind.table, device_id, wakeup.set)
+    except HubFull as e:
+        return text_response(json.dumps({"statusCode": 503, "error": str(e)}))
+
+    logger.info(f"Streaming live readings of device_id={device_id} from {kind.table}")
+    streams = request.app[live_streams_key]
+    task = asyncio.current_task()
+    streams.add(task)
+    response = web.StreamResponse(
+        headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    try:
+        await response.prepare(request)
+        await response.write(RETRY_EVENT.encode())
+        while True:
+            try:
+                await asyncio.wait_for(wakeup.wait(), LIVE_KEEPALIVE_INTERVAL)
+            except TimeoutError:
+                await response.write(KEEPALIVE_EVENT.encode())
+                continue
+            wakeup.clear()
+            for event in pending_events(subscription):
+                await response.write(event.encode())
+    except ConnectionResetError:
+        pass
+    finally:
+        hub.unsubscribe(subscription)
+        streams.discard(task)
+    return response
+
+
+@routes.get("/api/gateway-readings/stream")
+async def stream_gateway_readings_handler(request: web.Request) -> web.StreamResponse:
+    return await stream_readings_handler(request, GATEWAY_READINGS)
+
+
+@routes.get("/api/sensor-temperature-readings/stream")
+async def stream_sensor_temp_readings_handler(request: web.Request) -> web.StreamResponse:
+    return await stream_readings_handler(request, TEMPERATURE_READINGS)
+
+
+@routes.get("/api/ingest-stats")
+async def ingest_stats_handler(request: web.Request) -> web.Response:
+    return text_response(
+        json.dumps(
+            {
+                "statusCode": 200,
+                "ingest": request.app[ingest_queue_key].stats(),
+                "live": request.app[readings_hub_key].stats(),
+                "responseCache": request.app[response_cache_key].stats(),
+            }
+        )
+    )
+
+
+@routes.get("/metrics")
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(body=REGISTRY.render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+@web.middleware
+async def request_latency_middleware(request: web.Request, handler):
+    # Labelled by route pattern like the Flask app, a live stream is timed until its response ends
+    start = time.perf_counter()
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        HTTP_REQUEST_SECONDS.labels(request.method, route, status).observe(time.perf_counter() - start)
+
+
+###### App lifecycle ######
+async def refresh_registry(app: web.Application) -> None:
+    # Reloaded ahead of its refresh interval, so lookups on the loop never have to hit the db
+    loop = asyncio.get_running_loop()
+    registry = app[registry_key]
+    while True:
+        await asyncio.sleep(registry.refresh_interval / 2)
+        try:
+            await loop.run_in_executor(app[read_executor_key], registry.load)
+        except Exception:
+            logger.exception("Failed to refresh device registry")
+
+
+async def runtime_context(app: web.Application):
+    loop = asyncio.get_running_loop()
+    app[read_executor_key] = ThreadPoolExecutor(max_workers=SQLITE_POOL_SIZE, thread_name_prefix="sqlite-read")
+    app[read_pool_key] = ConnectionPool(DATABASE_PATH, readonly=True, max_idle=SQLITE_POOL_SIZE)
+    app[registry_key] = DeviceRegistry(
+        DATABASE_PATH,
+        refresh_interval=DEVICE_REGISTRY_REFRESH_INTERVAL,
+        negative_ttl=DEVICE_REGISTRY_NEGATIVE_TTL,
+    )
+    await loop.run_in_executor(app[read_executor_key], app[registry_key].load)
+    hub = app[readings_hub_key] = ReadingsHub(buffer_size=LIVE_BUFFER_SIZE, max_subscribers=LIVE_MAX_CLIENTS)
+    cache = app[response_cache_key] = ResponseCache(
+        max_bytes=int(RESPONSE_CACHE_MAX_MB * 1024 * 1024),
+        open_ttl=None if MQTT_SUBSCRIBE_IN_WEB else RESPONSE_CACHE_OPEN_TTL,
+    )
+
+    def readings_committed(batch: list[tuple]) -> None:
+        cache.invalidate(batch)
+        hub.publish(batch)
+
+    def run_maintenance(db) -> None:
+        run_retention(db)
+        cache.clear()
+
+    app[live_streams_key] = set()
+    ingest_queue = app[ingest_queue_key] = AsyncIngestQueue(
+        DATABASE_PATH,
+        max_batch=INGEST_MAX_BATCH,
+        flush_interval=INGEST_FLUSH_INTERVAL,
+        max_size=INGEST_QUEUE_SIZE,
+        full_policy=INGEST_FULL_POLICY,
+        block_timeout=INGEST_BLOCK_TIMEOUT,
+        maintenance=run_maintenance,
+        maintenance_interval=RETENTION_CHECK_INTERVAL,
+        on_commit=readings_committed,
+    )
+    ingest_queue.start()
+    INGEST_QUEUE_DEPTH.set_function(lambda: ingest_queue.depth)
+    LIVE_SUBSCRIBERS.set_function(lambda: hub.stats()["subscribers"])
+    refresh_task = loop.create_task(refresh_registry(app))
+
+    # With the drop policy readings keep flowing and are counted as dropped, like the Flask app
+    mqtt_client = AsyncMqttClient(
+        loop,
+        mqtt_message_handler(app),
+        should_pause=lambda: ingest_queue.full_policy == "block" and ingest_queue.room() < MQTT_READ_PACKETS,
+        resume=lambda: ingest_queue.wait_for_room(MQTT_READ_PACKETS),
+    )
+    await mqtt_client.connect()
+
+    yield
+
+    await mqtt_client.disconnect()
+    refresh_task.cancel()
+    await ingest_queue.stop()
+    app[read_executor_key].shutdown(wait=True)
+    app[read_pool_key].close()
+    logger.info(f"Async app stopped: {ingest_queue.stats()}")
+
+
+async def close_live_streams(app: web.Application) -> None:
+    # Live streams never end on their own, shutdown would otherwise wait for them until its timeout
+    for task in list(app[live_streams_key]):
+        task.cancel()
+
+
+def create_app() -> web.Application:
+    metrics.configure(enabled=METRICS_ENABLED, log_sample_rate=LOG_MESSAGE_SAMPLE_RATE)
+    app = web.Application(middlewares=[request_latency_middleware])
+    app.add_routes(routes)
+    app.cleanup_ctx.append(runtime_context)
+    app.on_shutdown.append(close_live_streams)
+    return app
+
+
+def main():
+    logging.basicConfig(
+        level=getattr(logging, LOG_LEVEL),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S",
+    )
+    migrate(DATABASE_PATH)
+    web.run_app(create_app(), host=HOST_URL, port=PORT)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+"""Flask (`flask run`, a thread per connection) against the asyncio runtime (`async_app.py`) under many concurrent
+dashboard clients polling readings pages, optionally while MQTT readings are being ingested.
+
+python -m benchmarks.bench_async_server --clients 50 500 2000 --duration 10 --mqtt-rate 2000
+
+Needs aiohttp (the 'async' extra) for both the async runtime and the load generating clients. Each runtime is
+started on a fresh copy of the seeded db, with benchmarks.fake_broker as MQTT broker.
+"""
+
+import argparse
+import asyncio
+import random
+import shutil
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import aiohttp
+
+from benchmarks.common import APP_DIR, RUNTIMES, add_devices, create_db, free_port, report, seed_readings, start_server
+from benchmarks.mqtt_loadgen import count_readings, publish, sensor_macs
+from migrations import migrate
+
+
+def proc_status(pid: int) -> dict:
+    # Threads and resident memory of the server process
+    status = {}
+    for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+        key, _, value = line.partition(":")
+        if key in ("Threads", "VmRSS"):
+            status[key] = int(value.split()[0])
+    return status
+
+
+async def poll_readings(url: str, macs: list[str], n_clients: int, duration: float, limit: int) -> dict:
+    # Every client is its own keep-alive connection, polling one page after the other
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def client(session: aiohttp.ClientSession) -> None:
+        nonlocal errors
+        while time.monotonic() < deadline:
+            params = {"macAddress": random.choice(macs), "limit": str(limit)}
+            start = time.perf_counter()
+            try:
+                async with session.get(url, params=params) as resp:
+                    body = await resp.read()
+                if resp.status != 200 or not body.startswith(b'{"statusCode": 200'):
+                    errors += 1
+                    continue
+            except (aiohttp.ClientError, TimeoutError):
+                errors += 1
+                continue
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    connector = aiohttp.TCPConnector(limit=n_clients)
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(n_clients)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "requestsPerSec": round(len(latencies) / elapsed),
+        "p50Ms": round(statistics.median(latencies), 2) if latencies else None,
+        "p99Ms": round(latencies[int(len(latencies) * 0.99)], 2) if latencies else None,
+    }
+
+
+def run(args, runtime: str, seeded_db: str, tmp: str, broker_port: int, n_clients: int) -> dict:
+    db_path = str(Path(tmp) / f"{runtime}-{n_clients}.sqlite")
+    shutil.copy(seeded_db, db_path)
+    macs = sensor_macs(db_path)
+    port = free_port()
+    server = start_server(runtime, db_path, port, broker_port)
+    try:
+        before = count_readings(db_path)
+        publisher = None
+        n_messages = int(args.mqtt_rate * args.duration)
+        if n_messages:
+            publisher = threading.Thread(
+                target=publish, args=("127.0.0.1", broker_port, macs, n_messages, args.mqtt_rate), daemon=True
+            )
+            publisher.start()
+
+        # Server threads and memory are sampled halfway through the run, with every client connected
+        sample = {}
+        sampler = threading.Timer(args.duration / 2, lambda: sample.update(proc_status(server.pid)))
+        sampler.start()
+        url = f"http://127.0.0.1:{port}/api/sensor-temperature-readings"
+        result = asyncio.run(poll_readings(url, macs, n_clients, args.duration, args.limit))
+        sampler.join()
+
+        ingested = 0
+        if publisher is not None:
+            publisher.join()
+            # Readings still in flight are given a few more seconds, the rest count as lost
+            deadline = time.monotonic() + 10
+            while ingested < n_messages and time.monotonic() < deadline:
+                time.sleep(0.2)
+                ingested = count_readings(db_path) - before
+    finally:
+        server.send_signal(signal.SIGINT)
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+    return {
+        "runtime": runtime,
+        "clients": n_clients,
+        **result,
+        "mqttPublished": n_messages,
+        "mqttIngested": ingested,
+        "serverThreads": sample.get("Threads"),
+        "serverRssMb": round(sample["VmRSS"] / 1024, 1) if "VmRSS" in sample else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runtimes", nargs="+", choices=list(RUNTIMES), default=list(RUNTIMES))
+    parser.add_argument("--clients", type=int, nargs="+", default=[50, 500], help="concurrent dashboard clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of polling per run")
+    parser.add_argument("--limit", type=int, default=100, help="readings per page")
+    parser.add_argument("--devices", type=int, default=100, help="sensors, each seeded with readings")
+    parser.add_argument("--readings", type=int, default=500_000, help="seeded temperature readings")
+    parser.add_argument("--mqtt-rate", type=float, default=0, help="MQTT readings/s published during the run")
+    args = parser.parse_args()
+
+    results = []
+    broker_port = free_port()
+    broker = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.fake_broker", "--port", str(broker_port)],
+        cwd=APP_DIR,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            seeded_db = str(Path(tmp) / "seeded.sqlite")
+            create_db(seeded_db)
+            add_devices(seeded_db, 0, args.devices)
+            sensor_ids = list(range(4, 4 + args.devices))  # after the 3 project devices
+            seed_readings(seeded_db, "sensor_temperature_readings", args.readings, sensor_ids)
+            migrate(seeded_db)
+            for n_clients in args.clients:
+                for runtime in args.runtimes:
+                    results.append(run(args, runtime, seeded_db, tmp, broker_port, n_clients))
+    finally:
+        broker.terminate()
+
+    report("async_server", results)
+
+
+if __name__ == "__main__":
+    main()
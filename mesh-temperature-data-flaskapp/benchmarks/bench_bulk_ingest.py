@@ -0,0 +1,96 @@
+"""Readings/sec of the bulk ingestion path: body parsing, validation and the single-transaction write.
+
+python -m benchmarks.bench_bulk_ingest --readings 50000 --devices 50
+"""
+
+import argparse
+import json
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import add_devices, create_db, report
+from bulk import parse_bulk_body, validate_readings
+from ingest import IngestQueue
+from migrations import migrate
+from registry import TEMPERATURE, DeviceRegistry
+
+TARGET_READINGS_PER_SEC = 50_000
+
+
+def make_body(n_readings: int, macs: list[str], content_type: str, start: datetime) -> bytes:
+    items = [
+        {
+            "macAddress": macs[i % len(macs)],
+            "timestamp": (start + timedelta(seconds=i // len(macs))).strftime("%Y-%m-%d %H:%M:%S"),
+            "temperature": round(15 + (i % 1000) / 100, 2),
+        }
+        for i in range(n_readings)
+    ]
+    if content_type == "application/json":
+        return json.dumps(items).encode()
+    return "".join(json.dumps(item) + "\n" for item in items).encode()
+
+
+def run(db_path: str, body: bytes, content_type: str, registry: DeviceRegistry) -> dict:
+    ingest_queue = IngestQueue(db_path)
+    ingest_queue.start()
+
+    def lookup_device_id(mac_address: str) -> int | None:
+        device = registry.lookup(mac_address, TEMPERATURE)
+        return device.id if device is not None else None
+
+    try:
+        start = time.perf_counter()
+        items = parse_bulk_body(body, content_type)
+        parsed = time.perf_counter()
+        rows, errors = validate_readings(items, "temperature", float, lookup_device_id)
+        validated = time.perf_counter()
+        ingest_queue.put_many("sensor_temperature_readings", rows)
+        written = time.perf_counter()
+    finally:
+        ingest_queue.stop()
+
+    assert not errors, errors[:5]
+    elapsed = written - start
+    return {
+        "format": content_type.rpartition("/")[2],
+        "readings": len(rows),
+        "parseMs": round((parsed - start) * 1000, 1),
+        "validateMs": round((validated - parsed) * 1000, 1),
+        "writeMs": round((written - validated) * 1000, 1),
+        "readingsPerSec": round(len(rows) / elapsed),
+        "meetsTarget": len(rows) / elapsed >= TARGET_READINGS_PER_SEC,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readings", type=int, default=50_000, help="readings per uploaded body")
+    parser.add_argument("--devices", type=int, default=50, help="sensors the readings are spread over")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        add_devices(db_path, 0, args.devices)
+        migrate(db_path)
+        db = sqlite3.connect(db_path)
+        macs = [row[0] for row in db.execute("SELECT mac_address FROM devices WHERE info LIKE 'BENCH_TEMPERATURE%'")]
+        db.close()
+        registry = DeviceRegistry(db_path)
+        registry.load()
+
+        # Each upload covers a different day so both write into fresh rollup buckets
+        for day, content_type in enumerate(("application/json", "application/x-ndjson")):
+            body = make_body(args.readings, macs, content_type, datetime(2024, 1, 1 + day))
+            results.append(run(db_path, body, content_type, registry))
+
+    report("bulk_ingest", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""Concurrent ingest + read load, rollback journal with a connection per request vs WAL with pooled connections.
+
+python -m benchmarks.bench_concurrency --readers 8 --seconds 10
+"""
+
+import argparse
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import database
+from benchmarks.common import create_db, report, seed_readings
+from database import ConnectionPool, SQLiteSettings
+from migrations import migrate
+from partitions import create_partition
+
+SENSOR_ID = 2  # MESH_TEMPERATURE_SENSOR_1 from init.sql
+BASELINE = SQLiteSettings(journal_mode="DELETE", synchronous="FULL", cache_size_kb=2000, mmap_size=0)
+TUNED = SQLiteSettings()
+# Readers page through the seeded month while the writer appends to a later one, like live ingest vs. history views
+PAGE_QUERY = (
+    "SELECT * FROM sensor_temperature_readings_p202401 WHERE device_id = ? ORDER BY timestamp DESC, id DESC LIMIT 500"
+)
+
+
+def percentile(samples: list[float], pct: float) -> float:
+    return round(statistics.quantiles(samples, n=100)[int(pct) - 1], 3) if len(samples) > 1 else 0.0
+
+
+def run(db_path: str, sqlite_settings: SQLiteSettings, pooled: bool, n_readers: int, seconds: float) -> dict:
+    stop = threading.Event()
+    write_ms, read_ms = [], []
+    errors = {"write": 0, "read": 0}
+    partition = create_partition_for_run(db_path)
+
+    def writer():
+        db = database.connect(db_path, sqlite_settings=sqlite_settings)
+        stmt = f"INSERT INTO {partition} (device_id, timestamp, temperature) VALUES (?, ?, ?)"
+        n = 0
+        while not stop.is_set():
+            rows = [(SENSOR_ID, f"2030-01-01 00:{(n // 60) % 60:02d}:{n % 60:02d}", 20.0) for n in range(n, n + 500)]
+            n += 500
+            start = time.perf_counter()
+            try:
+                with db:
+                    db.executemany(stmt, rows)
+                write_ms.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                errors["write"] += 1
+        db.close()
+
+    pool = ConnectionPool(db_path, readonly=True, max_idle=n_readers) if pooled else None
+
+    def reader():
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                # Baseline mirrors the previous get_db(): a fresh connection per app context
+                if pooled:
+                    db = pool.acquire()
+                else:
+                    db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+                db.execute(PAGE_QUERY, (SENSOR_ID,)).fetchall()
+                pool.release(db) if pooled else db.close()
+                read_ms.append((time.perf_counter() - start) * 1000)
+            except sqlite3.OperationalError:
+                errors["read"] += 1
+
+    previous_settings = database.settings
+    database.configure(sqlite_settings)
+    try:
+        threads = [threading.Thread(target=writer)] + [threading.Thread(target=reader) for _ in range(n_readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        database.configure(previous_settings)
+        if pool is not None:
+            pool.close()
+
+    return {
+        "rowsWrittenPerSec": round(len(write_ms) * 500 / seconds),
+        "writeP50Ms": percentile(write_ms, 50),
+        "writeP99Ms": percentile(write_ms, 99),
+        "readsPerSec": round(len(read_ms) / seconds),
+        "readP50Ms": percentile(read_ms, 50),
+        "readP99Ms": percentile(read_ms, 99),
+        "writeLockErrors": errors["write"],
+        "readLockErrors": errors["read"],
+    }
+
+
+def create_partition_for_run(db_path: str) -> str:
+    db = sqlite3.connect(db_path)
+    with db:
+        name = create_partition(db, "sensor_temperature_readings", "2030-01")
+    db.close()
+    return name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, sqlite_settings, pooled in (("baseline", BASELINE, False), ("tuned", TUNED, True)):
+            db_path = str(Path(tmp) / f"{name}.sqlite")
+            create_db(db_path)
+            seed_readings(db_path, "sensor_temperature_readings", args.rows, [SENSOR_ID])
+            migrate(db_path)
+            result = run(db_path, sqlite_settings, pooled, args.readers, args.seconds)
+            results.append({"mode": name, "readers": args.readers, **result})
+
+    report("concurrency", results)
+
+
+if __name__ == "__main__":
+    main()
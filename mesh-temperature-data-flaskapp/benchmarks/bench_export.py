@@ -0,0 +1,100 @@
+"""Peak RSS and throughput of the streaming readings export against json.dumps of the full list.
+
+python -m benchmarks.bench_export --rows 2000000
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sqlite3
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+from benchmarks.common import create_db, report, seed_readings
+from export import iter_csv, iter_gzip, iter_ndjson, iter_readings_rows
+from migrations import migrate
+from partitions import partitions_for_range
+
+SENSOR_ID = 2  # MESH_TEMPERATURE_SENSOR_1 from init.sql
+
+
+def run_full_list(db_path: str) -> int:
+    # Previous get_sensor_temp_readings path: fetchall, dict per row, strftime per datetime, json.dumps of everything
+    db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    rows = []
+    for partition in reversed(partitions_for_range(db, "sensor_temperature_readings")):
+        rows.extend(
+            db.execute(
+                f"SELECT * FROM {partition} WHERE device_id = ? ORDER BY timestamp DESC", (SENSOR_ID,)
+            ).fetchall()
+        )
+    readings = [
+        {k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v for k, v in dict(row).items()}
+        for row in rows
+    ]
+    return len(json.dumps({"statusCode": 200, "sensorTemperatureReadings": readings}))
+
+
+def run_stream(db_path: str, export_format: str, gzip: bool = False) -> int:
+    chunks = iter_readings_rows(db_path, "sensor_temperature_readings", "temperature", [SENSOR_ID])
+    macs = {SENSOR_ID: "40:91:51:CB:A4:64"}
+    body = iter_csv(chunks, "temperature", macs) if export_format == "csv" else iter_ndjson(chunks, "temperature", macs)
+    if gzip:
+        return sum(len(chunk) for chunk in iter_gzip(body))
+    return sum(len(chunk) for chunk in body)
+
+
+def child(mode: str, db_path: str, conn) -> None:
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if mode == "full_list":
+        n_bytes = run_full_list(db_path)
+    else:
+        export_format, _, gzip = mode.partition("+")
+        n_bytes = run_stream(db_path, export_format, gzip=bool(gzip))
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((elapsed, n_bytes, (rss_after - rss_before) / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    args = parser.parse_args()
+
+    # Fresh interpreter per run so peak RSS of one mode does not leak into the next
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        for n_rows in args.rows:
+            create_db(db_path)
+            seed_readings(db_path, "sensor_temperature_readings", n_rows, [SENSOR_ID])
+            # Brings the seeded readings into the partitioned layout the export reads from
+            migrate(db_path)
+            for mode in ("full_list", "ndjson", "csv", "ndjson+gzip"):
+                parent_conn, child_conn = ctx.Pipe()
+                proc = ctx.Process(target=child, args=(mode, db_path, child_conn))
+                proc.start()
+                elapsed, n_bytes, peak_rss_mb = parent_conn.recv()
+                proc.join()
+                results.append(
+                    {
+                        "rows": n_rows,
+                        "mode": mode,
+                        "seconds": round(elapsed, 3),
+                        "rowsPerSec": round(n_rows / elapsed),
+                        "bytes": n_bytes,
+                        "peakRssDeltaMb": round(peak_rss_mb, 1),
+                    }
+                )
+
+    report("export", results)
+
+
+if __name__ == "__main__":
+    main()
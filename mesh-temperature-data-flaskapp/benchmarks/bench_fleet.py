@@ -0,0 +1,60 @@
+"""Cost of a fleet overview: one readings request per sensor against the /latest fleet query.
+
+python -m benchmarks.bench_fleet --sensors 500 --days 7 --window 3600 86400
+
+Seeds a fleet with a reading every `--interval` seconds, then builds the overview of all sensors the old way (the
+latest readings page of each MAC, as dashboards called `/api/sensor-temperature-readings`) and with `get_fleet`,
+plain and with stats over each `--window`. Steps of the views without HTTP.
+"""
+
+import argparse
+import functools
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import create_db, report, seed_fleet, timeit
+from readings import TEMPERATURE_READINGS, get_fleet, get_readings
+from registry import DeviceRegistry
+
+
+def per_device_overview(db, registry: DeviceRegistry, macs: list[str]) -> None:
+    for mac in macs:
+        get_readings(db, registry, TEMPERATURE_READINGS, {"macAddress": mac, "limit": "1"})
+
+
+def fleet_overview(db, args: dict) -> None:
+    get_fleet(db, TEMPERATURE_READINGS, [], args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=500)
+    parser.add_argument("--days", type=float, default=7, help="days of readings seeded, up to now")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between the readings of a sensor")
+    parser.add_argument("--window", type=int, nargs="+", default=[3600, 86400], help="stats windows in seconds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        seed_fleet(db_path, 0, args.sensors, args.days / 30, args.interval)
+        registry = DeviceRegistry(db_path)
+        registry.load()
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        macs = [f"BB:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(args.sensors)]
+
+        cases = {"per_device": functools.partial(per_device_overview, db, registry, macs)}
+        cases["fleet"] = functools.partial(fleet_overview, db, {})
+        for window in args.window:
+            cases[f"fleet/window={window}"] = functools.partial(fleet_overview, db, {"window": str(window)})
+        for query, func in cases.items():
+            results.append({"query": query, "sensors": args.sensors, **timeit(func, args.repeat)})
+        db.close()
+    report("fleet", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""Latency of recent-range aggregations from the hot window against SQLite, and the window's memory per device.
+
+python -m benchmarks.bench_hot_window --sensors 100 --days 2 --interval 30 --window 1024 --hours 1 3 6
+
+Seeds a fleet with a reading every `--interval` seconds, warms a HotWindow from the db like the ingest writer does,
+then aggregates the last `--hours` of random sensors into ~1000 buckets and with LTTB, as the aggregate endpoint does
+for both sources.
+"""
+
+import argparse
+import functools
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from aggregation import (
+    aggregate_buckets,
+    aggregate_series_buckets,
+    bucket_seconds_for_points,
+    downsample_lttb,
+    downsample_series_lttb,
+    get_epoch_range,
+    series_epoch_range,
+)
+from benchmarks.common import bench_device_ids, create_db, report, seed_fleet, timeit
+from window import HotWindow
+
+TABLE, VALUE_COL = "sensor_temperature_readings", "temperature"
+POINTS = 1000
+
+
+def db_buckets(db, device_ids: list[int], readings_from: str) -> None:
+    epoch_range = get_epoch_range(db, TABLE, device_ids, readings_from, None)
+    if epoch_range:
+        aggregate_buckets(
+            db, TABLE, VALUE_COL, device_ids, readings_from, None, bucket_seconds_for_points(epoch_range, POINTS)
+        )
+
+
+def window_buckets(window: HotWindow, device_ids: list[int], readings_from: str) -> None:
+    series = window.series(TABLE, device_ids, readings_from, None)
+    if series is None:
+        raise RuntimeError(f"Hot window does not hold all readings since {readings_from}, raise --window")
+    epoch_range = series_epoch_range(series)
+    if epoch_range:
+        aggregate_series_buckets(series, bucket_seconds_for_points(epoch_range, POINTS))
+
+
+def window_lttb(window: HotWindow, device_ids: list[int], readings_from: str) -> None:
+    downsample_series_lttb(window.series(TABLE, device_ids, readings_from, None), VALUE_COL, POINTS)
+
+
+def db_lttb(db, device_ids: list[int], readings_from: str) -> None:
+    downsample_lttb(db, TABLE, VALUE_COL, device_ids, readings_from, None, POINTS)
+
+
+def run_queries(query, source, picks: list[list[int]], readings_from: str) -> None:
+    for device_ids in picks:
+        query(source, device_ids, readings_from)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--days", type=float, default=2, help="days of readings seeded, up to now")
+    parser.add_argument("--interval", type=int, default=30, help="seconds between the readings of a sensor")
+    parser.add_argument("--window", type=int, default=1024, help="HOT_WINDOW_SIZE, readings kept per device")
+    parser.add_argument("--hours", type=float, nargs="+", default=[1, 3, 6])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        seed_fleet(db_path, 0, args.sensors, args.days / 30, args.interval)
+        device_ids = bench_device_ids(db_path, "BENCH_TEMPERATURE")
+        db = sqlite3.connect(db_path, check_same_thread=False)
+
+        window = HotWindow(args.window)
+        warm = timeit(functools.partial(window.warm, db), 1)
+        stats = window.stats()
+        results.append(
+            {
+                "query": "warm",
+                "devices": stats["devices"],
+                "readings": stats["readings"],
+                "bytesPerDevice": round(stats["bytes"] / max(stats["devices"], 1)),
+                **warm,
+            }
+        )
+
+        cases = {
+            "buckets/db": (db_buckets, db),
+            "buckets/window": (window_buckets, window),
+            "lttb/db": (db_lttb, db),
+            "lttb/window": (window_lttb, window),
+        }
+        for hours in args.hours:
+            readings_from = (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+            picks = [[random.choice(device_ids)] for _ in range(args.queries)]
+            for query, (func, source) in cases.items():
+                timing = timeit(functools.partial(run_queries, func, source, picks, readings_from), args.repeat)
+                results.append(
+                    {
+                        "query": query,
+                        "hours": hours,
+                        "readingsPerQuery": round(hours * 3600 / args.interval),
+                        "usPerQuery": round(timing["medianMs"] * 1000 / args.queries, 1),
+                        **timing,
+                    }
+                )
+        db.close()
+    report("hot_window", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Fan-out of committed readings through the live readings hub to many subscribed clients.
+
+python -m benchmarks.bench_hub_fanout --clients 1000 --devices 1 10 100 --rate 100
+
+Clients are spread evenly over the devices, every published batch has one reading per device. 'threads' drains an
+EventStream per client thread like the Flask app, 'asyncio' an asyncio.Event per client task like async_app.py.
+Measures the hub only (publish cost and wake up to drained events), not writing to sockets.
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from benchmarks.common import report
+from hub import EventStream, ReadingsHub, pending_events
+
+TABLE = "gateway_readings"
+
+
+def make_batch(index: int, n_devices: int) -> list[tuple]:
+    # The value carries the batch index, for the delivery latency
+    return [(TABLE, (device_id, "2026-01-01 00:00:00", index)) for device_id in range(1, n_devices + 1)]
+
+
+def last_batch_index(chunk: str) -> int:
+    data = chunk.rstrip("\n").rpartition("data: ")[2]
+    return json.loads(data)[-1]["rssi"]
+
+
+class Client:
+    __slots__ = ("dropped", "events", "last_index", "latencies")
+
+    def __init__(self):
+        self.events = 0
+        self.dropped = 0
+        self.last_index = -1
+        self.latencies = []
+
+    def received(self, chunks: list[str], published_at: list[float]) -> None:
+        now = time.perf_counter()
+        for chunk in chunks:
+            if chunk.startswith("event: lagged"):
+                self.dropped += json.loads(chunk.split("data: ", 1)[1].split("\n", 1)[0])["dropped"]
+                continue
+            self.events += chunk.count("event: readings")
+            self.last_index = last_batch_index(chunk)
+            self.latencies.append((now - published_at[self.last_index]) * 1000)
+
+
+def run_threads(args, n_devices: int) -> tuple[list[Client], list[float], float]:
+    hub = ReadingsHub(buffer_size=args.buffer_size, max_subscribers=args.clients)
+    published_at, publish_us = [], []
+    clients = [Client() for _ in range(args.clients)]
+    stop = threading.Event()
+
+    def consume(client: Client, stream: EventStream) -> None:
+        for chunk in stream:
+            if stop.is_set():
+                break
+            if chunk.startswith("event:"):
+                client.received([chunk], published_at)
+        stream.close()
+
+    threads = []
+    for i, client in enumerate(clients):
+        stream = EventStream(hub, TABLE, i % n_devices + 1, keepalive_interval=0.2)
+        threads.append(threading.Thread(target=consume, args=(client, stream), daemon=True))
+    for thread in threads:
+        thread.start()
+
+    start = time.perf_counter()
+    for index in range(args.batches):
+        batch = make_batch(index, n_devices)
+        published_at.append(time.perf_counter())
+        hub.publish(batch)
+        publish_us.append((time.perf_counter() - published_at[-1]) * 1e6)
+        ahead = (index + 1) / args.rate - (time.perf_counter() - start)
+        if ahead > 0:
+            time.sleep(ahead)
+    wait_for_last(clients, args.batches)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return clients, publish_us, elapsed
+
+
+def run_asyncio(args, n_devices: int) -> tuple[list[Client], list[float], float]:
+    async def main():
+        hub = ReadingsHub(buffer_size=args.buffer_size, max_subscribers=args.clients)
+        published_at, publish_us = [], []
+        clients = [Client() for _ in range(args.clients)]
+
+        async def consume(client: Client, device_id: int) -> None:
+            wakeup = asyncio.Event()
+            subscription = hub.subscribe(TABLE, device_id, wakeup.set)
+            try:
+                while True:
+                    await wakeup.wait()
+                    wakeup.clear()
+                    client.received(pending_events(subscription), published_at)
+            finally:
+                hub.unsubscribe(subscription)
+
+        tasks = [asyncio.create_task(consume(client, i % n_devices + 1)) for i, client in enumerate(clients)]
+        await asyncio.sleep(0)
+
+        start = time.perf_counter()
+        for index in range(args.batches):
+            batch = make_batch(index, n_devices)
+            published_at.append(time.perf_counter())
+            hub.publish(batch)
+            publish_us.append((time.perf_counter() - published_at[-1]) * 1e6)
+            # Yielding to the loop hands the events to the clients, like the ingest writer between commits
+            await asyncio.sleep(max(0.0, (index + 1) / args.rate - (time.perf_counter() - start)))
+        while not all(client.last_index == args.batches - 1 for client in clients):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        return clients, publish_us, elapsed
+
+    return asyncio.run(main())
+
+
+def wait_for_last(clients: list[Client], n_batches: int, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(client.last_index == n_batches - 1 for client in clients):
+            return
+        time.sleep(0.01)
+
+
+MODES = {"threads": run_threads, "asyncio": run_asyncio}
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def run(args, mode: str, n_devices: int) -> dict:
+    clients, publish_us, elapsed = MODES[mode](args, n_devices)
+    latencies = [latency for client in clients for latency in client.latencies]
+    expected = args.batches * args.clients
+    received = sum(client.events for client in clients)
+    return {
+        "mode": mode,
+        "clients": args.clients,
+        "devices": n_devices,
+        "batches": args.batches,
+        "publishP50Us": round(statistics.median(publish_us), 1),
+        "publishP99Us": round(percentile(publish_us, 0.99), 1),
+        "deliveryP50Ms": round(percentile(latencies, 0.5), 3) if latencies else None,
+        "deliveryP99Ms": round(percentile(latencies, 0.99), 3) if latencies else None,
+        "eventsExpected": expected,
+        "eventsReceived": received,
+        "eventsDropped": sum(client.dropped for client in clients),
+        "elapsedS": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+    parser.add_argument("--clients", type=int, default=1000, help="subscribed clients")
+    parser.add_argument("--devices", type=int, nargs="+", default=[1, 100], help="devices the clients watch")
+    parser.add_argument("--batches", type=int, default=500, help="committed batches published")
+    parser.add_argument("--rate", type=float, default=100, help="batches/s")
+    parser.add_argument("--buffer-size", type=int, default=256, help="events buffered per client")
+    args = parser.parse_args()
+
+    results = []
+    for n_devices in args.devices:
+        for mode in args.modes:
+            results.append(run(args, mode, n_devices))
+    report("hub_fanout", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Readings query latency before/after the (device_id, timestamp) covering indexes (migration 1).
+
+python -m benchmarks.bench_indexes --rows 1000000 10000000 50000000
+"""
+
+import argparse
+import sqlite3
+import tempfile
+from pathlib import Path
+
+from benchmarks.common import add_devices, create_db, report, seed_readings, timeit
+from migrations import migrate
+
+QUERIES = {
+    "last_day": (
+        "SELECT * FROM sensor_temperature_readings WHERE device_id = ? AND timestamp >= ? ORDER BY timestamp DESC",
+        lambda end: (end - 86400,),
+    ),
+    "last_week": (
+        (
+            "SELECT * FROM sensor_temperature_readings "
+            "WHERE device_id = ? AND timestamp >= ? AND timestamp <= ? ORDER BY timestamp DESC"
+        ),
+        lambda end: (end - 7 * 86400, end),
+    ),
+    "all": ("SELECT * FROM sensor_temperature_readings WHERE device_id = ? ORDER BY timestamp DESC", lambda end: ()),
+}
+
+
+def run_queries(db_path: Path, device_id: int, end_epoch: int, repeat: int) -> dict:
+    db = sqlite3.connect(db_path)
+    results = {}
+    for name, (stmt, params) in QUERIES.items():
+        args = [device_id]
+        for epoch in params(end_epoch):
+            args.append(db.execute("SELECT datetime(?, 'unixepoch')", (epoch,)).fetchone()[0])
+        results[name] = timeit(lambda stmt=stmt, args=args: db.execute(stmt, args).fetchall(), repeat)["medianMs"]
+    db.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000])
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = Path(tmp) / "bench.sqlite"
+        for n_rows in args.rows:
+            create_db(db_path)
+            add_devices(db_path, 0, args.sensors)
+            db = sqlite3.connect(db_path)
+            device_ids = [row[0] for row in db.execute("SELECT id FROM devices WHERE info LIKE '%TEMPERATURE%'")]
+            db.close()
+            seed_readings(db_path, "sensor_temperature_readings", n_rows, device_ids)
+
+            db = sqlite3.connect(db_path)
+            end_epoch = db.execute(
+                "SELECT CAST(strftime('%s', MAX(timestamp)) AS INTEGER) FROM sensor_temperature_readings"
+            ).fetchone()[0]
+            db.close()
+
+            before = run_queries(db_path, device_ids[0], end_epoch, args.repeat)
+            migrate(str(db_path), target_version=1)
+            after = run_queries(db_path, device_ids[0], end_epoch, args.repeat)
+            for query in QUERIES:
+                results.append({"rows": n_rows, "query": query, "beforeMs": before[query], "afterMs": after[query]})
+
+    report("indexes", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Per-message cost of the metrics and of the per-message INFO logs on the MQTT ingest hot path.
+
+python -m benchmarks.bench_metrics --messages 50000 --log-rates 1 0.01 0
+
+Replays JSON gateway readings through the steps of the Flask MQTT handler: parse, device lookup in the registry,
+validation and enqueue on an ingest queue that is not drained to SQLite. Logs are formatted into memory, so the cost
+is the logging itself and not a terminal or a file.
+"""
+
+import argparse
+import io
+import json
+import logging
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import metrics
+from benchmarks.common import create_db, report, timeit
+from ingest import IngestQueue
+from metrics import ENQUEUE_SECONDS, PARSE_SECONDS, TOPIC_MESSAGES, message_log
+from readings import GATEWAY_READINGS, validate_reading
+from registry import DeviceRegistry
+
+GATEWAY_MAC = "3C:E9:0E:72:12:4C"  # project gateway of init.sql
+
+logger = logging.getLogger("bench_metrics")
+
+
+def handle_messages(messages: list[bytes], registry: DeviceRegistry, db_path: str) -> None:
+    # Fresh queue per run, nothing is flushed
+    ingest_queue = IngestQueue(db_path, max_size=0)
+    for payload in messages:
+        log_message = message_log.enabled(logger)
+        start = time.perf_counter()
+        payload = payload.decode()
+        if log_message:
+            logger.info(f"Received message with payload={payload}")
+        data = json.loads(payload)
+        PARSE_SECONDS.observe(time.perf_counter() - start)
+
+        TOPIC_MESSAGES["gateway"].inc()
+        data["timestamp"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if log_message:
+            logger.info(data)
+        row, error = validate_reading(GATEWAY_READINGS, data, registry)
+        if error is None:
+            start = time.perf_counter()
+            ingest_queue.put(GATEWAY_READINGS.table, *row)
+            ENQUEUE_SECONDS.observe(time.perf_counter() - start)
+        if log_message:
+            logger.info(f"Processed message with db operation: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=50_000)
+    parser.add_argument("--log-rates", type=float, nargs="+", default=[1, 0.01, 0], help="LOG_MESSAGE_SAMPLE_RATE")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    handler = logging.StreamHandler(io.StringIO())
+    handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    # The readings module logs its lookups the same way as the app
+    logging.getLogger("readings").addHandler(handler)
+    logging.getLogger("readings").setLevel(logging.INFO)
+    logging.getLogger("readings").propagate = False
+
+    messages = [json.dumps({"macAddress": GATEWAY_MAC, "rssi": i % 90 + 10}).encode() for i in range(args.messages)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        registry = DeviceRegistry(db_path)
+        registry.load()
+
+        def run():
+            handler.setStream(io.StringIO())
+            handle_messages(messages, registry, db_path)
+
+        results = []
+        baseline_ms = None
+        for log_rate in sorted(args.log_rates):
+            for enabled in (False, True):
+                metrics.configure(enabled=enabled, log_sample_rate=log_rate)
+                timing = timeit(run, args.repeat)
+                baseline_ms = baseline_ms if baseline_ms is not None else timing["medianMs"]
+                results.append(
+                    {
+                        "metrics": enabled,
+                        "logSampleRate": log_rate,
+                        "messagesPerSec": round(args.messages / timing["medianMs"] * 1000),
+                        "usPerMessage": round(timing["medianMs"] * 1000 / args.messages, 2),
+                        "overheadUsPerMessage": round((timing["medianMs"] - baseline_ms) * 1000 / args.messages, 2),
+                        **timing,
+                    }
+                )
+        metrics.configure()
+    report("metrics", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Bytes on the wire and decode + validate cost of MQTT readings, a JSON message per reading vs binary frames.
+
+python -m benchmarks.bench_payloads --readings 100000 --frame-size 1 10 100
+
+Both paths are the consumer's: json.loads and validate_readings per message, decode_frame and frame_rows per frame.
+"""
+
+import argparse
+import json
+from datetime import datetime
+from functools import partial
+
+from benchmarks.common import report, timeit
+from bulk import validate_readings
+from payloads import decode_frame, encode_frame, frame_rows
+
+TABLE = "sensor_temperature_readings"
+
+
+def make_readings(n_readings: int, n_devices: int) -> list[tuple[str, int, float]]:
+    macs = [f"02:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(n_devices)]
+    return [(macs[i % n_devices], 0, round(15 + (i % 1000) / 100, 2)) for i in range(n_readings)]
+
+
+def decode_json(messages: list[bytes], device_ids: dict[str, int]) -> int:
+    received_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    n_rows = 0
+    for payload in messages:
+        data = json.loads(payload)
+        data["timestamp"] = received_time
+        rows, _ = validate_readings([data], "temperature", float, device_ids.get)
+        n_rows += len(rows)
+    return n_rows
+
+
+def decode_frames(frames: list[bytes], device_ids: dict[str, int]) -> int:
+    received_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    n_rows = 0
+    for payload in frames:
+        rows, _ = frame_rows(decode_frame(payload, TABLE), device_ids.get, received_time)
+        n_rows += len(rows)
+    return n_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=100_000)
+    parser.add_argument("--devices", type=int, default=20, help="devices relayed by the gateway")
+    parser.add_argument("--frame-size", type=int, nargs="+", default=[1, 10, 100], help="readings per binary frame")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings, args.devices)
+    device_ids = {mac: i for i, mac in enumerate(sorted({mac for mac, _, _ in readings}), start=1)}
+
+    messages = [json.dumps({"macAddress": mac, "temperature": value}).encode() for mac, _, value in readings]
+    timing = timeit(partial(decode_json, messages, device_ids), args.repeat)
+    results = [
+        {
+            "format": "json",
+            "frameSize": 1,
+            "messages": len(messages),
+            "bytesPerReading": round(sum(map(len, messages)) / args.readings, 1),
+            "readingsPerSec": round(args.readings / timing["medianMs"] * 1000),
+            **timing,
+        }
+    ]
+    for frame_size in args.frame_size:
+        frames = [encode_frame(TABLE, readings[i : i + frame_size]) for i in range(0, args.readings, frame_size)]
+        assert decode_frames(frames, device_ids) == args.readings
+        timing = timeit(partial(decode_frames, frames, device_ids), args.repeat)
+        results.append(
+            {
+                "format": "binary",
+                "frameSize": frame_size,
+                "messages": len(frames),
+                "bytesPerReading": round(sum(map(len, frames)) / args.readings, 1),
+                "readingsPerSec": round(args.readings / timing["medianMs"] * 1000),
+                **timing,
+            }
+        )
+    report("payloads", results)
+
+
+if __name__ == "__main__":
+    main()
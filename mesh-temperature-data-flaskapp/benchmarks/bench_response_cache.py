@@ -0,0 +1,101 @@
+"""Readings API throughput with and without the response cache, on dashboard-like polling of a seeded fleet.
+
+python -m benchmarks.bench_response_cache --sensors 100 --months 1 --requests 20000 --commit-every 0 50
+
+Requests go through the steps of the Flask readings view (device lookup, cache, db read and serialization), without
+HTTP. Each request is the latest page or one closed day of a random device. With `--commit-every N` a reading of a
+random device is committed and invalidated every N requests, like MQTT ingest does while dashboards poll.
+"""
+
+import argparse
+import functools
+import random
+import sqlite3
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from benchmarks.common import bench_device_ids, create_db, report, seed_fleet, timeit
+from cache import ResponseCache
+from readings import TEMPERATURE_READINGS, get_readings, lookup_device, readings_cache_key
+from registry import DeviceRegistry
+
+
+def make_requests(macs: list[str], n_requests: int, days: int) -> list[dict]:
+    # Half latest pages, half closed days over the seeded range
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    requests = []
+    for i in range(n_requests):
+        args = {"macAddress": random.choice(macs)}
+        if i % 2:
+            day = today - timedelta(days=random.randint(1, days))
+            args["readingsFrom"] = day.strftime("%Y-%m-%d %H:%M:%S")
+            args["readingsTo"] = (day + timedelta(seconds=86399)).strftime("%Y-%m-%d %H:%M:%S")
+        requests.append(args)
+    return requests
+
+
+def serve(db, registry, cache: ResponseCache, requests: list[dict], device_ids: list[int], commit_every: int) -> None:
+    for i, args in enumerate(requests):
+        if commit_every and i % commit_every == 0:
+            # Readings arrive with the current time, only open ranges of the device are dropped
+            now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            cache.invalidate([(TEMPERATURE_READINGS.table, (random.choice(device_ids), now, 20.0))])
+        device_id, error = lookup_device(registry, TEMPERATURE_READINGS, args)
+        if error is not None:
+            raise RuntimeError(error)
+        key, upper_bound = readings_cache_key(TEMPERATURE_READINGS, device_id, args)
+        if cache.get(key) is None:
+            generation = cache.generation(key)
+            body = get_readings(db, registry, TEMPERATURE_READINGS, args)
+            cache.put(key, body, upper_bound, generation)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--months", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=20_000)
+    parser.add_argument("--commit-every", type=int, nargs="+", default=[0, 50], help="requests between commits, 0 none")
+    parser.add_argument("--cache-mb", type=float, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(0)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        seed_fleet(db_path, 0, args.sensors, args.months)
+        device_ids = bench_device_ids(db_path, "BENCH_TEMPERATURE")
+        registry = DeviceRegistry(db_path)
+        registry.load()
+        db = sqlite3.connect(db_path, check_same_thread=False)
+        macs = [f"BB:00:00:00:{i // 256:02X}:{i % 256:02X}" for i in range(args.sensors)]
+        requests = make_requests(macs, args.requests, 30 * args.months - 1)
+
+        for commit_every in args.commit_every:
+            for cache_mb in (0, args.cache_mb):
+                cache = ResponseCache(max_bytes=int(cache_mb * 1024 * 1024))
+                timing = timeit(
+                    functools.partial(serve, db, registry, cache, requests, device_ids, commit_every), args.repeat
+                )
+                stats = cache.stats()
+                lookups = stats["hits"] + stats["misses"]
+                results.append(
+                    {
+                        "cacheMb": cache_mb,
+                        "commitEvery": commit_every,
+                        "requestsPerSec": round(args.requests / timing["medianMs"] * 1000),
+                        "usPerRequest": round(timing["medianMs"] * 1000 / args.requests, 1),
+                        "hitRatio": round(stats["hits"] / lookups, 3) if lookups else 0,
+                        "cachedMb": round(stats["bytes"] / 1024 / 1024, 1),
+                        **timing,
+                    }
+                )
+        db.close()
+    report("response_cache", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Rows/sec of the readings and devices API serialization, sqlite3.Row + dict per row + json.dumps vs tuple rows.
+
+python -m benchmarks.bench_serialization --rows 200000 --limit 10000
+"""
+
+import argparse
+import json
+import sqlite3
+import tempfile
+from datetime import datetime
+from functools import partial
+from pathlib import Path
+
+import database
+from benchmarks.common import add_devices, create_db, report, seed_readings, timeit
+from migrations import migrate
+from partitions import READING_COLUMNS, partitions_for_range
+from serialize import json_response, readings_json, rows_to_dicts
+
+GATEWAY_ID = 1  # NORVI_IIOT_GATEWAY from init.sql
+SENSOR_ID = 2  # MESH_TEMPERATURE_SENSOR_1 from init.sql
+ENDPOINTS = {
+    "/api/gateway-readings": ("gateway_readings", GATEWAY_ID, "gatewayReadings"),
+    "/api/sensor-temperature-readings": ("sensor_temperature_readings", SENSOR_ID, "sensorTemperatureReadings"),
+}
+
+
+def readings_page(db: sqlite3.Connection, table: str, device_id: int, limit: int, columns: str) -> list:
+    rows = []
+    for partition in reversed(partitions_for_range(db, table)):
+        stmt = f"SELECT {columns} FROM {partition} WHERE device_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?"
+        rows.extend(db.execute(stmt, (device_id, limit - len(rows))).fetchall())
+        if len(rows) >= limit:
+            break
+    return rows
+
+
+def baseline_readings(db_path: str, table: str, device_id: int, key: str, limit: int) -> str:
+    # Previous path: declared types parsed, sqlite3.Row, dict per row re-formatting datetimes, json.dumps
+    db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    readings = [
+        {k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v for k, v in dict(row).items()}
+        for row in readings_page(db, table, device_id, limit, "*")
+    ]
+    db.close()
+    return json.dumps({"statusCode": 200, key: readings, "nextCursor": None, "prevCursor": None})
+
+
+def fast_readings(db_path: str, table: str, device_id: int, key: str, limit: int) -> str:
+    value_col, _ = READING_COLUMNS[table]
+    db = database.connect(db_path, readonly=True)
+    rows = readings_page(db, table, device_id, limit, f"id, device_id, timestamp, {value_col}, received_time")
+    db.close()
+    return json_response(
+        {"statusCode": 200, key: readings_json(rows, value_col), "nextCursor": None, "prevCursor": None}
+    )
+
+
+def baseline_devices(db_path: str) -> str:
+    db = sqlite3.connect(db_path, detect_types=sqlite3.PARSE_DECLTYPES)
+    db.row_factory = sqlite3.Row
+    devices = [
+        {k: v.strftime("%Y-%m-%d %H:%M:%S") if isinstance(v, datetime) else v for k, v in dict(row).items()}
+        for row in db.execute("SELECT * FROM devices").fetchall()
+    ]
+    db.close()
+    return json.dumps({"statusCode": 200, "devices": devices})
+
+
+def fast_devices(db_path: str) -> str:
+    db = database.connect(db_path, readonly=True)
+    cur = db.execute("SELECT * FROM devices")
+    devices = rows_to_dicts([col[0] for col in cur.description], cur.fetchall())
+    db.close()
+    return json.dumps({"statusCode": 200, "devices": devices})
+
+
+def measure(endpoint: str, mode: str, fn, n_rows: int, repeat: int) -> dict:
+    timing = timeit(fn, repeat)
+    return {
+        "endpoint": endpoint,
+        "mode": mode,
+        "rows": n_rows,
+        "rowsPerSec": round(n_rows / (timing["medianMs"] / 1000)),
+        **timing,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000, help="readings seeded per readings table")
+    parser.add_argument("--limit", type=int, default=10_000, help="page size of the readings requests")
+    parser.add_argument("--devices", type=int, default=5000, help="extra devices for /api/devices")
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / "bench.sqlite")
+        create_db(db_path)
+        add_devices(db_path, args.devices // 2, args.devices - args.devices // 2)
+        for table, device_id, _ in ENDPOINTS.values():
+            seed_readings(db_path, table, args.rows, [device_id])
+        migrate(db_path)
+
+        for endpoint, (table, device_id, key) in ENDPOINTS.items():
+            call_args = (db_path, table, device_id, key, args.limit)
+            # Both paths must serve byte-identical bodies
+            assert baseline_readings(*call_args) == fast_readings(*call_args), endpoint
+            n_rows = min(args.limit, args.rows)
+            results.append(measure(endpoint, "baseline", partial(baseline_readings, *call_args), n_rows, args.repeat))
+            results.append(measure(endpoint, "fast", partial(fast_readings, *call_args), n_rows, args.repeat))
+
+        assert baseline_devices(db_path) == fast_devices(db_path)
+        n_devices = len(json.loads(fast_devices(db_path))["devices"])
+        results.append(measure("/api/devices", "baseline", partial(baseline_devices, db_path), n_devices, args.repeat))
+        results.append(measure("/api/devices", "fast", partial(fast_devices, db_path), n_devices, args.repeat))
+
+    report("serialization", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+"""Load test of the whole stack: MQTT readings of a seeded fleet replayed at fixed rates, then the readings API
+queried over ranges of growing size.
+
+python -m benchmarks.bench_stack --sensors 100 --months 3 --rates 500 2000 --duration 20 --output stack.json
+python -m benchmarks.bench_stack --db seeded.sqlite --broker mosquitto --ingest consumer --consumer-workers 2
+
+Runs on a copy of `--db` (seed one with benchmarks.seed_db) or on a temporary db seeded with `--gateways`,
+`--sensors` and `--months` of readings. The app is started with `--runtime`; readings are ingested by it, or by
+consumer.py with `--ingest consumer`. The broker is benchmarks.fake_broker, a mosquitto started on a free port, or
+one already running on `--mqtt-port` (`--broker external`).
+
+For every rate, the fleet's sensors publish for `--duration` seconds while a probe sensor publishes a reading every
+`--probe-interval` seconds and polls the db for its row: the publish to committed row latency. Ingest results are
+the readings committed per second and the p50/p99 of that latency, query results the p50/p99 of the readings,
+aggregate and export requests by range.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import random
+import shutil
+import signal
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+from urllib.parse import urlencode
+
+import paho.mqtt.client as mqtt
+
+from benchmarks.common import APP_DIR, RUNTIMES, create_db, free_port, report, seed_fleet, start_server
+from benchmarks.mqtt_loadgen import TABLE, count_readings, publish, sensor_macs, start_consumer
+from config import MQTT_TEMPERATURE_TOPIC
+from partitions import month_of, partition_name
+
+# Readings API queried by range, with the runtimes serving them
+ENDPOINTS = {
+    "readings": ("/api/sensor-temperature-readings", {"flask", "async"}),
+    "aggregate": ("/api/sensor-temperature-readings/aggregate", {"flask"}),
+    "export": ("/api/sensor-temperature-readings/export", {"flask"}),
+}
+RANGES = {"1h": 3600, "1d": 86400, "7d": 7 * 86400, "30d": 30 * 86400, "90d": 90 * 86400}
+
+# Probe readings stand out of the fleet's 15-25 degrees
+PROBE_BASE_VALUE = 1000.0
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * q))], 2)
+
+
+class LatencyProbe:
+    """Publishes a reading of one sensor every `interval` seconds, then polls the db until its row is committed.
+
+    One probe is in flight at a time, the latency from publish to committed row of each is kept in `latencies`.
+    """
+
+    def __init__(self, host: str, port: int, db_path: str, mac_address: str, interval: float, timeout: float = 10):
+        self.host = host
+        self.port = port
+        self.db_path = db_path
+        self.mac_address = mac_address
+        self.interval = interval
+        self.timeout = timeout
+        self.latencies: list[float] = []
+        self.lost = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="latency-probe", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        client = mqtt.Client(client_id=f"mesh-probe-{random.getrandbits(32):08x}")
+        client.connect(self.host, self.port)
+        client.loop_start()
+        db = sqlite3.connect(f"{Path(self.db_path).resolve().as_uri()}?mode=ro", uri=True)
+        device_id = db.execute("SELECT id FROM devices WHERE mac_address = ?", (self.mac_address,)).fetchone()[0]
+        try:
+            index = 0
+            while not self._stop.is_set():
+                value = PROBE_BASE_VALUE + index
+                index += 1
+                # The app stamps JSON readings with their received time, never before the publish second
+                since = (datetime.now() - timedelta(seconds=1)).strftime("%Y-%m-%d %H:%M:%S")
+                published_at = time.perf_counter()
+                payload = json.dumps({"macAddress": self.mac_address, "temperature": value})
+                client.publish(f"{MQTT_TEMPERATURE_TOPIC}/{self.mac_address}", payload)
+                if self._wait_for_row(db, device_id, value, since):
+                    self.latencies.append((time.perf_counter() - published_at) * 1000)
+                else:
+                    self.lost += 1
+                self._stop.wait(max(0.0, self.interval - (time.perf_counter() - published_at)))
+        finally:
+            db.close()
+            client.disconnect()
+            client.loop_stop()
+
+    def _wait_for_row(self, db: sqlite3.Connection, device_id: int, value: float, since: str) -> bool:
+        deadline = time.monotonic() + self.timeout
+        # The reading lands in the partition of the current month, or of the next one around midnight of its last day
+        until = (datetime.now() + timedelta(seconds=self.timeout)).strftime("%Y-%m-%d %H:%M:%S")
+        partitions = {partition_name(TABLE, month_of(since)), partition_name(TABLE, month_of(until))}
+        while time.monotonic() < deadline:
+            for partition in partitions:
+                try:
+                    row = db.execute(
+                        f"SELECT 1 FROM {partition} WHERE device_id = ? AND timestamp >= ? AND temperature = ?",
+                        (device_id, since, value),
+                    ).fetchone()
+                except sqlite3.OperationalError:
+                    # Partition not created yet
+                    row = None
+                if row is not None:
+                    return True
+            time.sleep(0.002)
+        return False
+
+
+def start_broker(args) -> tuple[subprocess.Popen | None, int]:
+    if args.broker == "external":
+        return None, args.mqtt_port
+    port = free_port()
+    if args.broker == "mosquitto":
+        if shutil.which("mosquitto") is None:
+            raise SystemExit("mosquitto not found on PATH, use --broker fake")
+        command = ["mosquitto", "-p", str(port)]
+    else:
+        command = [sys.executable, "-m", "benchmarks.fake_broker", "--port", str(port)]
+    broker = subprocess.Popen(command, cwd=APP_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1)
+    return broker, port
+
+
+def stop_process(process: subprocess.Popen | None) -> None:
+    if process is None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_ingest(args, db_path: str, broker_port: int, rate: float) -> dict:
+    # The last sensor is the probe, the others are the fleet publishing at `rate`
+    *macs, probe_mac = sensor_macs(db_path)
+    n_messages = int(rate * args.duration)
+    per_publisher = n_messages // args.publishers
+    n_messages = per_publisher * args.publishers
+    before = count_readings(db_path)
+
+    probe = LatencyProbe("127.0.0.1", broker_port, db_path, probe_mac, args.probe_interval)
+    probe.start()
+    start = time.perf_counter()
+    publishers = [
+        multiprocessing.Process(
+            target=publish, args=("127.0.0.1", broker_port, macs, per_publisher, rate / args.publishers)
+        )
+        for _ in range(args.publishers)
+    ]
+    for publisher in publishers:
+        publisher.start()
+    for publisher in publishers:
+        publisher.join()
+    published_s = time.perf_counter() - start
+    probe.stop()
+
+    expected = n_messages + len(probe.latencies) + probe.lost
+    committed = 0
+    deadline = time.monotonic() + args.timeout
+    while time.monotonic() < deadline:
+        committed = count_readings(db_path) - before
+        if committed >= expected:
+            break
+        time.sleep(0.05)
+    committed_s = time.perf_counter() - start
+
+    return {
+        "phase": "ingest",
+        "rate": rate,
+        "published": n_messages,
+        "publishPerSec": round(n_messages / published_s),
+        "committed": committed,
+        "lost": max(0, expected - committed),
+        "committedPerSec": round(committed / committed_s),
+        "probes": len(probe.latencies) + probe.lost,
+        "probesLost": probe.lost,
+        "latencyP50Ms": percentile(probe.latencies, 0.5),
+        "latencyP99Ms": percentile(probe.latencies, 0.99),
+        "latencyMaxMs": round(max(probe.latencies), 2) if probe.latencies else None,
+    }
+
+
+def query_params(endpoint: str, mac_address: str, readings_from: datetime, readings_to: datetime, limit: int) -> dict:
+    params = {
+        "macAddress": mac_address,
+        "readingsFrom": readings_from.strftime("%Y-%m-%d %H:%M:%S"),
+        "readingsTo": readings_to.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    if endpoint == "readings":
+        params["limit"] = str(limit)
+    elif endpoint == "export":
+        params["format"] = "ndjson"
+    return params
+
+
+def run_queries(args, port: int, endpoint: str, range_name: str, macs: list[str], end: datetime) -> dict:
+    path, _ = ENDPOINTS[endpoint]
+    readings_from = end - timedelta(seconds=RANGES[range_name])
+    latencies, sizes = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def client(n_requests: int) -> None:
+        # One keep-alive connection per client, requests one after the other
+        nonlocal errors
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=60)
+        try:
+            for _ in range(n_requests):
+                params = query_params(endpoint, random.choice(macs), readings_from, end, args.limit)
+                start = time.perf_counter()
+                try:
+                    conn.request("GET", f"{path}?{urlencode(params)}")
+                    response = conn.getresponse()
+                    body = response.read()
+                except (OSError, http.client.HTTPException):
+                    conn.close()
+                    with lock:
+                        errors += 1
+                    continue
+                elapsed = (time.perf_counter() - start) * 1000
+                # Errors are reported in the body with a 200 status, exports stream rows without a statusCode
+                ok = response.status == 200 and (endpoint == "export" or body.startswith(b'{"statusCode": 200'))
+                with lock:
+                    if ok:
+                        latencies.append(elapsed)
+                        sizes.append(len(body))
+                    else:
+                        errors += 1
+        finally:
+            conn.close()
+
+    per_client = [args.queries // args.clients + (i < args.queries % args.clients) for i in range(args.clients)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as executor:
+        list(executor.map(client, per_client))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "phase": "query",
+        "endpoint": endpoint,
+        "range": range_name,
+        "requests": len(latencies),
+        "errors": errors,
+        "requestsPerSec": round(len(latencies) / elapsed),
+        "p50Ms": percentile(latencies, 0.5),
+        "p99Ms": percentile(latencies, 0.99),
+        "meanKb": round(statistics.mean(sizes) / 1024, 1) if sizes else None,
+    }
+
+
+def run(args, db_path: str, broker_port: int) -> list[dict]:
+    results = []
+    # Queried ranges end now, where the seeded readings end
+    end = datetime.now()
+    port = free_port()
+    env = {"MQTT_SUBSCRIBE_IN_WEB": "False"} if args.ingest == "consumer" else {}
+    server = start_server(args.runtime, db_path, port, broker_port, env)
+    consumer = None
+    try:
+        if args.ingest == "consumer":
+            consumer = start_consumer(db_path, "127.0.0.1", broker_port, args.consumer_workers, "shared")
+        # Time for the MQTT subscriptions
+        time.sleep(3)
+
+        for rate in args.rates:
+            result = run_ingest(args, db_path, broker_port, rate)
+            results.append({"runtime": args.runtime, "ingest": args.ingest, **result})
+
+        macs = sensor_macs(db_path)
+        for endpoint in args.endpoints:
+            if args.runtime not in ENDPOINTS[endpoint][1]:
+                print(f"Skipping {endpoint} queries, not served by the {args.runtime} runtime", file=sys.stderr)
+                continue
+            for range_name in args.ranges:
+                result = run_queries(args, port, endpoint, range_name, macs, end)
+                results.append({"runtime": args.runtime, "ingest": args.ingest, **result})
+    finally:
+        stop_process(consumer)
+        stop_process(server)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", help="seeded db, copied before the run. A temporary one is seeded when omitted")
+    parser.add_argument("--gateways", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--months", type=int, default=3, help="months of readings seeded, up to now")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between the seeded readings of a device")
+    parser.add_argument("--runtime", choices=list(RUNTIMES), default="flask")
+    parser.add_argument("--ingest", choices=("web", "consumer"), default="web", help="process subscribed to readings")
+    parser.add_argument("--consumer-workers", type=int, default=2)
+    parser.add_argument("--broker", choices=("fake", "mosquitto", "external"), default="fake")
+    parser.add_argument("--mqtt-port", type=int, default=1883, help="port of the external broker")
+    parser.add_argument("--rates", type=float, nargs="+", default=[500, 2000], help="published readings/s")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of publishing per rate")
+    parser.add_argument("--publishers", type=int, default=2, help="publishing processes")
+    parser.add_argument("--probe-interval", type=float, default=0.25, help="seconds between latency probes")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for readings to be committed")
+    parser.add_argument("--endpoints", nargs="+", choices=list(ENDPOINTS), default=list(ENDPOINTS))
+    parser.add_argument("--ranges", nargs="+", choices=list(RANGES), default=list(RANGES))
+    parser.add_argument("--queries", type=int, default=200, help="requests per endpoint and range")
+    parser.add_argument("--clients", type=int, default=4, help="concurrent API clients")
+    parser.add_argument("--limit", type=int, default=500, help="readings per page")
+    parser.add_argument("--output", help="also write the JSON results to this file")
+    args = parser.parse_args()
+
+    results = []
+    broker, broker_port = start_broker(args)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = str(Path(tmp) / "stack.sqlite")
+            if args.db:
+                shutil.copy(args.db, db_path)
+            else:
+                create_db(db_path)
+                seed_fleet(db_path, args.gateways, args.sensors, args.months, args.interval)
+            results = run(args, db_path, broker_port)
+    finally:
+        if broker is not None:
+            broker.terminate()
+
+    report("stack", results, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Shared helpers for the benchmark scripts, run them from the flask app directory: `python -m benchmarks.<name>`"""
+
+import json
+import os
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from latest import backfill_latest
+from migrations import migrate
+from partitions import READING_COLUMNS, move_to_partitions
+from rollups import backfill_rollups
+
+APP_DIR = Path(__file__).resolve().parents[1]
+INIT_SQL = Path(__file__).resolve().parents[2] / "sqlite" / "init.sql"
+
+# Server runtimes of the app, command line to serve on a port
+RUNTIMES = {
+    "flask": lambda port: ["flask", "--app", "app", "run", "--host", "127.0.0.1", "--port", str(port)],
+    "async": lambda port: [sys.executable, "async_app.py"],
+}
+
+
+def create_db(db_path: str | Path) -> None:
+    # Fresh db with the baseline schema and the project devices (schema version 0)
+    Path(db_path).unlink(missing_ok=True)
+    db = sqlite3.connect(db_path)
+    db.executescript(INIT_SQL.read_text())
+    db.close()
+
+
+def add_devices(db_path: str | Path, n_gateways: int, n_sensors: int) -> None:
+    db = sqlite3.connect(db_path)
+    with db:
+        for i in range(n_gateways):
+            mac = f"AA:00:00:00:{i // 256:02X}:{i % 256:02X}"
+            db.execute(
+                "INSERT OR IGNORE INTO devices (internal_id, mac_address, chip, info) VALUES (?, ?, 'ESP32-WROOM', ?)",
+                (1000 + i, mac, f"BENCH_GATEWAY_{i}"),
+            )
+        for i in range(n_sensors):
+            mac = f"BB:00:00:00:{i // 256:02X}:{i % 256:02X}"
+            db.execute(
+                "INSERT OR IGNORE INTO devices (internal_id, mac_address, chip, info) "
+                "VALUES (?, ?, 'ESP32-WROOM-32D', ?)",
+                (100000 + i, mac, f"BENCH_TEMPERATURE_SENSOR_{i}"),
+            )
+    db.close()
+
+
+def seed_readings(
+    db_path: str | Path,
+    table: str,
+    n_rows: int,
+    device_ids: list[int],
+    start: str = "2024-01-01 00:00:00",
+    interval_s: int = 10,
+) -> None:
+    """Bulk insert `n_rows` synthetic readings round-robin over `device_ids`, one every `interval_s` per device.
+
+    Generated in SQL with a recursive CTE so 10M+ rows stay practical.
+    """
+    value_col, value_expr = (
+        ("rssi", "abs(random() % 90) + 10")
+        if table == "gateway_readings"
+        else ("temperature", "15.0 + (abs(random() % 1000) / 100.0)")
+    )
+    ids = ",".join(str(i) for i in device_ids)
+    db = sqlite3.connect(db_path)
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    with db:
+        db.execute(f"CREATE TEMP TABLE bench_devices AS SELECT value AS id, key AS k FROM json_each('[{ids}]')")
+        db.execute(
+            f"""
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n < ?)
+            INSERT INTO {table} (device_id, timestamp, {value_col})
+            SELECT d.id,
+                   datetime(?, '+' || ((seq.n / ?) * ?) || ' seconds'),
+                   {value_expr}
+            FROM seq JOIN bench_devices d ON d.k = seq.n % ?
+            """,
+            (n_rows - 1, start, len(device_ids), interval_s, len(device_ids)),
+        )
+    db.close()
+
+
+def bench_device_ids(db_path: str | Path, info_prefix: str) -> list[int]:
+    # Ids of the devices added by add_devices, 'BENCH_GATEWAY' or 'BENCH_TEMPERATURE'
+    db = sqlite3.connect(db_path)
+    try:
+        return [
+            row[0] for row in db.execute("SELECT id FROM devices WHERE info LIKE ? ORDER BY id", (f"{info_prefix}%",))
+        ]
+    finally:
+        db.close()
+
+
+def seed_fleet(
+    db_path: str | Path,
+    n_gateways: int,
+    n_sensors: int,
+    months: int,
+    interval_s: int = 300,
+    end: datetime | None = None,
+) -> dict:
+    """Register a fleet of gateways and sensors and seed `months` (of 30 days) of readings for each, up to `end`.
+
+    Migrates the db first, readings are then moved to their monthly partitions, rolled up and the latest reading of
+    each device stored, so the db is ready for the app whether it was fresh or already in use. Returns the seeded rows
+    per readings table.
+    """
+    end = (end or datetime.now()).replace(microsecond=0)
+    start = end - timedelta(days=30 * months)
+    n_intervals = int((end - start).total_seconds()) // interval_s
+    migrate(str(db_path))
+    add_devices(db_path, n_gateways, n_sensors)
+
+    seeded = {}
+    for table, info_prefix in (
+        ("gateway_readings", "BENCH_GATEWAY"),
+        ("sensor_temperature_readings", "BENCH_TEMPERATURE"),
+    ):
+        device_ids = bench_device_ids(db_path, info_prefix)
+        seeded[table] = n_intervals * len(device_ids)
+        if seeded[table]:
+            seed_readings(db_path, table, seeded[table], device_ids, start.strftime("%Y-%m-%d %H:%M:%S"), interval_s)
+
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        db.execute("BEGIN IMMEDIATE")
+        for table in READING_COLUMNS:
+            move_to_partitions(db, table)
+            backfill_rollups(db, table)
+            backfill_latest(db, table)
+        db.execute("COMMIT")
+    finally:
+        db.close()
+    return seeded
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(runtime: str, db_path: str, port: int, broker_port: int, env: dict | None = None) -> subprocess.Popen:
+    """Serve the app with a runtime of RUNTIMES on `port`, returns once it accepts connections."""
+    env = {
+        **os.environ,
+        "DATABASE": db_path,
+        "MQTT_BROKER_URL": "127.0.0.1",
+        "MQTT_BROKER_PORT": str(broker_port),
+        "HOST_URL": "127.0.0.1",
+        "PORT": str(port),
+        "LOG_LEVEL": "WARNING",
+        **(env or {}),
+    }
+    server = subprocess.Popen(
+        RUNTIMES[runtime](port), cwd=APP_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{runtime} server did not start listening on port {port}")
+
+
+def timeit(fn, repeat: int = 5) -> dict:
+    # Run fn `repeat` times, latencies in ms
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "minMs": round(min(samples), 3),
+        "medianMs": round(statistics.median(samples), 3),
+        "maxMs": round(max(samples), 3),
+    }
+
+
+def report(name: str, results: list[dict], output: str | Path | None = None) -> None:
+    # Human readable lines on stdout, followed by a single machine readable json line, also written to `output`
+    for result in results:
+        print(" ".join(f"{k}={v}" for k, v in result.items()))
+    document = json.dumps({"benchmark": name, "results": results})
+    print(document)
+    if output is not None:
+        Path(output).write_text(document + "\n")
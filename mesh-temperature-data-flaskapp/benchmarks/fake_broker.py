@@ -0,0 +1,201 @@
+"""Minimal in-process MQTT broker for benchmarks where mosquitto is not available.
+
+python -m benchmarks.fake_broker --port 1883
+
+Only what the app, consumer.py and the load generators use: MQTT 3.1.1 and 5 clients, QoS 0 delivery (QoS 1
+publishes are acknowledged, then delivered at QoS 0), `+`/`#` wildcards and `$share/<group>/<filter>` shared
+subscriptions dealt round-robin. No retained messages, sessions, wills or authentication.
+"""
+
+import argparse
+import asyncio
+import itertools
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CONNECT, CONNACK, PUBLISH, PUBACK = 1, 2, 3, 4
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK = 8, 9, 10, 11
+PINGREQ, PINGRESP, DISCONNECT = 12, 13, 14
+
+
+def encode_varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        n, digit = divmod(n, 128)
+        out.append(digit | (0x80 if n else 0))
+        if not n:
+            return bytes(out)
+
+
+def decode_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value, shift = 0, 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, pos
+        shift += 7
+
+
+def decode_str(data: bytes, pos: int) -> tuple[bytes, int]:
+    length = int.from_bytes(data[pos : pos + 2], "big")
+    return data[pos + 2 : pos + 2 + length], pos + 2 + length
+
+
+def packet(packet_type: int, flags: int, body: bytes) -> bytes:
+    return bytes([packet_type << 4 | flags]) + encode_varint(len(body)) + body
+
+
+def topic_matches(topic_filter: str, topic: str) -> bool:
+    filter_levels, topic_levels = topic_filter.split("/"), topic.split("/")
+    for i, level in enumerate(filter_levels):
+        if level == "#":
+            return True
+        if i >= len(topic_levels) or (level != "+" and level != topic_levels[i]):
+            return False
+    return len(filter_levels) == len(topic_levels)
+
+
+class Session:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.protocol_level = 4
+
+    def publish(self, topic: bytes, payload: bytes) -> None:
+        properties = b"\x00" if self.protocol_level == 5 else b""
+        self.writer.write(packet(PUBLISH, 0, len(topic).to_bytes(2, "big") + topic + properties + payload))
+
+
+class FakeBroker:
+    def __init__(self):
+        self.subscriptions: dict[str, set[Session]] = {}
+        # (group, filter) -> members, dealt round-robin
+        self.shared: dict[tuple[str, str], list[Session]] = {}
+        self._next_member: dict[tuple[str, str], itertools.count] = {}
+        self.published = 0
+
+    def subscribe(self, session: Session, topic_filter: str) -> None:
+        if topic_filter.startswith("$share/"):
+            _, group, shared_filter = topic_filter.split("/", 2)
+            members = self.shared.setdefault((group, shared_filter), [])
+            if session not in members:
+                members.append(session)
+            self._next_member.setdefault((group, shared_filter), itertools.count())
+        else:
+            self.subscriptions.setdefault(topic_filter, set()).add(session)
+
+    def remove(self, session: Session) -> None:
+        for sessions in self.subscriptions.values():
+            sessions.discard(session)
+        for members in self.shared.values():
+            if session in members:
+                members.remove(session)
+
+    def route(self, topic: bytes, payload: bytes) -> None:
+        self.published += 1
+        topic_str = topic.decode()
+        receivers = set()
+        for topic_filter, sessions in self.subscriptions.items():
+            if sessions and topic_matches(topic_filter, topic_str):
+                receivers.update(sessions)
+        for key, members in self.shared.items():
+            if members and topic_matches(key[1], topic_str):
+                receivers.add(members[next(self._next_member[key]) % len(members)])
+        for session in receivers:
+            session.publish(topic, payload)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        session = Session(writer)
+        try:
+            while True:
+                header = await reader.readexactly(1)
+                remaining, multiplier = 0, 1
+                while True:
+                    byte = (await reader.readexactly(1))[0]
+                    remaining += (byte & 0x7F) * multiplier
+                    multiplier *= 128
+                    if not byte & 0x80:
+                        break
+                body = await reader.readexactly(remaining)
+                if not self.dispatch(session, header[0] >> 4, header[0] & 0x0F, body):
+                    break
+                if writer.transport.get_write_buffer_size() > 1 << 20:
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.remove(session)
+            writer.close()
+
+    def dispatch(self, session: Session, packet_type: int, flags: int, body: bytes) -> bool:
+        v5 = session.protocol_level == 5
+        if packet_type == CONNECT:
+            _, pos = decode_str(body, 0)
+            session.protocol_level = body[pos]
+            ack = b"\x00\x00\x00" if session.protocol_level == 5 else b"\x00\x00"
+            session.writer.write(packet(CONNACK, 0, ack))
+        elif packet_type == PUBLISH:
+            topic, pos = decode_str(body, 0)
+            qos = (flags >> 1) & 0x03
+            if qos:
+                packet_id = body[pos : pos + 2]
+                pos += 2
+                session.writer.write(packet(PUBACK, 0, packet_id))
+            if v5:
+                properties_length, pos = decode_varint(body, pos)
+                pos += properties_length
+            self.route(topic, body[pos:])
+        elif packet_type == SUBSCRIBE:
+            packet_id, pos = body[:2], 2
+            if v5:
+                properties_length, pos = decode_varint(body, pos)
+                pos += properties_length
+            granted = bytearray()
+            while pos < len(body):
+                topic_filter, pos = decode_str(body, pos)
+                pos += 1  # subscription options
+                self.subscribe(session, topic_filter.decode())
+                granted.append(0)
+            session.writer.write(packet(SUBACK, 0, packet_id + (b"\x00" if v5 else b"") + bytes(granted)))
+        elif packet_type == UNSUBSCRIBE:
+            session.writer.write(packet(UNSUBACK, 0, body[:2] + (b"\x00" if v5 else b"")))
+        elif packet_type == PINGREQ:
+            session.writer.write(packet(PINGRESP, 0, b""))
+        elif packet_type == DISCONNECT:
+            return False
+        return True
+
+
+async def serve(host: str, port: int, ready: threading.Event | None = None) -> None:
+    broker = FakeBroker()
+    server = await asyncio.start_server(broker.handle, host, port)
+    logger.info(f"Fake MQTT broker listening on {host}:{port}")
+    if ready is not None:
+        ready.set()
+    async with server:
+        await server.serve_forever()
+
+
+def start_in_thread(host: str = "127.0.0.1", port: int = 1883) -> threading.Thread:
+    """Run the broker on a daemon thread of the calling process, returns once it accepts connections."""
+    ready = threading.Event()
+    thread = threading.Thread(target=asyncio.run, args=(serve(host, port, ready),), name="fake-broker", daemon=True)
+    thread.start()
+    ready.wait(5)
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
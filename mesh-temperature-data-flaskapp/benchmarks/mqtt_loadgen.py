@@ -0,0 +1,212 @@
+"""MQTT load generator for the standalone consumer: publishes temperature readings from simulated sensors and
+measures how fast they are committed to the db.
+
+Against a running local mosquitto and consumer (`python consumer.py`, same DATABASE):
+
+    python -m benchmarks.mqtt_loadgen --db ../data/db.sqlite --messages 200000 --publishers 4
+
+Or self contained, starting the consumer (and the fake broker when mosquitto is not around) on a temporary db:
+
+    python -m benchmarks.mqtt_loadgen --fake-broker --consumer-workers 1 2 4 --messages 200000
+
+`--format binary` publishes binary frames of `--frame-size` readings (see payloads.py) instead of a JSON message per
+reading.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import paho.mqtt.client as mqtt
+
+from benchmarks.common import add_devices, create_db, report
+from config import MQTT_TEMPERATURE_TOPIC
+from migrations import migrate
+from partitions import list_partitions
+from payloads import BINARY_TOPIC_SUFFIX, encode_frame
+
+APP_DIR = Path(__file__).resolve().parents[1]
+TABLE = "sensor_temperature_readings"
+
+
+def sensor_macs(db_path: str) -> list[str]:
+    db = sqlite3.connect(db_path)
+    macs = [row[0] for row in db.execute("SELECT mac_address FROM devices WHERE info LIKE 'BENCH_TEMPERATURE%'")]
+    db.close()
+    return macs
+
+
+def count_readings(db_path: str) -> int:
+    db = sqlite3.connect(db_path)
+    try:
+        return sum(
+            db.execute(f"SELECT COUNT(*) FROM {partition}").fetchone()[0]
+            for partition, _ in list_partitions(db, "sensor_temperature_readings")
+        )
+    finally:
+        db.close()
+
+
+def publish(
+    host: str,
+    port: int,
+    macs: list[str],
+    n_messages: int,
+    rate: float,
+    payload_format: str = "json",
+    frame_size: int = 1,
+) -> None:
+    """Publish `n_messages` readings at `rate` readings/s, as JSON messages or binary frames of `frame_size` readings."""
+    client = mqtt.Client(client_id=f"mesh-loadgen-{os.getpid()}")
+    client.connect(host, port)
+    client.loop_start()
+    start = time.perf_counter()
+    message_info = None
+    step = frame_size if payload_format == "binary" else 1
+    for i in range(0, n_messages, step):
+        mac = macs[i % len(macs)]
+        if payload_format == "binary":
+            # No clock on the nodes, the consumer stamps the received time
+            readings = [
+                (macs[j % len(macs)], 0, round(15 + (j % 1000) / 100, 2)) for j in range(i, min(i + step, n_messages))
+            ]
+            topic, payload = f"{MQTT_TEMPERATURE_TOPIC}/{mac}{BINARY_TOPIC_SUFFIX}", encode_frame(TABLE, readings)
+        else:
+            topic = f"{MQTT_TEMPERATURE_TOPIC}/{mac}"
+            payload = json.dumps({"macAddress": mac, "temperature": round(15 + (i % 1000) / 100, 2)})
+        message_info = client.publish(topic, payload)
+        # Paced in steps of 100 readings (or a frame) when a rate is set
+        published = min(i + step, n_messages)
+        if rate and published // 100 != i // 100:
+            ahead = published / rate - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+    # Stopping the network loop right away would discard the messages still queued in the client
+    if message_info is not None:
+        message_info.wait_for_publish()
+    client.disconnect()
+    client.loop_stop()
+
+
+def start_consumer(db_path: str, host: str, port: int, workers: int, mode: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "DATABASE": db_path,
+        "MQTT_BROKER_URL": host,
+        "MQTT_BROKER_PORT": str(port),
+        "LOG_LEVEL": "WARNING",
+    }
+    args = [sys.executable, "consumer.py", "--workers", str(workers), "--mode", mode]
+    return subprocess.Popen(args, cwd=APP_DIR, env=env)
+
+
+def run(args, db_path: str, workers: int | None) -> dict:
+    consumer = start_consumer(db_path, args.host, args.port, workers, args.mode) if workers else None
+    try:
+        if consumer is not None:
+            time.sleep(args.warmup)
+        macs = sensor_macs(db_path)
+        before = count_readings(db_path)
+
+        start = time.perf_counter()
+        per_publisher = args.messages // args.publishers
+        publishers = [
+            multiprocessing.Process(
+                target=publish,
+                args=(
+                    args.host,
+                    args.port,
+                    macs,
+                    per_publisher,
+                    args.rate / args.publishers,
+                    args.format,
+                    args.frame_size,
+                ),
+            )
+            for _ in range(args.publishers)
+        ]
+        for publisher in publishers:
+            publisher.start()
+        for publisher in publishers:
+            publisher.join()
+        published_s = time.perf_counter() - start
+
+        expected = per_publisher * args.publishers
+        committed = 0
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            committed = count_readings(db_path) - before
+            if committed >= expected:
+                break
+            time.sleep(0.05)
+        committed_s = time.perf_counter() - start
+    finally:
+        if consumer is not None:
+            consumer.send_signal(signal.SIGINT)
+            consumer.wait(30)
+
+    return {
+        "consumerWorkers": workers,
+        "mode": args.mode,
+        "format": args.format,
+        "published": expected,
+        "publishPerSec": round(expected / published_s),
+        "committed": committed,
+        "lost": expected - committed,
+        "committedPerSec": round(committed / committed_s),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1883)
+    parser.add_argument("--db", help="db the consumer writes to, a temporary one when omitted")
+    parser.add_argument("--devices", type=int, default=200, help="simulated sensors, registered in the db")
+    parser.add_argument("--messages", type=int, default=100_000)
+    parser.add_argument("--publishers", type=int, default=2, help="publishing processes")
+    parser.add_argument("--rate", type=float, default=0, help="total readings/s, 0 publishes as fast as possible")
+    parser.add_argument("--format", choices=("json", "binary"), default="json", help="payload format")
+    parser.add_argument("--frame-size", type=int, default=100, help="readings per binary frame")
+    parser.add_argument("--consumer-workers", type=int, nargs="*", default=[], help="start consumer.py runs with")
+    parser.add_argument("--mode", choices=("shared", "hash"), default="shared")
+    parser.add_argument("--fake-broker", action="store_true", help="start benchmarks.fake_broker on --port")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds for a started consumer to subscribe")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for readings to be committed")
+    args = parser.parse_args()
+
+    broker = None
+    if args.fake_broker:
+        broker = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.fake_broker", "--host", args.host, "--port", str(args.port)],
+            cwd=APP_DIR,
+        )
+        time.sleep(1)
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = args.db or str(Path(tmp) / "bench.sqlite")
+            if not args.db:
+                create_db(db_path)
+            migrate(db_path)
+            add_devices(db_path, 0, args.devices)
+            for workers in args.consumer_workers or [None]:
+                results.append(run(args, db_path, workers))
+    finally:
+        if broker is not None:
+            broker.terminate()
+
+    report("mqtt_loadgen", results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Seed a db with a synthetic fleet of gateways and sensors and months of their readings, for load tests.
+
+python -m benchmarks.seed_db --db /tmp/seeded.sqlite --gateways 10 --sensors 200 --months 6 --interval 300
+
+Creates the db with sqlite/init.sql when missing and migrates it. The fleet is added next to the devices already
+registered, with 'BENCH_GATEWAY_<n>'/'BENCH_TEMPERATURE_SENSOR_<n>' infos and one reading every `--interval`
+seconds per device up to now, partitioned and rolled up like ingested readings.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+from benchmarks.common import create_db, report, seed_fleet
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", required=True, help="db to seed, created when missing")
+    parser.add_argument("--gateways", type=int, default=10)
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--months", type=int, default=3, help="months of 30 days of readings, up to now")
+    parser.add_argument("--interval", type=int, default=300, help="seconds between the readings of a device")
+    args = parser.parse_args()
+
+    if not Path(args.db).exists():
+        create_db(args.db)
+    start = time.perf_counter()
+    seeded = seed_fleet(args.db, args.gateways, args.sensors, args.months, args.interval)
+    elapsed = time.perf_counter() - start
+    report(
+        "seed_db",
+        [
+            {
+                "db": args.db,
+                "gateways": args.gateways,
+                "sensors": args.sensors,
+                "months": args.months,
+                "intervalS": args.interval,
+                "gatewayReadings": seeded["gateway_readings"],
+                "temperatureReadings": seeded["sensor_temperature_readings"],
+                "elapsedS": round(elapsed, 1),
+            }
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import json
+import re
+from collections.abc import Callable
+from datetime import datetime
+
+from metrics import REJECTED
+from payloads import is_device_clock, is_seq, local_timestamp, reading_seq
+
+BULK_CONTENT_TYPES = ("application/json", "application/x-ndjson", "application/ndjson")
+
+_TIMESTAMP_RE = re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}")
+
+
+def is_valid_timestamp(timestamp) -> bool:
+    # Same readings strptime("%Y-%m-%d %H:%M:%S") accepts once zero padded, at a fraction of the cost
+    if not isinstance(timestamp, str) or not _TIMESTAMP_RE.fullmatch(timestamp):
+        return False
+    try:
+        datetime.fromisoformat(timestamp)
+    except ValueError:
+        return False
+    return True
+
+
+def parse_bulk_body(body: bytes, content_type: str) -> list:
+    """Items of a JSON array or NDJSON body. Raises ValueError if the body itself can't be used.
+
+    NDJSON lines that are not valid JSON are kept as their ValueError, so they are reported with the line's index.
+    Blank lines are skipped and don't count in the indices.
+    """
+    if content_type == "application/json":
+        try:
+            items = json.loads(body)
+        except ValueError as e:
+            raise ValueError(f"Invalid JSON body: {e}") from None
+        if not isinstance(items, list):
+            raise ValueError("Expected a JSON array of readings")
+        return items
+
+    lines = [line for line in body.splitlines() if line.strip()]
+    try:
+        # One json.loads of the lines as an array is much cheaper than one per line
+        items = json.loads(b"[" + b",".join(lines) + b"]")
+        if len(items) == len(lines):
+            return items
+    except ValueError:
+        pass
+
+    # Some line is not a single JSON value, parse line by line to tell which
+    items = []
+    for line in lines:
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            items.append(e)
+    return items
+
+
+def validate_readings(
+    items: list,
+    value_key: str,
+    convert: Callable,
+    lookup_device_id: Callable[[str], int | None],
+    received_time: str | None = None,
+) -> tuple[list[tuple], list[dict]]:
+    """Validate bulk readings in one pass, like process_gateway_data/process_sensor_temp_data do for one reading.
+
+    Returns the (device_id, timestamp, value, seq) rows of the valid items and an {index, error} per invalid item.
+    With a `received_time` (MQTT messages), items without a unix timestamp get it instead of being rejected.
+    """
+    rows, errors = [], []
+    device_ids: dict[str, int | None] = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            error = f"Invalid JSON: {item}" if isinstance(item, ValueError) else "Expected a JSON object"
+            REJECTED["invalid_payload"].inc()
+            errors.append({"index": index, "error": error})
+            continue
+
+        mac_address = item.get("macAddress")
+        if not isinstance(mac_address, str):
+            REJECTED["missing_mac"].inc()
+            errors.append({"index": index, "error": "'macAddress' required"})
+            continue
+        # Uploads usually come from a handful of devices, resolve each MAC once per request
+        if mac_address in device_ids:
+            device_id = device_ids[mac_address]
+        else:
+            device_id = device_ids[mac_address] = lookup_device_id(mac_address)
+        if device_id is None:
+            REJECTED["unknown_device"].inc()
+            errors.append({"index": index, "error": f"Device with MAC_address={mac_address} not found"})
+            continue
+
+        timestamp, value, seq = item.get("timestamp"), item.get(value_key), item.get("seq")
+        # The received time is not the node's, the reading is only keyed by its seq
+        received = received_time is not None and not is_device_clock(timestamp)
+        if received:
+            timestamp = received_time
+        if timestamp is None or value is None:
+            REJECTED["missing_field"].inc()
+            errors.append({"index": index, "error": f"Missing either of 'timestamp' or '{value_key}'"})
+            continue
+        if is_device_clock(timestamp):
+            timestamp = local_timestamp(timestamp)
+        elif not is_valid_timestamp(timestamp):
+            REJECTED["invalid_timestamp"].inc()
+            errors.append(
+                {
+                    "index": index,
+                    "error": f"Invalid datetime format: {timestamp}. Required format: 'YYYY-MM-DD HH:MM:SS'",
+                }
+            )
+            continue
+        try:
+            value = convert(value)
+        except (TypeError, ValueError):
+            REJECTED["invalid_value"].inc()
+            errors.append(
+                {
+                    "index": index,
+                    "error": f"Invalid {value_key} format. Could not convert {value} to {convert.__name__}.",
+                }
+            )
+            continue
+        if seq is not None and not is_seq(seq):
+            REJECTED["invalid_seq"].inc()
+            errors.append({"index": index, "error": f"Invalid seq: {seq}. Required a non negative integer"})
+            continue
+
+        rows.append((device_id, timestamp, value, reading_seq(seq, None if received else timestamp)))
+    return rows, errors
@@ -0,0 +1,150 @@
+"""LRU cache of serialized readings responses, bounded by memory and invalidated per device as readings are committed.
+
+Entries are keyed by readings table, device and request range (see readings.readings_cache_key). The ingest writer
+calls `invalidate` with every committed batch: a device's entries whose range could hold one of the new readings are
+dropped, closed historical ranges ending before them stay cached for good.
+"""
+
+import hashlib
+import sys
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from metrics import RESPONSE_CACHE_LOOKUPS
+
+# Only successful responses are cached, errors are cheap and may depend on the registry
+_OK_PREFIX = '{"statusCode": 200'
+# Key, entry and index bookkeeping on top of the body
+_ENTRY_OVERHEAD = 512
+
+_HITS = RESPONSE_CACHE_LOOKUPS.labels("hit")
+_MISSES = RESPONSE_CACHE_LOOKUPS.labels("miss")
+
+
+class CachedResponse:
+    __slots__ = ("body", "etag", "expires", "size", "upper_bound")
+
+    def __init__(self, body: str, upper_bound: str | None, expires: float | None):
+        self.body = body
+        # Strong validator of the body, unquoted
+        self.etag = hashlib.blake2b(body.encode(), digest_size=16).hexdigest()
+        self.upper_bound = upper_bound
+        self.expires = expires
+        self.size = sys.getsizeof(body) + _ENTRY_OVERHEAD
+
+
+class ResponseCache:
+    """Serialized responses by key, least recently used ones evicted past `max_bytes`. `max_bytes=0` disables it.
+
+    Keys start with (readings table, device id). `upper_bound` of an entry is the newest reading timestamp the response
+    can hold, None for open ranges. When readings are written by another process (consumer.py) nothing invalidates
+    the entries, open ranges then expire after `open_ttl` seconds.
+    """
+
+    def __init__(self, max_bytes: int, open_ttl: float | None = None):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_bytes // 4
+        self.open_ttl = open_ttl
+        self._entries: OrderedDict[tuple, CachedResponse] = OrderedDict()
+        self._device_keys: dict[tuple[str, int], set[tuple]] = defaultdict(set)
+        self._generations: dict[tuple[str, int], int] = defaultdict(int)
+        self._clears = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+        # Stats
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.evicted = 0
+
+    def get(self, key: tuple) -> CachedResponse | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires is not None and entry.expires < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                _MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        _HITS.inc()
+        return entry
+
+    def generation(self, key: tuple) -> tuple[int, int]:
+        """Invalidations of the key's device and clears, taken before reading the response that is then `put`."""
+        with self._lock:
+            return self._clears, self._generations[key[:2]]
+
+    def put(self, key: tuple, body: str, upper_bound: str | None, generation: tuple[int, int]) -> CachedResponse | None:
+        """Cache a response body. Returns its entry, or None for error responses which are not cached.
+
+        The entry is not stored if readings of the device were committed since `generation` was taken, the response
+        may have been read before them.
+        """
+        if not body.startswith(_OK_PREFIX):
+            return None
+        is_open = upper_bound is None or upper_bound >= time.strftime("%Y-%m-%d %H:%M:%S")
+        expires = time.monotonic() + self.open_ttl if is_open and self.open_ttl is not None else None
+        entry = CachedResponse(body, upper_bound, expires)
+        if entry.size > self.max_entry_bytes:
+            return entry
+        with self._lock:
+            if (self._clears, self._generations[key[:2]]) != generation:
+                return entry
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._device_keys[key[:2]].add(key)
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evicted += 1
+        return entry
+
+    def invalidate(self, batch: list[tuple[str, tuple]]) -> None:
+        """Drop the entries that committed (table, (device_id, timestamp, value)) readings could be part of."""
+        oldest = {}
+        for table, row in batch:
+            device = (table, row[0])
+            if device not in oldest or row[1] < oldest[device]:
+                oldest[device] = row[1]
+        with self._lock:
+            for device, timestamp in oldest.items():
+                self._generations[device] += 1
+                for key in list(self._device_keys.get(device, ())):
+                    upper_bound = self._entries[key].upper_bound
+                    # Same string comparison as the 'timestamp <= readingsTo' of the readings query
+                    if upper_bound is None or timestamp <= upper_bound:
+                        self._remove(key)
+                        self.invalidated += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._clears += 1
+            self._entries.clear()
+            self._device_keys.clear()
+            self._size = 0
+
+    def _remove(self, key: tuple) -> None:
+        entry = self._entries.pop(key)
+        self._size -= entry.size
+        keys = self._device_keys[key[:2]]
+        keys.discard(key)
+        if not keys:
+            del self._device_keys[key[:2]]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "maxBytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+                "evicted": self.evicted,
+            }
@@ -15,6 +15,17 @@ MQTT_TLS_ENABLED = os.environ.get("MQTT_TLS_ENABLED", "False").lower() == "true"
 MQTT_BASE_TOPIC = os.environ.get("MQTT_BASE_TOPIC", "/readings")
 MQTT_GATEWAY_TOPIC = f"{MQTT_BASE_TOPIC}/gateway"
 MQTT_TEMPERATURE_TOPIC = f"{MQTT_BASE_TOPIC}/temperature"
+# Set to False when readings are consumed by the standalone consumer (consumer.py) instead of the web process
+MQTT_SUBSCRIBE_IN_WEB = os.environ.get("MQTT_SUBSCRIBE_IN_WEB", "True").lower() == "true"
+
+# Standalone MQTT consumer (consumer.py)
+MQTT_CONSUMER_WORKERS = int(os.environ.get("MQTT_CONSUMER_WORKERS", str(os.cpu_count() or 1)))
+MQTT_CONSUMER_MODE = os.environ.get("MQTT_CONSUMER_MODE", "shared").lower()  # 'shared' ($share, MQTT v5) or 'hash'
+MQTT_CONSUMER_SHARE_GROUP = os.environ.get("MQTT_CONSUMER_SHARE_GROUP", "mesh-ingest")
+MQTT_CONSUMER_BATCH = int(os.environ.get("MQTT_CONSUMER_BATCH", "500"))  # readings per worker -> writer hand-off
+MQTT_CONSUMER_BATCH_INTERVAL = float(os.environ.get("MQTT_CONSUMER_BATCH_INTERVAL", "0.1"))
+# Longer than MQTT_KEEPALIVE, a PINGRESP queued behind a backlog of readings must not look like a dead broker
+MQTT_CONSUMER_KEEPALIVE = int(os.environ.get("MQTT_CONSUMER_KEEPALIVE", "60"))
 
 # Server configuration
 HOST_URL = os.environ.get("HOST_URL", "0.0.0.0")
@@ -25,3 +36,63 @@ DEBUG_MODE = os.environ.get("DEBUG_MODE", "ON").lower() == "on"
 # Use an absolute path for Docker compatibility
 BASE_DIR = Path(__file__).resolve().parent
 DATABASE_PATH = os.environ.get("DATABASE", str(BASE_DIR / "../data/db.sqlite"))
+
+# Ingestion queue configuration (write-behind batching of readings)
+INGEST_MAX_BATCH = int(os.environ.get("INGEST_MAX_BATCH", "500"))
+INGEST_FLUSH_INTERVAL = float(os.environ.get("INGEST_FLUSH_INTERVAL", "0.5"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "10000"))
+INGEST_FULL_POLICY = os.environ.get("INGEST_FULL_POLICY", "block").lower()  # 'block' or 'drop'
+INGEST_BLOCK_TIMEOUT = float(os.environ.get("INGEST_BLOCK_TIMEOUT", "1.0"))
+INGEST_BULK_MAX_ITEMS = int(os.environ.get("INGEST_BULK_MAX_ITEMS", "100000"))
+INGEST_BULK_TIMEOUT = float(os.environ.get("INGEST_BULK_TIMEOUT", "30.0"))  # seconds to wait for a bulk upload commit
+
+# Device registry configuration (in-memory MAC -> device cache)
+DEVICE_REGISTRY_REFRESH_INTERVAL = float(os.environ.get("DEVICE_REGISTRY_REFRESH_INTERVAL", "60"))
+DEVICE_REGISTRY_NEGATIVE_TTL = float(os.environ.get("DEVICE_REGISTRY_NEGATIVE_TTL", "30"))
+
+# Readings API pagination
+READINGS_DEFAULT_LIMIT = int(os.environ.get("READINGS_DEFAULT_LIMIT", "500"))
+READINGS_MAX_LIMIT = int(os.environ.get("READINGS_MAX_LIMIT", "10000"))
+
+# Readings responses cache, invalidated per device as readings are committed. 0 disables it
+RESPONSE_CACHE_MAX_MB = float(os.environ.get("RESPONSE_CACHE_MAX_MB", "64"))
+# Seconds open ranges stay cached when readings are ingested by consumer.py (MQTT_SUBSCRIBE_IN_WEB=False)
+RESPONSE_CACHE_OPEN_TTL = float(os.environ.get("RESPONSE_CACHE_OPEN_TTL", "2"))
+
+# Newest readings kept in memory per device for recent-range aggregations, 0 disables it.
+# Only used when this process ingests the MQTT readings (MQTT_SUBSCRIBE_IN_WEB=True)
+HOT_WINDOW_SIZE = int(os.environ.get("HOT_WINDOW_SIZE", "1024"))
+
+# Live readings pushed to the pages (Server-Sent Events)
+LIVE_BUFFER_SIZE = int(os.environ.get("LIVE_BUFFER_SIZE", "256"))  # events buffered per client, oldest dropped
+LIVE_MAX_CLIENTS = int(os.environ.get("LIVE_MAX_CLIENTS", "1000"))
+LIVE_KEEPALIVE_INTERVAL = float(os.environ.get("LIVE_KEEPALIVE_INTERVAL", "15"))
+LIVE_INITIAL_WINDOW = int(os.environ.get("LIVE_INITIAL_WINDOW", "100"))  # readings shown before live ones are appended
+
+# Metrics exported at /metrics (Prometheus text format)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "True").lower() == "true"
+# Share of the per-message INFO logs of MQTT ingest and the readings API that are written: 1 all, 0 none, 0.01 one in 100
+LOG_MESSAGE_SAMPLE_RATE = float(os.environ.get("LOG_MESSAGE_SAMPLE_RATE", "1.0"))
+
+# Readings export, rows fetched per chunk while streaming
+EXPORT_CHUNK_SIZE = int(os.environ.get("EXPORT_CHUNK_SIZE", "5000"))
+
+# Readings aggregation/downsampling for charts
+AGGREGATE_DEFAULT_POINTS = int(os.environ.get("AGGREGATE_DEFAULT_POINTS", "1000"))
+AGGREGATE_MAX_POINTS = int(os.environ.get("AGGREGATE_MAX_POINTS", "5000"))
+
+# Retention in days, 0 keeps forever. Raw readings expire by whole monthly partitions, rollups by bucket
+RETENTION_GATEWAY_READINGS_DAYS = int(os.environ.get("RETENTION_GATEWAY_READINGS_DAYS", "0"))
+RETENTION_SENSOR_TEMPERATURE_READINGS_DAYS = int(os.environ.get("RETENTION_SENSOR_TEMPERATURE_READINGS_DAYS", "0"))
+RETENTION_MINUTE_ROLLUPS_DAYS = int(os.environ.get("RETENTION_MINUTE_ROLLUPS_DAYS", "0"))
+RETENTION_HOUR_ROLLUPS_DAYS = int(os.environ.get("RETENTION_HOUR_ROLLUPS_DAYS", "0"))
+RETENTION_DAY_ROLLUPS_DAYS = int(os.environ.get("RETENTION_DAY_ROLLUPS_DAYS", "0"))
+RETENTION_CHECK_INTERVAL = float(os.environ.get("RETENTION_CHECK_INTERVAL", "3600"))
+
+# SQLite connection tuning
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_CACHE_SIZE_KB = int(os.environ.get("SQLITE_CACHE_SIZE_KB", "32768"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", "8"))  # idle read-only connections kept for the HTTP API
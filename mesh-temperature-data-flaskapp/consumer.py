@@ -0,0 +1,311 @@
+"""Standalone MQTT ingest consumer, run beside the web process (with MQTT_SUBSCRIBE_IN_WEB=False):
+
+    python consumer.py --workers 4 --mode shared
+
+Worker processes each hold their own MQTT connection and split the readings between them, either with MQTT v5
+shared subscriptions (`$share/<group>/<topic>`, the broker deals each message to one worker) or by hashing the
+device MAC address of the topic (every worker receives everything and keeps its own shard, for brokers without
+shared subscriptions). Workers decode and validate messages and hand batches of rows to the main process, whose
+single ingest writer commits them.
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+import zlib
+
+import paho.mqtt.client as mqtt
+
+import database
+from bulk import validate_readings
+from config import (
+    DATABASE_PATH,
+    DEVICE_REGISTRY_NEGATIVE_TTL,
+    DEVICE_REGISTRY_REFRESH_INTERVAL,
+    INGEST_BLOCK_TIMEOUT,
+    INGEST_FLUSH_INTERVAL,
+    INGEST_FULL_POLICY,
+    INGEST_MAX_BATCH,
+    INGEST_QUEUE_SIZE,
+    LOG_LEVEL,
+    MQTT_BROKER_PORT,
+    MQTT_BROKER_URL,
+    MQTT_CONSUMER_BATCH,
+    MQTT_CONSUMER_BATCH_INTERVAL,
+    MQTT_CONSUMER_KEEPALIVE,
+    MQTT_CONSUMER_MODE,
+    MQTT_CONSUMER_SHARE_GROUP,
+    MQTT_CONSUMER_WORKERS,
+    MQTT_GATEWAY_TOPIC,
+    MQTT_PASSWORD,
+    MQTT_TEMPERATURE_TOPIC,
+    MQTT_TLS_ENABLED,
+    MQTT_USERNAME,
+    SQLITE_BUSY_TIMEOUT_MS,
+    SQLITE_CACHE_SIZE_KB,
+    SQLITE_JOURNAL_MODE,
+    SQLITE_MMAP_SIZE,
+    SQLITE_SYNCHRONOUS,
+)
+from database import SQLiteSettings
+from ingest import IngestQueue, IngestQueueFull
+from migrations import migrate
+from payloads import decode_frame, device_topic_mac, frame_rows, is_binary, received_timestamp
+from registry import GATEWAY, TEMPERATURE, DeviceRegistry
+
+logger = logging.getLogger("consumer")
+
+CONSUMER_MODES = ("shared", "hash")
+
+# topic prefix -> (readings table, value key, value type, device type)
+TOPIC_READINGS = {
+    MQTT_GATEWAY_TOPIC: ("gateway_readings", "rssi", int, GATEWAY),
+    MQTT_TEMPERATURE_TOPIC: ("sensor_temperature_readings", "temperature", float, TEMPERATURE),
+}
+
+
+def shard_of(mac_address: str, n_shards: int) -> int:
+    # Stable across processes and restarts, unlike hash()
+    return zlib.crc32(mac_address.encode()) % n_shards
+
+
+class ConsumerWorker:
+    """One MQTT connection turning its share of the messages into batches of (device_id, timestamp, value) rows."""
+
+    def __init__(self, index: int, n_workers: int, mode: str, rows_queue, stop_event):
+        self.index = index
+        self.n_workers = n_workers
+        self.mode = mode
+        self.rows_queue = rows_queue
+        self.stop_event = stop_event
+
+        self.registry = DeviceRegistry(
+            DATABASE_PATH, refresh_interval=DEVICE_REGISTRY_REFRESH_INTERVAL, negative_ttl=DEVICE_REGISTRY_NEGATIVE_TTL
+        )
+        self.pending: dict[str, list[tuple]] = {table: [] for table, *_ in TOPIC_READINGS.values()}
+        self.last_hand_off = time.monotonic()
+        # Stats
+        self.received = 0
+        self.rejected = 0
+        self.other_shard = 0
+
+    def topic_filters(self) -> list[str]:
+        filters = [f"{topic}/#" for topic in TOPIC_READINGS]
+        if self.mode == "shared":
+            return [f"$share/{MQTT_CONSUMER_SHARE_GROUP}/{topic_filter}" for topic_filter in filters]
+        return filters
+
+    def on_connect(self, client, userdata, flags, rc, properties=None):
+        if rc != 0:
+            logger.error(f"Worker {self.index}: bad connection to MQTT broker. Code: {rc}")
+            return
+        for topic_filter in self.topic_filters():
+            client.subscribe(topic_filter)
+        logger.info(f"Worker {self.index}: subscribed to {self.topic_filters()}")
+
+    def on_message(self, client, userdata, message):
+        topic = message.topic
+        for topic_prefix, (table, value_key, convert, device_type) in TOPIC_READINGS.items():
+            if topic.startswith(topic_prefix):
+                break
+        else:
+            logger.warning(f"Not processing topic {topic}")
+            return
+        # Devices publish on <topic>/<MAC>, the MAC is the shard key
+        if self.mode == "hash" and shard_of(device_topic_mac(topic), self.n_workers) != self.index:
+            self.other_shard += 1
+            return
+
+        def lookup_device_id(mac_address: str) -> int | None:
+            device = self.registry.lookup(mac_address, device_type)
+            return device.id if device is not None else None
+
+        self.received += 1
+        if is_binary(message):
+            self.on_frame(topic, table, message.payload, lookup_device_id)
+            return
+        try:
+            data = json.loads(message.payload)
+        except ValueError:
+            self.rejected += 1
+            logger.error(f"Failed to parse JSON payload from: {message.payload}")
+            return
+        if not isinstance(data, dict):
+            self.rejected += 1
+            return
+        # FIX: No real time clock in gateway for now, received time as timestamp unless the device sent its own
+        rows, errors = validate_readings([data], value_key, convert, lookup_device_id, received_timestamp())
+        if errors:
+            self.rejected += 1
+            logger.debug(f"Rejected message on {topic}: {errors[0]['error']}")
+            return
+        self.pending[table].extend(rows)
+
+    def on_frame(self, topic: str, table: str, payload: bytes, lookup_device_id) -> None:
+        # Binary frame of many readings relayed by one gateway, see payloads.py
+        try:
+            readings = decode_frame(payload, table)
+        except ValueError as e:
+            self.rejected += 1
+            logger.error(f"Failed to decode binary frame on {topic}: {e}")
+            return
+        rows, rejected = frame_rows(readings, lookup_device_id, received_timestamp())
+        if rejected:
+            self.rejected += 1
+            logger.debug(f"Rejected {rejected} readings of unknown devices in frame on {topic}")
+        self.pending[table].extend(rows)
+
+    def hand_off(self, force: bool = False) -> None:
+        # Rows cross the process boundary in batches, one pickle per batch instead of per reading
+        n_pending = sum(len(rows) for rows in self.pending.values())
+        interval_elapsed = time.monotonic() - self.last_hand_off >= MQTT_CONSUMER_BATCH_INTERVAL
+        if not n_pending or not (force or interval_elapsed or n_pending >= MQTT_CONSUMER_BATCH):
+            return
+        for table, rows in self.pending.items():
+            if rows:
+                self.rows_queue.put((table, rows))
+                self.pending[table] = []
+        self.last_hand_off = time.monotonic()
+
+    def reconnect(self, client: mqtt.Client, rc: int) -> None:
+        # Subscriptions are made again by on_connect
+        logger.warning(f"Worker {self.index}: lost MQTT connection ({mqtt.error_string(rc)}), reconnecting")
+        delay = 1.0
+        while not self.stop_event.is_set():
+            try:
+                client.reconnect()
+                return
+            except OSError as e:
+                logger.error(f"Worker {self.index}: reconnect failed: {e}, retrying in {delay}s")
+                self.stop_event.wait(delay)
+                delay = min(delay * 2, 30.0)
+
+    def run(self) -> None:
+        self.registry.load()
+        protocol = mqtt.MQTTv5 if self.mode == "shared" else mqtt.MQTTv311
+        client = mqtt.Client(client_id=f"mesh-consumer-{self.index}-{time.time_ns()}", protocol=protocol)
+        if MQTT_USERNAME:
+            client.username_pw_set(MQTT_USERNAME, MQTT_PASSWORD)
+        if MQTT_TLS_ENABLED:
+            client.tls_set()
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        client.connect(MQTT_BROKER_URL, MQTT_BROKER_PORT, MQTT_CONSUMER_KEEPALIVE)
+
+        while not self.stop_event.is_set():
+            rc = client.loop(timeout=MQTT_CONSUMER_BATCH_INTERVAL)
+            self.hand_off()
+            if rc != mqtt.MQTT_ERR_SUCCESS:
+                self.reconnect(client, rc)
+        client.disconnect()
+        self.hand_off(force=True)
+        logger.info(
+            f"Worker {self.index} stopped: received={self.received}, rejected={self.rejected}, "
+            f"other_shard={self.other_shard}"
+        )
+
+
+def run_worker(index: int, n_workers: int, mode: str, rows_queue, stop_event) -> None:
+    configure_logging()
+    configure_database()
+    # Ctrl+C reaches the whole process group, the main process decides when workers stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    ConsumerWorker(index, n_workers, mode, rows_queue, stop_event).run()
+
+
+def configure_logging() -> None:
+    logging.basicConfig(
+        level=getattr(logging, LOG_LEVEL),
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        datefmt="%H:%M:%S",
+    )
+
+
+def configure_database() -> None:
+    # Same SQLite tuning as app.py, spawned workers start from the defaults of database.py again
+    database.configure(
+        SQLiteSettings(
+            journal_mode=SQLITE_JOURNAL_MODE,
+            synchronous=SQLITE_SYNCHRONOUS,
+            cache_size_kb=SQLITE_CACHE_SIZE_KB,
+            mmap_size=SQLITE_MMAP_SIZE,
+            busy_timeout_ms=SQLITE_BUSY_TIMEOUT_MS,
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=MQTT_CONSUMER_WORKERS)
+    parser.add_argument("--mode", choices=CONSUMER_MODES, default=MQTT_CONSUMER_MODE)
+    args = parser.parse_args()
+    configure_logging()
+    configure_database()
+
+    migrate(DATABASE_PATH)
+    # Spawned, not forked: workers start clean instead of inheriting this process' threads and connections
+    ctx = multiprocessing.get_context("spawn")
+    rows_queue = ctx.Queue(maxsize=max(1, INGEST_QUEUE_SIZE // MQTT_CONSUMER_BATCH))
+    stop_event = ctx.Event()
+    workers = [
+        ctx.Process(target=run_worker, args=(i, args.workers, args.mode, rows_queue, stop_event), name=f"consumer-{i}")
+        for i in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    # Single writer for every worker
+    ingest_queue = IngestQueue(
+        DATABASE_PATH,
+        max_batch=INGEST_MAX_BATCH,
+        flush_interval=INGEST_FLUSH_INTERVAL,
+        max_size=INGEST_QUEUE_SIZE,
+        full_policy=INGEST_FULL_POLICY,
+        block_timeout=INGEST_BLOCK_TIMEOUT,
+    )
+    ingest_queue.start()
+    logger.info(f"Started {args.workers} consumer workers in {args.mode} mode")
+
+    def request_stop(signum, frame):
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    def drain(timeout: float) -> None:
+        table, rows = rows_queue.get(timeout=timeout)
+        for row in rows:
+            try:
+                ingest_queue.put(table, *row)
+            except IngestQueueFull as e:
+                logger.error(f"Dropped reading: {e}")
+
+    try:
+        while not stop_event.is_set():
+            try:
+                drain(timeout=0.5)
+            except queue.Empty:
+                pass
+            if not any(worker.is_alive() for worker in workers) and not stop_event.is_set():
+                logger.error("All consumer workers exited")
+                stop_event.set()
+    finally:
+        stop_event.set()
+        # Workers hand off their last rows on the way out, keep draining until they are gone
+        while any(worker.is_alive() for worker in workers) or not rows_queue.empty():
+            try:
+                drain(timeout=0.1)
+            except queue.Empty:
+                pass
+        for worker in workers:
+            worker.join()
+        ingest_queue.stop()
+        logger.info(f"Consumer stopped: {ingest_queue.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+import logging
+import queue
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class SQLiteSettings:
+    journal_mode: str = "WAL"  # readers no longer block the writer (and the other way around)
+    synchronous: str = "NORMAL"  # safe with WAL, only the last transactions can be lost on power failure
+    cache_size_kb: int = 32768
+    mmap_size: int = 256 * 1024 * 1024
+    busy_timeout_ms: int = 5000
+
+
+# Defaults used by connect(), replaced once at app start by configure()
+settings = SQLiteSettings()
+
+
+def configure(new_settings: SQLiteSettings) -> None:
+    global settings
+    settings = new_settings
+
+
+def connect(db_path: str, readonly: bool = False, sqlite_settings: SQLiteSettings | None = None, **kwargs):
+    """Open a tuned connection. Read-only connections can't take the write lock, used by the HTTP API."""
+    sqlite_settings = sqlite_settings or settings
+    if readonly:
+        db = sqlite3.connect(f"{Path(db_path).resolve().as_uri()}?mode=ro", uri=True, **kwargs)
+    else:
+        db = sqlite3.connect(db_path, **kwargs)
+        # Journal mode is persistent in the db file, only a writer can switch it
+        db.execute(f"PRAGMA journal_mode = {sqlite_settings.journal_mode}")
+    db.execute(f"PRAGMA synchronous = {sqlite_settings.synchronous}")
+    db.execute(f"PRAGMA cache_size = -{sqlite_settings.cache_size_kb:d}")
+    db.execute(f"PRAGMA mmap_size = {sqlite_settings.mmap_size:d}")
+    db.execute(f"PRAGMA busy_timeout = {sqlite_settings.busy_timeout_ms:d}")
+    db.execute("PRAGMA temp_store = MEMORY")
+    return db
+
+
+class ConnectionPool:
+    """Idle connections reused across requests and threads instead of a connect/close per app context.
+
+    Connections are handed to one thread at a time, `max_idle` bounds how many are kept open when idle.
+    """
+
+    def __init__(self, db_path: str, readonly: bool = True, max_idle: int = 8, **connect_kwargs):
+        self.db_path = db_path
+        self.readonly = readonly
+        self.connect_kwargs = connect_kwargs
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=max_idle)
+
+    def acquire(self) -> sqlite3.Connection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            logger.debug(f"Opening new {'read-only ' if self.readonly else ''}connection to {self.db_path}")
+            return connect(self.db_path, self.readonly, check_same_thread=False, **self.connect_kwargs)
+
+    def release(self, db: sqlite3.Connection) -> None:
+        if db.in_transaction:
+            db.rollback()
+        try:
+            self._idle.put_nowait(db)
+        except queue.Full:
+            db.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
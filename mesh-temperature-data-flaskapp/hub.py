@@ -0,0 +1,167 @@
+import json
+import logging
+import threading
+from collections import defaultdict, deque
+from collections.abc import Callable, Iterator
+
+from partitions import READING_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+
+class HubFull(Exception):
+    pass
+
+
+class Subscription:
+    """Bounded buffer of Server-Sent Events for one client of one device's readings.
+
+    A client that falls behind loses its oldest events, counted in `dropped` so it can be told to reload.
+    """
+
+    __slots__ = ("_buffer", "_lock", "_notify", "dropped", "key")
+
+    def __init__(self, key: tuple[str, int], buffer_size: int, notify: Callable[[], None]):
+        self.key = key
+        self.dropped = 0
+        self._buffer: deque[str] = deque(maxlen=buffer_size)
+        self._lock = threading.Lock()
+        self._notify = notify
+
+    def push(self, event: str) -> None:
+        with self._lock:
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(event)
+        self._notify()
+
+    def drain(self) -> tuple[list[str], int]:
+        """Buffered events and how many were dropped since the last drain."""
+        with self._lock:
+            events = list(self._buffer)
+            self._buffer.clear()
+            dropped, self.dropped = self.dropped, 0
+        return events, dropped
+
+
+class ReadingsHub:
+    """In-process fan-out of committed readings to live subscribers, keyed by (readings table, device id).
+
+    `publish` is called by the ingest writer after each commit. Every device's new readings are serialized once
+    into a single SSE event, then handed to all its subscribers, each waking up through its own `notify` callback
+    (a threading.Event for Flask streams, the event loop for the asyncio runtime).
+    """
+
+    def __init__(self, buffer_size: int = 256, max_subscribers: int = 1000):
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self._subscriptions: dict[tuple[str, int], set[Subscription]] = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+
+        # Stats
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, table: str, device_id: int, notify: Callable[[], None]) -> Subscription:
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        subscription = Subscription((table, device_id), self.buffer_size, notify)
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise HubFull(f"Too many live clients, at most {self.max_subscribers}")
+            self._subscriptions[subscription.key].add(subscription)
+            self._count += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.key)
+            if subscriptions is None or subscription not in subscriptions:
+                return
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self._subscriptions[subscription.key]
+            self._count -= 1
+
+    def publish(self, batch: list[tuple[str, tuple]]) -> None:
+        """Fan out committed (table, (device_id, timestamp, value)) readings to the subscribers of their device."""
+        if not self._subscriptions:
+            return
+        rows_by_key = defaultdict(list)
+        for table, row in batch:
+            if (table, row[0]) in self._subscriptions:
+                rows_by_key[(table, row[0])].append(row)
+
+        for key, rows in rows_by_key.items():
+            with self._lock:
+                subscriptions = list(self._subscriptions.get(key, ()))
+            if not subscriptions:
+                continue
+            event = readings_event(key[0], rows)
+            for subscription in subscriptions:
+                subscription.push(event)
+            self.published += len(rows)
+            self.delivered += len(rows) * len(subscriptions)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "subscribers": self._count,
+                "devices": len(self._subscriptions),
+                "published": self.published,
+                "delivered": self.delivered,
+            }
+
+
+def readings_event(table: str, rows: list[tuple]) -> str:
+    # One SSE 'readings' event per device and commit, oldest reading first
+    value_col, _ = READING_COLUMNS[table]
+    data = json.dumps(
+        [{"device_id": device_id, "timestamp": timestamp, value_col: value} for device_id, timestamp, value in rows]
+    )
+    return f"event: readings\ndata: {data}\n\n"
+
+
+def lagged_event(dropped: int) -> str:
+    return f"event: lagged\ndata: {json.dumps({'dropped': dropped})}\n\n"
+
+
+# Sent on an idle stream so proxies keep it open and a gone client is noticed on the next write
+KEEPALIVE_EVENT = ": keepalive\n\n"
+# Browsers reconnect 3s after a dropped stream
+RETRY_EVENT = "retry: 3000\n\n"
+
+
+class EventStream:
+    """Blocking SSE stream of a device's new readings, for a thread per client server (Flask).
+
+    Subscribes right away, so a full hub is reported before the response starts. Unsubscribes on `close()`, which
+    the WSGI server calls once the client is gone.
+    """
+
+    def __init__(self, hub: ReadingsHub, table: str, device_id: int, keepalive_interval: float = 15.0):
+        self.hub = hub
+        self.keepalive_interval = keepalive_interval
+        self._wakeup = threading.Event()
+        self.subscription = hub.subscribe(table, device_id, self._wakeup.set)
+
+    def __iter__(self) -> Iterator[str]:
+        yield RETRY_EVENT
+        while True:
+            if not self._wakeup.wait(self.keepalive_interval):
+                yield KEEPALIVE_EVENT
+                continue
+            self._wakeup.clear()
+            yield from pending_events(self.subscription)
+
+    def close(self) -> None:
+        self.hub.unsubscribe(self.subscription)
+
+
+def pending_events(subscription: Subscription) -> list[str]:
+    events, dropped = subscription.drain()
+    if dropped:
+        # Events were lost, the page reloads instead of showing a gap
+        return [lagged_event(dropped), "".join(events)]
+    return ["".join(events)] if events else []
@@ -0,0 +1,516 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+import sys
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+from latest import apply_latest
+from metrics import (
+    INGEST_COMMIT_ERRORS,
+    INGEST_COMMIT_READINGS,
+    INGEST_COMMIT_SECONDS,
+    READINGS_ACCEPTED,
+    REJECTED,
+)
+from partitions import READING_COLUMNS, create_partition, month_of, reserve_ids
+from rollups import apply_rollups
+
+logger = logging.getLogger(__name__)
+
+_ACCEPTED = {table: READINGS_ACCEPTED.labels(table) for table in READING_COLUMNS}
+
+FULL_POLICIES = ("block", "drop")
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class IngestWriteError(Exception):
+    pass
+
+
+class _BulkWrite:
+    # Readings flushed together in their own transaction, the producer waits on `done` for the outcome
+    __slots__ = ("done", "error", "items", "written")
+
+    def __init__(self, items: list[tuple], done: threading.Event | asyncio.Future | None = None):
+        self.items = items
+        self.done = done if done is not None else threading.Event()
+        self.error: str | None = None
+        self.written: list[tuple] = []
+
+
+def write_readings(db: sqlite3.Connection, batch: list[tuple]) -> list[tuple]:
+    """Insert (table, (device_id, timestamp, value, seq)) readings and their rollups in one transaction.
+
+    A reading of a device with a seq already stored (i.e. a replayed MQTT message, see payloads.reading_seq) is
+    ignored. Returns the (table, (device_id, timestamp, value)) readings actually inserted, only those are counted in
+    the rollups and latest readings.
+    """
+    rows_by_partition = defaultdict(list)
+    for table, row in batch:
+        rows_by_partition[(table, month_of(row[1]))].append(row)
+
+    with db:
+        rows_by_table = defaultdict(list)
+        for (table, month), rows in rows_by_partition.items():
+            # IF NOT EXISTS is a cheap schema lookup, and copes with partitions dropped by retention
+            partition = create_partition(db, table, month)
+            value_col = READING_COLUMNS[table][0]
+            # Ids from the sequence shared by the table's partitions, those of ignored duplicates are left unused
+            first_id = reserve_ids(db, table, len(rows))
+            stmt = (
+                f"INSERT OR IGNORE INTO {partition} (id, device_id, timestamp, {value_col}, seq) VALUES (?, ?, ?, ?, ?)"
+            )
+            inserted = db.executemany(stmt, [(first_id + i, *row) for i, row in enumerate(rows)]).rowcount
+            if inserted < len(rows):
+                # Duplicates were skipped (or the batch repeats a reading), the inserted rows are read back by id
+                rows_by_table[table].extend(
+                    db.execute(
+                        f"SELECT device_id, timestamp, {value_col} FROM {partition} WHERE id >= ? ORDER BY id",
+                        (first_id,),
+                    )
+                )
+            else:
+                rows_by_table[table].extend(row[:3] for row in rows)
+        for table, rows in rows_by_table.items():
+            # Rollups and latest readings are kept in step with the raw readings, in the same transaction
+            apply_rollups(db, table, rows)
+            apply_latest(db, table, rows)
+    return [(table, row) for table, rows in rows_by_table.items() for row in rows]
+
+
+class _IngestWriter:
+    # Settings, stats and flushing shared by the threaded and the asyncio ingest queues
+
+    def __init__(
+        self,
+        db_path: str,
+        max_batch: int,
+        flush_interval: float,
+        full_policy: str,
+        block_timeout: float,
+        maintenance: Callable[[sqlite3.Connection], None] | None,
+        maintenance_interval: float,
+        on_commit: Callable[[list[tuple]], None] | None,
+    ):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"Invalid full_policy={full_policy}. Expected one of {FULL_POLICIES}")
+        self.db_path = db_path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.full_policy = full_policy
+        self.block_timeout = block_timeout
+        self.maintenance = maintenance
+        self.maintenance_interval = maintenance_interval
+        self.on_commit = on_commit
+
+        self._queue: queue.Queue | asyncio.Queue
+        self._lock = threading.Lock()
+
+        # Stats
+        self.enqueued = 0
+        self.dropped = 0
+        self.flushed = 0
+        self.duplicates = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.last_flush_ms = 0.0
+        self.max_flush_ms = 0.0
+        self.total_flush_ms = 0.0
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        with self._lock:
+            avg_flush_ms = self.total_flush_ms / self.flush_count if self.flush_count else 0.0
+            return {
+                "queueDepth": self.depth,
+                "queueMaxSize": self._queue.maxsize,
+                "fullPolicy": self.full_policy,
+                "enqueued": self.enqueued,
+                "dropped": self.dropped,
+                "flushed": self.flushed,
+                "duplicates": self.duplicates,
+                "flushCount": self.flush_count,
+                "flushErrors": self.flush_errors,
+                "lastFlushMs": round(self.last_flush_ms, 3),
+                "avgFlushMs": round(avg_flush_ms, 3),
+                "maxFlushMs": round(self.max_flush_ms, 3),
+            }
+
+    def _count_enqueued(self, table: str, n: int) -> None:
+        with self._lock:
+            self.enqueued += n
+        _ACCEPTED[table].inc(n)
+
+    def _count_dropped(self, n: int) -> None:
+        with self._lock:
+            self.dropped += n
+        REJECTED["queue_full"].inc(n)
+
+    def _run_maintenance(self, db: sqlite3.Connection) -> None:
+        try:
+            self.maintenance(db)
+        except sqlite3.Error as e:
+            logger.error(f"Ingest writer maintenance failed: {e}")
+
+    def _committed(self, batch: list) -> None:
+        # Hands the committed readings on, i.e. to the live readings hub
+        if self.on_commit is None or not batch:
+            return
+        try:
+            self.on_commit(batch)
+        except Exception:
+            logger.exception("Ingest on_commit callback failed")
+
+    def _flush(self, db: sqlite3.Connection, batch: list) -> tuple[list, str | None]:
+        # Writes the readings in one transaction, returns the ones inserted, or the error if it was rolled back
+        start = time.perf_counter()
+        try:
+            written = write_readings(db, batch)
+        except sqlite3.Error as e:
+            with self._lock:
+                self.flush_errors += 1
+            INGEST_COMMIT_ERRORS.inc()
+            logger.error(f"Failed to flush {len(batch)} readings: {e}")
+            return [], str(e)
+        elapsed = time.perf_counter() - start
+        elapsed_ms = elapsed * 1000
+        INGEST_COMMIT_SECONDS.observe(elapsed)
+        INGEST_COMMIT_READINGS.observe(len(batch))
+        duplicates = len(batch) - len(written)
+        if duplicates:
+            REJECTED["duplicate"].inc(duplicates)
+
+        with self._lock:
+            self.flushed += len(written)
+            self.duplicates += duplicates
+            self.flush_count += 1
+            self.last_flush_ms = elapsed_ms
+            self.max_flush_ms = max(self.max_flush_ms, elapsed_ms)
+            self.total_flush_ms += elapsed_ms
+        logger.debug(f"Flushed {len(written)} readings ({duplicates} duplicates) in {elapsed_ms:.2f}ms")
+        return written, None
+
+
+class IngestQueue(_IngestWriter):
+    """Bounded write-behind queue for readings, drained by a single writer thread.
+
+    Readings are buffered in memory and flushed with one `executemany` per monthly partition inside a
+    single transaction, either when `max_batch` readings are waiting or `flush_interval` seconds have
+    passed since the first buffered reading. Bulk uploads (`put_many`) get a transaction of their own. An optional
+    `maintenance` callable (i.e. retention) runs on the writer connection every `maintenance_interval` seconds,
+    so it never competes for the write lock.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_batch: int = 500,
+        flush_interval: float = 0.5,
+        max_size: int = 10000,
+        full_policy: str = "block",
+        block_timeout: float = 1.0,
+        maintenance: Callable[[sqlite3.Connection], None] | None = None,
+        maintenance_interval: float = 3600.0,
+        on_commit: Callable[[list[tuple]], None] | None = None,
+    ):
+        super().__init__(
+            db_path, max_batch, flush_interval, full_policy, block_timeout, maintenance, maintenance_interval, on_commit
+        )
+        self._queue: queue.Queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    ### Producer side ###
+    def put(self, table: str, device_id: int, timestamp, value, seq: int | None = None) -> bool:
+        """Enqueue a reading. Returns False if it was dropped because the queue is full.
+
+        A reading with a `seq` is stored once per device and seq, see payloads.reading_seq.
+        """
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        item = (table, (device_id, timestamp, value, seq))
+        try:
+            if self.full_policy == "block":
+                self._queue.put(item, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(item)
+        except queue.Full:
+            self._count_dropped(1)
+            if self.full_policy == "block":
+                raise IngestQueueFull(f"Ingest queue full after waiting {self.block_timeout}s") from None
+            return False
+
+        self._count_enqueued(table, 1)
+        return True
+
+    def put_many(self, table: str, rows: list[tuple], timeout: float = 30.0) -> int:
+        """Write (device_id, timestamp, value, seq) readings in a single transaction of the writer thread.
+
+        Blocks until they are committed and returns how many were inserted, duplicates of stored readings are not.
+        Waits at most `block_timeout` for room in the queue whatever the full policy, raising IngestQueueFull, then up
+        to `timeout` seconds for the commit, raising TimeoutError.
+        Raises IngestWriteError if the transaction failed, in which case none of the readings were written.
+        """
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        bulk = _BulkWrite([(table, row) for row in rows])
+        try:
+            self._queue.put(bulk, timeout=self.block_timeout)
+        except queue.Full:
+            self._count_dropped(len(rows))
+            raise IngestQueueFull(f"Ingest queue full after waiting {self.block_timeout}s") from None
+
+        self._count_enqueued(table, len(rows))
+        if not bulk.done.wait(timeout):
+            raise TimeoutError(f"Readings not written after waiting {timeout}s")
+        if bulk.error is not None:
+            raise IngestWriteError(bulk.error)
+        return len(bulk.written)
+
+    ### Writer side ###
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Started ingest writer: max_batch={self.max_batch}, flush_interval={self.flush_interval}s, "
+            f"max_size={self._queue.maxsize}, full_policy={self.full_policy}"
+        )
+
+    def stop(self, timeout: float = 5.0) -> None:
+        # Writer drains what is left in the queue before exiting
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self) -> None:
+        db = database.connect(self.db_path)
+        next_maintenance = time.monotonic()
+        try:
+            while not (self._stop.is_set() and self._queue.empty()):
+                if self.maintenance is not None and time.monotonic() >= next_maintenance:
+                    self._run_maintenance(db)
+                    next_maintenance = time.monotonic() + self.maintenance_interval
+                batch = self._collect_batch()
+                readings = [item for item in batch if not isinstance(item, _BulkWrite)]
+                if readings:
+                    written, error = self._flush(db, readings)
+                    if error is None:
+                        self._committed(written)
+                for item in batch:
+                    if isinstance(item, _BulkWrite):
+                        item.written, item.error = self._flush(db, item.items)
+                        item.done.set()
+                        if item.error is None:
+                            self._committed(item.written)
+        finally:
+            db.close()
+
+    def _collect_batch(self) -> list:
+        # Wait for a first reading, then gather more until batch is full or interval elapsed
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        # A waiting bulk upload is flushed right away, its producer is blocked on the commit
+        while len(batch) < self.max_batch and not isinstance(batch[-1], _BulkWrite):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stop.is_set():
+                # Still grab whatever is immediately available
+                try:
+                    while len(batch) < self.max_batch and not isinstance(batch[-1], _BulkWrite):
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    pass
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+
+class AsyncIngestQueue(_IngestWriter):
+    """IngestQueue for the asyncio runtime: readings are queued and batched on the event loop.
+
+    Same batching, full policy, bulk transactions and maintenance as IngestQueue, but producers await `put` and
+    `put_many` instead of blocking a thread. Only the SQLite writes run off the loop, on a single executor thread
+    that owns the writer connection.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        max_batch: int = 500,
+        flush_interval: float = 0.5,
+        max_size: int = 10000,
+        full_policy: str = "block",
+        block_timeout: float = 1.0,
+        maintenance: Callable[[sqlite3.Connection], None] | None = None,
+        maintenance_interval: float = 3600.0,
+        on_commit: Callable[[list[tuple]], None] | None = None,
+    ):
+        super().__init__(
+            db_path, max_batch, flush_interval, full_policy, block_timeout, maintenance, maintenance_interval, on_commit
+        )
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_size)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self._room = asyncio.Event()
+        self._stopping = False
+        self._task: asyncio.Task | None = None
+
+    ### Producer side ###
+    def put_nowait(self, table: str, device_id: int, timestamp, value, seq: int | None = None) -> bool:
+        """Enqueue a reading without waiting, whatever the full policy. Returns False if it was dropped."""
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        try:
+            self._queue.put_nowait((table, (device_id, timestamp, value, seq)))
+        except asyncio.QueueFull:
+            self._count_dropped(1)
+            return False
+
+        self._count_enqueued(table, 1)
+        return True
+
+    async def put(self, table: str, device_id: int, timestamp, value, seq: int | None = None) -> bool:
+        """Enqueue a reading, see IngestQueue.put. Returns False if it was dropped because the queue is full."""
+        if self.full_policy == "drop" or not self._queue.full():
+            return self.put_nowait(table, device_id, timestamp, value, seq)
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        try:
+            await asyncio.wait_for(self._queue.put((table, (device_id, timestamp, value, seq))), self.block_timeout)
+        except TimeoutError:
+            self._count_dropped(1)
+            raise IngestQueueFull(f"Ingest queue full after waiting {self.block_timeout}s") from None
+
+        self._count_enqueued(table, 1)
+        return True
+
+    def room(self) -> int:
+        """Readings that can be enqueued right now without hitting the full policy."""
+        if self._queue.maxsize <= 0:
+            return sys.maxsize
+        return self._queue.maxsize - self._queue.qsize()
+
+    async def wait_for_room(self, n: int = 1) -> None:
+        # Lets a paused producer (i.e. the MQTT reader) resume once the writer took batches off the queue
+        n = min(n, self._queue.maxsize) if self._queue.maxsize > 0 else n
+        while self.room() < n:
+            self._room.clear()
+            await self._room.wait()
+
+    async def put_many(self, table: str, rows: list[tuple], timeout: float = 30.0) -> int:
+        """Write (device_id, timestamp, value, seq) readings in a single transaction, see IngestQueue.put_many."""
+        if table not in READING_COLUMNS:
+            raise ValueError(f"Unknown readings table: {table}")
+        bulk = _BulkWrite([(table, row) for row in rows], done=asyncio.get_running_loop().create_future())
+        try:
+            await asyncio.wait_for(self._queue.put(bulk), self.block_timeout)
+        except TimeoutError:
+            self._count_dropped(len(rows))
+            raise IngestQueueFull(f"Ingest queue full after waiting {self.block_timeout}s") from None
+
+        self._count_enqueued(table, len(rows))
+        try:
+            # Shielded, the transaction outcome is still recorded when the waiting producer gives up
+            await asyncio.wait_for(asyncio.shield(bulk.done), timeout)
+        except TimeoutError:
+            raise TimeoutError(f"Readings not written after waiting {timeout}s") from None
+        if bulk.error is not None:
+            raise IngestWriteError(bulk.error)
+        return len(bulk.written)
+
+    ### Writer side ###
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="ingest-writer")
+        logger.info(
+            f"Started async ingest writer: max_batch={self.max_batch}, flush_interval={self.flush_interval}s, "
+            f"max_size={self._queue.maxsize}, full_policy={self.full_policy}"
+        )
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        # Writer drains what is left in the queue before exiting
+        self._stopping = True
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except TimeoutError:
+                logger.error(f"Ingest writer still busy after {timeout}s, {self.depth} readings left in the queue")
+            self._task = None
+        self._executor.shutdown(wait=False)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        db = await loop.run_in_executor(self._executor, database.connect, self.db_path)
+        next_maintenance = time.monotonic()
+        try:
+            while not (self._stopping and self._queue.empty()):
+                if self.maintenance is not None and time.monotonic() >= next_maintenance:
+                    await loop.run_in_executor(self._executor, self._run_maintenance, db)
+                    next_maintenance = time.monotonic() + self.maintenance_interval
+                batch = await self._collect_batch()
+                readings = [item for item in batch if not isinstance(item, _BulkWrite)]
+                # Committed readings are handed on from the loop thread
+                if readings:
+                    written, error = await loop.run_in_executor(self._executor, self._flush, db, readings)
+                    if error is None:
+                        self._committed(written)
+                for item in batch:
+                    if isinstance(item, _BulkWrite):
+                        item.written, item.error = await loop.run_in_executor(
+                            self._executor, self._flush, db, item.items
+                        )
+                        if not item.done.done():
+                            item.done.set_result(None)
+                        if item.error is None:
+                            self._committed(item.written)
+        finally:
+            await loop.run_in_executor(self._executor, db.close)
+
+    async def _collect_batch(self) -> list:
+        # Wait for a first reading, then gather more until batch is full or interval elapsed
+        try:
+            batch = [await asyncio.wait_for(self._queue.get(), self.flush_interval)]
+        except TimeoutError:
+            return []
+
+        deadline = time.monotonic() + self.flush_interval
+        # A waiting bulk upload is flushed right away, its producer is waiting on the commit
+        while len(batch) < self.max_batch and not isinstance(batch[-1], _BulkWrite):
+            # Whatever is immediately available first, without a timer per reading
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or self._stopping:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except TimeoutError:
+                break
+        self._room.set()
+        return batch
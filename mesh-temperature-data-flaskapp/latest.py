@@ -0,0 +1,71 @@
+"""Latest reading of every device, one row per device kept up to date by the ingest writer.
+
+Fleet overviews (`/api/*-readings/latest`) read these tables instead of a readings query per device. Rows are
+upserted in the same transaction as the raw readings and rollups; a late reading older than the stored one leaves it
+unchanged. Retention drops raw partitions but not these rows, a device keeps its last known reading.
+"""
+
+import logging
+import sqlite3
+
+from partitions import list_partitions
+
+logger = logging.getLogger(__name__)
+
+# readings table -> (latest readings table, value column)
+LATEST_TABLES = {
+    "gateway_readings": ("gateway_readings_latest", "rssi"),
+    "sensor_temperature_readings": ("sensor_temperature_readings_latest", "temperature"),
+}
+
+
+def create_latest_tables(db: sqlite3.Connection) -> None:
+    for latest_table, value_col in LATEST_TABLES.values():
+        value_type = "INTEGER" if value_col == "rssi" else "REAL"
+        db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {latest_table} (
+                device_id INTEGER PRIMARY KEY REFERENCES devices(id),
+                timestamp DATETIME NOT NULL,
+                {value_col} {value_type} NOT NULL
+            )
+            """
+        )
+
+
+def latest_batch(rows: list[tuple]) -> list[tuple]:
+    """Newest (device_id, timestamp, value) reading per device of a batch, ties go to the one inserted last."""
+    newest: dict[int, tuple] = {}
+    for row in rows:
+        current = newest.get(row[0])
+        if current is None or row[1] >= current[1]:
+            newest[row[0]] = row
+    return list(newest.values())
+
+
+def apply_latest(db: sqlite3.Connection, table: str, rows: list[tuple]) -> None:
+    """Upsert the newest of a batch of (device_id, timestamp, value) readings, inside the caller's transaction."""
+    latest_table, value_col = LATEST_TABLES[table]
+    db.executemany(
+        f"""
+        INSERT INTO {latest_table} (device_id, timestamp, {value_col}) VALUES (?, ?, ?)
+        ON CONFLICT (device_id) DO UPDATE SET timestamp = excluded.timestamp, {value_col} = excluded.{value_col}
+        WHERE excluded.timestamp >= timestamp
+        """,
+        latest_batch(rows),
+    )
+
+
+def backfill_latest(db: sqlite3.Connection, table: str) -> None:
+    """Rebuild the latest readings of a readings table from its raw readings, inside the caller's transaction."""
+    latest_table, value_col = LATEST_TABLES[table]
+    db.execute(f"DELETE FROM {latest_table}")
+    # Newest partition first, a device's newest reading is in the newest partition holding any of its readings
+    for partition, _ in reversed(list_partitions(db, table)):
+        # Bare column with MAX(): SQLite takes the value from the row holding the maximum
+        db.execute(
+            f"INSERT OR IGNORE INTO {latest_table} (device_id, timestamp, {value_col}) "
+            f"SELECT device_id, MAX(timestamp), {value_col} FROM {partition} "
+            f"WHERE device_id IS NOT NULL AND timestamp IS NOT NULL GROUP BY device_id"
+        )
+    logger.info(f"Backfilled {latest_table}")
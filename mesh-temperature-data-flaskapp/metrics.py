@@ -0,0 +1,271 @@
+"""In-process metrics of the ingest hot path and the HTTP API, rendered in the Prometheus text format at /metrics.
+
+Metrics are module-level and process-wide, like loggers. Hot paths bind their label values once
+(`MQTT_MESSAGES.labels("gateway")`) so recording is a lock and an add. `configure(enabled=False)` turns every
+recording into a no-op, `configure(log_sample_rate=...)` samples the per-message INFO logs (see MessageLogSampler).
+"""
+
+import bisect
+import logging
+import random
+import threading
+from collections.abc import Callable, Iterable
+
+# Latency buckets in seconds, from the µs of a parse or registry hit to the ms of a commit or HTTP request
+LATENCY_BUCKETS = (
+    0.00001,
+    0.000025,
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+_enabled = True
+
+
+def configure(enabled: bool = True, log_sample_rate: float = 1.0) -> None:
+    global _enabled
+    _enabled = enabled
+    message_log.rate = log_sample_rate
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels_text(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """Child metric of the label values, bind it once outside of hot paths."""
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _sorted_children(self) -> list:
+        with self._lock:
+            return sorted(self._children.items())
+
+    def _samples(self) -> Iterable[tuple[str, str, float]]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self._samples())
+        return "\n".join(lines)
+
+
+class _CounterChild:
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        if not _enabled:
+            return
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1) -> None:
+        self.labels().inc(amount)
+
+    def _samples(self):
+        for values, child in self._sorted_children():
+            yield self.name, _labels_text(self.labelnames, values), child.value
+
+
+class Gauge(_Metric):
+    """Value read when the metrics are rendered, i.e. a queue depth, from the function given to `set_function`."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, registry=None):
+        super().__init__(name, documentation, registry=registry)
+        self._function: Callable[[], float] | None = None
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def _samples(self):
+        if self._function is not None:
+            yield self.name, "", self._function()
+
+
+class _HistogramChild:
+    __slots__ = ("_lock", "buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        if not _enabled:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+        registry=None,
+    ):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _samples(self):
+        for values, child in self._sorted_children():
+            with child._lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float("inf")), counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket", _labels_text(self.labelnames, values, le), cumulative
+            yield f"{self.name}_sum", _labels_text(self.labelnames, values), total
+            yield f"{self.name}_count", _labels_text(self.labelnames, values), cumulative
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> None:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+###### Ingest and API metrics ######
+MQTT_MESSAGES = Counter("mesh_mqtt_messages_total", "MQTT messages received, by readings topic", ["topic"])
+READINGS_ACCEPTED = Counter("mesh_readings_accepted_total", "Readings validated and queued for ingest", ["table"])
+READINGS_REJECTED = Counter("mesh_readings_rejected_total", "Readings or messages rejected, by reason", ["reason"])
+INGEST_STAGE_SECONDS = Histogram(
+    "mesh_ingest_stage_seconds", "Time per message in the parse, device lookup and enqueue stages", ["stage"]
+)
+INGEST_COMMIT_SECONDS = Histogram("mesh_ingest_commit_seconds", "Time of an ingest writer transaction")
+INGEST_COMMIT_READINGS = Histogram(
+    "mesh_ingest_commit_readings", "Readings per ingest writer transaction", buckets=(1, 10, 50, 100, 500, 1000, 5000)
+)
+INGEST_COMMIT_ERRORS = Counter("mesh_ingest_commit_errors_total", "Ingest writer transactions rolled back")
+INGEST_QUEUE_DEPTH = Gauge("mesh_ingest_queue_depth", "Readings waiting for the ingest writer")
+LIVE_SUBSCRIBERS = Gauge("mesh_live_subscribers", "Open live readings streams")
+RESPONSE_CACHE_LOOKUPS = Counter("mesh_response_cache_lookups_total", "Readings response cache lookups", ["result"])
+HOT_WINDOW_LOOKUPS = Counter(
+    "mesh_hot_window_lookups_total", "Aggregations answered from the hot window (hit) or left to the db", ["result"]
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "mesh_http_request_duration_seconds", "HTTP request latency, by route", ["method", "route", "status"]
+)
+
+# Bound once for the hot paths
+REJECT_REASONS = (
+    "invalid_payload",
+    "unknown_topic",
+    "missing_mac",
+    "unknown_device",
+    "missing_field",
+    "invalid_timestamp",
+    "invalid_value",
+    "invalid_seq",
+    "queue_full",
+    "duplicate",
+)
+REJECTED = {reason: READINGS_REJECTED.labels(reason) for reason in REJECT_REASONS}
+TOPIC_MESSAGES = {topic: MQTT_MESSAGES.labels(topic) for topic in ("gateway", "temperature", "unknown")}
+PARSE_SECONDS = INGEST_STAGE_SECONDS.labels("parse")
+LOOKUP_SECONDS = INGEST_STAGE_SECONDS.labels("lookup")
+ENQUEUE_SECONDS = INGEST_STAGE_SECONDS.labels("enqueue")
+
+
+class MessageLogSampler:
+    """Samples the per-message INFO logs of the ingest and readings hot paths.
+
+    `rate` 1 logs every message, 0 none, in between that fraction of them. Check `enabled(logger)` before building
+    the log message, so dropped lines cost no formatting either.
+    """
+
+    def __init__(self, rate: float = 1.0):
+        self.rate = rate
+
+    def enabled(self, logger: logging.Logger) -> bool:
+        if not logger.isEnabledFor(logging.INFO):
+            return False
+        return self.rate >= 1 or (self.rate > 0 and random.random() < self.rate)
+
+
+message_log = MessageLogSampler()
@@ -0,0 +1,159 @@
+import logging
+import sqlite3
+from collections.abc import Callable
+from dataclasses import dataclass
+
+from latest import LATEST_TABLES, backfill_latest, create_latest_tables
+from partitions import (
+    READING_COLUMNS,
+    create_partition_index,
+    create_partition_indexes,
+    list_partitions,
+    move_to_partitions,
+)
+from rollups import ROLLUP_TABLES, backfill_rollups, create_rollup_tables
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: str | Callable[[sqlite3.Connection], None]  # SQL script or function run inside the transaction
+
+
+def _create_and_backfill_rollups(db: sqlite3.Connection) -> None:
+    create_rollup_tables(db)
+    for table in ROLLUP_TABLES:
+        backfill_rollups(db, table)
+
+
+def _partition_readings(db: sqlite3.Connection) -> None:
+    # Existing readings move to monthly partitions, rollups are then rebuilt from the partitions
+    for table in READING_COLUMNS:
+        move_to_partitions(db, table)
+    for table in ROLLUP_TABLES:
+        backfill_rollups(db, table)
+
+
+def _unique_readings(db: sqlite3.Connection) -> None:
+    # Readings stored twice (replayed MQTT messages) are removed keeping the first stored one, then each partition's
+    # index becomes unique on (device_id, timestamp). Rollups are rebuilt if duplicates were counted in them
+    removed = 0
+    for table in READING_COLUMNS:
+        for partition, _ in list_partitions(db, table):
+            removed += db.execute(
+                f"DELETE FROM {partition} WHERE id NOT IN (SELECT MIN(id) FROM {partition} GROUP BY device_id, timestamp)"
+            ).rowcount
+            db.execute(f"DROP INDEX IF EXISTS idx_{partition}_device_ts")
+            create_partition_index(db, partition)
+    if removed:
+        logger.info(f"Removed {removed} duplicate readings")
+        for table in ROLLUP_TABLES:
+            backfill_rollups(db, table)
+
+
+def _create_and_backfill_latest(db: sqlite3.Connection) -> None:
+    create_latest_tables(db)
+    for table in LATEST_TABLES:
+        backfill_latest(db, table)
+
+
+def _readings_seq(db: sqlite3.Connection) -> None:
+    # Readings are stored once per device and seq instead of per device and timestamp, see payloads.reading_seq.
+    # Stored readings are unique per device and timestamp since migration 5, they are keyed by their timestamp like
+    # readings the node timestamped. Partitions made by migration 4 in the same run already have the column
+    for table in READING_COLUMNS:
+        for partition, _ in list_partitions(db, table):
+            columns = {row[1] for row in db.execute(f"PRAGMA table_info({partition})")}
+            if "seq" not in columns:
+                db.execute(f"ALTER TABLE {partition} ADD COLUMN seq INTEGER")
+            db.execute(f"UPDATE {partition} SET seq = CAST(strftime('%s', timestamp) AS INTEGER) WHERE seq IS NULL")
+            db.execute(f"DROP INDEX IF EXISTS idx_{partition}_device_ts")
+            create_partition_indexes(db, partition)
+
+
+# Baseline schema (version 0) is sqlite/init.sql, migrations are applied in order on top of it.
+# NEVER edit an already released migration, append a new one instead.
+MIGRATIONS: list[Migration] = [
+    Migration(
+        1,
+        "Covering (device_id, timestamp) indexes on readings tables",
+        """
+        CREATE INDEX IF NOT EXISTS idx_gateway_readings_device_ts
+            ON gateway_readings (device_id, timestamp, rssi, received_time);
+        CREATE INDEX IF NOT EXISTS idx_sensor_temperature_readings_device_ts
+            ON sensor_temperature_readings (device_id, timestamp, temperature, received_time);
+        """,
+    ),
+    Migration(
+        2,
+        "Readings indexes ordered on (timestamp, id) for keyset pagination",
+        """
+        DROP INDEX IF EXISTS idx_gateway_readings_device_ts;
+        DROP INDEX IF EXISTS idx_sensor_temperature_readings_device_ts;
+        CREATE INDEX idx_gateway_readings_device_ts
+            ON gateway_readings (device_id, timestamp, id, rssi, received_time);
+        CREATE INDEX idx_sensor_temperature_readings_device_ts
+            ON sensor_temperature_readings (device_id, timestamp, id, temperature, received_time);
+        """,
+    ),
+    Migration(3, "Per minute/hour/day rollup tables of readings", _create_and_backfill_rollups),
+    Migration(4, "Split readings tables into monthly partitions", _partition_readings),
+    Migration(5, "Unique (device_id, timestamp) readings, duplicates removed", _unique_readings),
+    Migration(6, "Latest reading per device tables", _create_and_backfill_latest),
+    Migration(
+        7, "Readings stored once per device and seq, (device_id, timestamp) indexes no longer unique", _readings_seq
+    ),
+]
+
+
+def split_statements(script: str) -> list[str]:
+    # Split on ';' only where SQLite agrees the statement is complete (trigger bodies contain ';')
+    statements, current = [], ""
+    for part in script.split(";"):
+        current += part + ";"
+        if sqlite3.complete_statement(current):
+            if current.strip(" \n;"):
+                statements.append(current.strip())
+            current = ""
+    return statements
+
+
+def get_schema_version(db: sqlite3.Connection) -> int:
+    return db.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(db_path: str, target_version: int | None = None) -> int:
+    """Apply pending migrations to the db, each in its own transaction. Returns the resulting schema version."""
+    db = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        current_version = get_schema_version(db)
+        for migration in MIGRATIONS:
+            if migration.version <= current_version:
+                continue
+            if target_version is not None and migration.version > target_version:
+                break
+
+            logger.info(f"Applying migration {migration.version}: {migration.description}")
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if isinstance(migration.apply, str):
+                    for stmt in split_statements(migration.apply):
+                        db.execute(stmt)
+                else:
+                    migration.apply(db)
+                # user_version is part of the db header, updated atomically with the migration
+                db.execute(f"PRAGMA user_version = {migration.version:d}")
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                logger.error(f"Migration {migration.version} failed, schema left at version {current_version}")
+                raise
+            current_version = migration.version
+
+        logger.info(f"Database schema at version {current_version}")
+        return current_version
+    finally:
+        db.close()
@@ -0,0 +1,165 @@
+import logging
+import sqlite3
+from datetime import UTC, datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Readings tables split into monthly partitions, with their value column
+READING_COLUMNS = {
+    "gateway_readings": ("rssi", "INTEGER"),
+    "sensor_temperature_readings": ("temperature", "REAL"),
+}
+
+
+def month_of(timestamp: str) -> str:
+    # 'YYYY-MM' month of a 'YYYY-MM-DD HH:MM:SS' timestamp
+    return timestamp[:7]
+
+
+def partition_name(table: str, month: str) -> str:
+    return f"{table}_p{month[:4]}{month[5:7]}"
+
+
+def month_bounds(month: str) -> tuple[str, str]:
+    """[start, end) timestamps of a 'YYYY-MM' month, comparable with the stored timestamps."""
+    year, mon = int(month[:4]), int(month[5:7])
+    next_year, next_mon = (year + 1, 1) if mon == 12 else (year, mon + 1)
+    return f"{year:04d}-{mon:02d}-01 00:00:00", f"{next_year:04d}-{next_mon:02d}-01 00:00:00"
+
+
+def create_partition_index(db: sqlite3.Connection, name: str) -> None:
+    # Index of migration 5, unique on (device_id, timestamp). Kept as released, see create_partition_indexes
+    db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{name}_device_ts ON {name} (device_id, timestamp)")
+
+
+def create_partition_indexes(db: sqlite3.Connection, name: str) -> None:
+    # Rows are found by rowid (id) from the (device_id, timestamp) index, a wider covering index would double the
+    # cost of every insert. Not unique, readings stamped with their received time can share a second
+    db.execute(f"CREATE INDEX IF NOT EXISTS idx_{name}_device_ts ON {name} (device_id, timestamp)")
+    # One reading per device and seq (see payloads.reading_seq): replayed readings are ignored on insert. Those without
+    # a seq are left out of the index
+    db.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{name}_device_seq ON {name} (device_id, seq) WHERE seq IS NOT NULL"
+    )
+
+
+def create_partition(db: sqlite3.Connection, table: str, month: str) -> str:
+    """Create the partition of a readings table for a month if missing.
+
+    Same layout as the unpartitioned table, plus the `seq` readings are stored once per device by.
+    """
+    value_col, value_type = READING_COLUMNS[table]
+    name = partition_name(table, month)
+    db.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS {name} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            device_id INTEGER REFERENCES devices(id),
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            {value_col} {value_type} NOT NULL,
+            received_time DATETIME DEFAULT CURRENT_TIMESTAMP,
+            seq INTEGER
+        )
+        """
+    )
+    create_partition_indexes(db, name)
+    return name
+
+
+def reserve_ids(db: sqlite3.Connection, table: str, count: int) -> int:
+    """First of `count` consecutive ids reserved for new readings of a table, inside the caller's transaction.
+
+    Partitions share one sequence so reading ids stay unique across months, each partition's own AUTOINCREMENT would
+    restart at 1. The sequence is the sqlite_sequence row of the unpartitioned table, which is kept (empty) for it.
+    """
+    row = db.execute("UPDATE sqlite_sequence SET seq = seq + ? WHERE name = ? RETURNING seq", (count, table)).fetchone()
+    if row is None:
+        # No reading was ever stored in the table
+        db.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, count))
+        return 1
+    return row[0] - count + 1
+
+
+def list_partitions(db: sqlite3.Connection, table: str) -> list[tuple[str, str]]:
+    """(partition table, 'YYYY-MM' month) of a readings table, oldest first."""
+    rows = db.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name",
+        (f"{table}_p[0-9][0-9][0-9][0-9][0-9][0-9]",),
+    ).fetchall()
+    return [(name, f"{name[-6:-2]}-{name[-2:]}") for (name,) in rows]
+
+
+def partitions_for_range(
+    db: sqlite3.Connection, table: str, readings_from: str | None = None, readings_to: str | None = None
+) -> list[str]:
+    """Partitions that can hold readings in [readings_from, readings_to], oldest first. Open bounds are allowed."""
+    partitions = []
+    for name, month in list_partitions(db, table):
+        start, end = month_bounds(month)
+        if readings_from and readings_from >= end:
+            continue
+        if readings_to and readings_to < start:
+            continue
+        partitions.append(name)
+    return partitions
+
+
+def move_to_partitions(db: sqlite3.Connection, table: str) -> None:
+    """Move the rows of an unpartitioned readings table into its monthly partitions, keeping their ids.
+
+    The emptied table stays: its sqlite_sequence row is the id sequence of the partitions, see reserve_ids.
+
+    Duplicate readings of a device at the same timestamp are moved once, the first stored one is kept.
+    """
+    value_col, _ = READING_COLUMNS[table]
+    months = [row[0] for row in db.execute(f"SELECT DISTINCT substr(timestamp, 1, 7) FROM {table}") if row[0]]
+    for month in months:
+        name = create_partition(db, table, month)
+        start, end = month_bounds(month)
+        db.execute(
+            f"INSERT OR IGNORE INTO {name} (id, device_id, timestamp, {value_col}, received_time) "
+            f"SELECT id, device_id, timestamp, {value_col}, received_time FROM {table} "
+            f"WHERE timestamp >= ? AND timestamp < ? ORDER BY id",
+            (start, end),
+        )
+        db.execute(f"DELETE FROM {table} WHERE timestamp >= ? AND timestamp < ?", (start, end))
+        logger.info(f"Moved {table} readings of {month} to {name}")
+
+
+def drop_expired_partitions(db: sqlite3.Connection, table: str, retention_days: int, now: datetime) -> list[str]:
+    """Drop partitions whose whole month is older than the retention. Returns the dropped partitions."""
+    cutoff = (now - timedelta(days=retention_days)).strftime("%Y-%m-%d %H:%M:%S")
+    dropped = []
+    for name, month in list_partitions(db, table):
+        _, end = month_bounds(month)
+        if end <= cutoff:
+            db.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+            logger.info(f"Dropped partition {name}, older than {retention_days} days")
+    return dropped
+
+
+def apply_retention(
+    db: sqlite3.Connection,
+    raw_retention_days: dict[str, int],
+    rollup_retention_days: dict[int, int],
+    rollup_tables: list[str],
+    now: datetime | None = None,
+) -> None:
+    """Expire raw partitions and rollup buckets past their retention (0 days keeps forever), in one transaction."""
+    # Naive local time, like the timestamps given to ingested readings
+    now = now or datetime.now()
+    with db:
+        for table, days in raw_retention_days.items():
+            if days > 0:
+                drop_expired_partitions(db, table, days, now)
+        for resolution, days in rollup_retention_days.items():
+            if days <= 0:
+                continue
+            cutoff_epoch = int((now - timedelta(days=days)).replace(tzinfo=UTC).timestamp())
+            for rollup_table in rollup_tables:
+                deleted = db.execute(
+                    f"DELETE FROM {rollup_table} WHERE resolution = ? AND bucket < ?", (resolution, cutoff_epoch)
+                ).rowcount
+                if deleted:
+                    logger.info(f"Expired {deleted} rollups of {rollup_table} at resolution={resolution}s")
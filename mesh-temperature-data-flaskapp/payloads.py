@@ -0,0 +1,167 @@
+"""Binary MQTT readings frames, the compact alternative to one JSON object per message.
+
+A frame holds many readings relayed by one gateway, little-endian:
+
+    header   <2sBBH   magic b"MR", format version, readings kind (0 gateway rssi, 1 temperature), readings count
+    reading  <6sIh    device MAC (raw bytes), unix timestamp (0 when the node has no clock), value
+
+Gateway values are the rssi, temperature values hundredths of a degree: 12 bytes per reading against ~70 for JSON.
+Frames are published on `<readings topic>/<gateway MAC>/bin`, or on the usual topic with the MQTT v5 content type
+`BINARY_CONTENT_TYPE`.
+
+JSON messages may carry the same unix timestamp as an integer `timestamp`, readings without one get the received time.
+A message may also carry its `seq`, the node's message sequence number. Readings are stored once per device and seq (see
+reading_seq), a replayed message is ignored. Frames have no seq, their readings are keyed by their unix timestamp.
+"""
+
+import struct
+import time
+from collections.abc import Callable
+from functools import lru_cache
+
+from metrics import REJECTED
+from rollups import timestamp_to_epoch
+
+BINARY_CONTENT_TYPE = "application/vnd.mesh-readings"
+BINARY_TOPIC_SUFFIX = "/bin"
+
+FRAME_MAGIC = b"MR"
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct("<2sBBH")
+FRAME_READING = struct.Struct("<6sIh")
+FRAME_MAX_READINGS = 0xFFFF
+
+# readings table -> (kind in the frame header, value scale)
+FRAME_KINDS = {
+    "gateway_readings": (0, 1),
+    "sensor_temperature_readings": (1, 100),
+}
+
+
+def is_device_clock(timestamp) -> bool:
+    # Unix timestamp from the node's clock, in the range of a frame's (0 when it has none). Not bool, a JSON true
+    return type(timestamp) is int and 0 < timestamp <= 0xFFFFFFFF
+
+
+def is_seq(seq) -> bool:
+    # Message sequence number of a node, a signed 64 bits SQLite INTEGER. Not bool, a JSON true
+    return type(seq) is int and 0 <= seq < 1 << 63
+
+
+def reading_seq(seq: int | None, timestamp: str | None) -> int | None:
+    """Key a reading is stored once per device by, `timestamp` being the stored timestamp if the node set it.
+
+    The message sequence number if the node sent one, else the seconds of its timestamp read as UTC (the same for a
+    unix and a 'YYYY-MM-DD HH:MM:SS' timestamp of that second, i.e. an export uploaded again). Readings with neither
+    (received time, no seq) get None and are always stored: a replay of those can't be told apart. A seq must not
+    repeat for a device within a month, nodes keep their counter across reboots or put a boot count in its high bits.
+    """
+    if seq is not None:
+        return seq
+    if timestamp is None:
+        return None
+    return timestamp_to_epoch(timestamp)
+
+
+@lru_cache(maxsize=4096)
+def local_timestamp(epoch: int) -> str:
+    """Stored 'YYYY-MM-DD HH:MM:SS' local time of a unix timestamp, formatted once per distinct second."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch))
+
+
+def received_timestamp() -> str:
+    # Current second, cached: the messages of a second share one string instead of a strftime each
+    return local_timestamp(int(time.time()))
+
+
+def is_binary(message) -> bool:
+    """Whether a paho message carries a binary frame, from its topic suffix or MQTT v5 content type."""
+    if message.topic.endswith(BINARY_TOPIC_SUFFIX):
+        return True
+    # Only MQTT v5 messages have properties
+    properties = getattr(message, "properties", None)
+    return getattr(properties, "ContentType", None) == BINARY_CONTENT_TYPE
+
+
+def device_topic_mac(topic: str) -> str:
+    # Devices publish on <readings topic>/<MAC>[/bin]
+    return topic.removesuffix(BINARY_TOPIC_SUFFIX).rpartition("/")[2]
+
+
+def mac_to_bytes(mac_address: str) -> bytes:
+    try:
+        raw = bytes.fromhex(mac_address.replace(":", ""))
+    except ValueError:
+        raise ValueError(f"Invalid MAC address: {mac_address}") from None
+    if len(raw) != 6:
+        raise ValueError(f"Invalid MAC address: {mac_address}")
+    return raw
+
+
+def encode_frame(table: str, readings: list[tuple[str, int, float]]) -> bytes:
+    """Frame of (MAC address, unix timestamp or 0, value) readings for a readings table."""
+    if len(readings) > FRAME_MAX_READINGS:
+        raise ValueError(f"Too many readings for one frame: {len(readings)}. At most {FRAME_MAX_READINGS}")
+    kind, scale = FRAME_KINDS[table]
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, kind, len(readings))
+    return header + b"".join(
+        FRAME_READING.pack(mac_to_bytes(mac_address), timestamp, round(value * scale))
+        for mac_address, timestamp, value in readings
+    )
+
+
+def decode_frame(payload: bytes, table: str) -> list[tuple[bytes, int, int | float]]:
+    """(raw MAC, unix timestamp or 0, value) readings of a frame published on a `table` topic.
+
+    Raises ValueError if the frame is malformed or holds readings of another kind.
+    """
+    if len(payload) < FRAME_HEADER.size:
+        raise ValueError(f"Frame too short: {len(payload)} bytes")
+    magic, version, kind, count = FRAME_HEADER.unpack_from(payload)
+    if magic != FRAME_MAGIC or version != FRAME_VERSION:
+        raise ValueError(f"Not a version {FRAME_VERSION} readings frame")
+    expected_kind, scale = FRAME_KINDS[table]
+    if kind != expected_kind:
+        raise ValueError(f"Frame of readings kind {kind} published on a {table} topic")
+    if len(payload) != FRAME_HEADER.size + count * FRAME_READING.size:
+        raise ValueError(f"Frame of {len(payload)} bytes does not hold {count} readings")
+
+    # All readings unpacked in one pass over the buffer
+    readings = FRAME_READING.iter_unpack(memoryview(payload)[FRAME_HEADER.size :])
+    if scale == 1:
+        return list(readings)
+    return [(mac, timestamp, value / scale) for mac, timestamp, value in readings]
+
+
+def frame_rows(
+    readings: list[tuple[bytes, int, int | float]],
+    lookup_device_id: Callable[[str], int | None],
+    received_time: str,
+) -> tuple[list[tuple], int]:
+    """(device_id, timestamp, value, seq) rows of decoded frame readings, and how many were from unknown devices.
+
+    Readings without a timestamp get the received time and no seq, like JSON messages without either.
+    """
+    rows, rejected = [], 0
+    # A gateway relays a handful of devices, each MAC is looked up once per frame
+    device_ids: dict[bytes, int | None] = {}
+    for mac, timestamp, value in readings:
+        if mac in device_ids:
+            device_id = device_ids[mac]
+        else:
+            device_id = device_ids[mac] = lookup_device_id(mac.hex(":").upper())
+        if device_id is None:
+            rejected += 1
+            continue
+        if timestamp:
+            timestamp = local_timestamp(timestamp)
+            rows.append((device_id, timestamp, value, reading_seq(None, timestamp)))
+        else:
+            rows.append((device_id, received_time, value, None))
+    if rejected:
+        REJECTED["unknown_device"].inc(rejected)
+    return rows, rejected
+
+
+def frame_macs(readings: list[tuple[bytes, int, int | float]]) -> set[str]:
+    return {mac.hex(":").upper() for mac in {reading[0] for reading in readings}}
@@ -0,0 +1,353 @@
+"""Readings and devices API logic shared by the Flask app and the asyncio runtime (async_app.py).
+
+Handlers take an open db connection, the device registry and the request parameters, and return the JSON body,
+so both runtimes serve the exact same responses.
+"""
+
+import base64
+import json
+import logging
+import sqlite3
+import time
+from collections.abc import Mapping
+from dataclasses import dataclass
+from datetime import datetime
+
+from bulk import is_valid_timestamp
+from config import READINGS_DEFAULT_LIMIT, READINGS_MAX_LIMIT
+from latest import LATEST_TABLES
+from metrics import LOOKUP_SECONDS, REJECTED, message_log
+from partitions import READING_COLUMNS, partitions_for_range
+from payloads import is_device_clock, is_seq, local_timestamp, reading_seq
+from registry import GATEWAY, TEMPERATURE, DeviceRegistry, parse_device_type
+from rollups import timestamp_to_epoch, window_stats
+from serialize import json_response, readings_json, rows_to_dicts
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ReadingKind:
+    table: str
+    value_col: str
+    convert: type  # int or float, applied to the submitted value
+    device_type: str
+    device_label: str  # in error messages, i.e. 'Gateway with MAC_address=... not found'
+    value_label: str  # in error messages, i.e. 'Invalid rssi format'
+    response_key: str  # readings list key of the GET response
+
+
+GATEWAY_READINGS = ReadingKind("gateway_readings", "rssi", int, GATEWAY, "Gateway", "rssi", "gatewayReadings")
+TEMPERATURE_READINGS = ReadingKind(
+    "sensor_temperature_readings", "temperature", float, TEMPERATURE, "Sensor", "temp", "sensorTemperatureReadings"
+)
+
+
+###### Readings pagination helpers ######
+def encode_cursor(timestamp: str, reading_id: int) -> str:
+    # Opaque keyset cursor on (timestamp, id)
+    return base64.urlsafe_b64encode(json.dumps([timestamp, reading_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, int]:
+    try:
+        timestamp, reading_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(timestamp, str) or not isinstance(reading_id, int):
+            raise TypeError
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid cursor: {cursor}") from None
+    return timestamp, reading_id
+
+
+def parse_readings_limit(limit: str | None) -> int:
+    if limit is None:
+        return READINGS_DEFAULT_LIMIT
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError(f"Invalid limit format. Could not convert {limit} to int.") from None
+    if not 1 <= limit <= READINGS_MAX_LIMIT:
+        raise ValueError(f"Invalid limit={limit}. Must be between 1 and {READINGS_MAX_LIMIT}")
+    return limit
+
+
+def query_readings_page(
+    db: sqlite3.Connection,
+    table: str,
+    device_id: int,
+    readings_from: str | None = None,
+    readings_to: str | None = None,
+    limit: int = READINGS_DEFAULT_LIMIT,
+    before: str | None = None,
+    after: str | None = None,
+) -> tuple[list, str | None, str | None]:
+    """One page of (id, device_id, timestamp, value, received_time) readings, newest first, with keyset cursors.
+
+    `before`/`after` are cursors from a previous page, the returned `next_cursor` is used as `before` to get older
+    readings and `prev_cursor` as `after` to get newer ones (None when there are no more readings that way).
+    """
+    conditions, args = ["device_id = ?"], [device_id]
+    if readings_from:
+        conditions.append("timestamp >= ?")
+        args.append(readings_from)
+    if readings_to:
+        conditions.append("timestamp <= ?")
+        args.append(readings_to)
+    # Cursors also narrow down the partitions to visit
+    partitions_from, partitions_to = readings_from, readings_to
+    if before:
+        before_timestamp, before_id = decode_cursor(before)
+        conditions.append("(timestamp, id) < (?, ?)")
+        args.extend((before_timestamp, before_id))
+        partitions_to = min(partitions_to, before_timestamp) if partitions_to else before_timestamp
+    if after:
+        after_timestamp, after_id = decode_cursor(after)
+        conditions.append("(timestamp, id) > (?, ?)")
+        args.extend((after_timestamp, after_id))
+        partitions_from = max(partitions_from, after_timestamp) if partitions_from else after_timestamp
+
+    value_col, _ = READING_COLUMNS[table]
+    # Paging forward from an 'after' cursor walks the index ascending, page is then flipped back to newest first
+    order = "ASC" if after and not before else "DESC"
+    partitions = partitions_for_range(db, table, partitions_from, partitions_to)
+    if order == "DESC":
+        partitions.reverse()
+
+    # Fan out over the monthly partitions in page order until the page is full.
+    # One extra row tells if there is another page
+    rows = []
+    for partition in partitions:
+        stmt = (
+            f"SELECT id, device_id, timestamp, {value_col}, received_time FROM {partition} "
+            f"WHERE {' AND '.join(conditions)} ORDER BY timestamp {order}, id {order} LIMIT ?"
+        )
+        rows.extend(db.execute(stmt, (*args, limit + 1 - len(rows))).fetchall())
+        if len(rows) > limit:
+            break
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if order == "ASC":
+        rows.reverse()
+
+    if not rows:
+        return rows, None, None
+    older_exists = has_more if order == "DESC" else True
+    newer_exists = has_more if order == "ASC" else before is not None or after is not None
+    next_cursor = encode_cursor(rows[-1][2], rows[-1][0]) if older_exists else None
+    prev_cursor = encode_cursor(rows[0][2], rows[0][0]) if newer_exists else None
+    return rows, next_cursor, prev_cursor
+
+
+def readings_cache_key(kind: ReadingKind, device_id: int, args: Mapping) -> tuple[tuple, str | None]:
+    """Response cache key of a readings page request, and the newest timestamp the page can hold (None if open)."""
+    readings_to, before = args.get("readingsTo") or None, args.get("before") or None
+    upper_bound = readings_to
+    if before:
+        try:
+            before_timestamp, _ = decode_cursor(before)
+        except ValueError:
+            # Invalid cursors get an error response, which is not cached
+            before_timestamp = None
+        if before_timestamp is not None:
+            upper_bound = min(upper_bound, before_timestamp) if upper_bound else before_timestamp
+    key = (
+        kind.table,
+        device_id,
+        args.get("readingsFrom") or None,
+        readings_to,
+        args.get("limit"),
+        before,
+        args.get("after") or None,
+    )
+    return key, upper_bound
+
+
+###### API handlers ######
+def get_devices(db: sqlite3.Connection, internal_ids: list[str]) -> str:
+    if message_log.enabled(logger):
+        logger.info(f"Retrieving devices with {internal_ids=} from db...")
+    if internal_ids:
+        placeholders = ",".join(["?"] * len(internal_ids))
+        stmt = f"SELECT * FROM devices WHERE internal_id IN ({placeholders})"
+        cur = db.execute(stmt, internal_ids)
+    else:
+        stmt = "SELECT * FROM devices"
+        cur = db.execute(stmt)
+
+    # Return all fetched devices, created_at as stored
+    devices = rows_to_dicts([col[0] for col in cur.description], cur.fetchall())
+    logger.debug(f"Retrieved devices: {devices}")
+    return json.dumps({"statusCode": 200, "devices": devices})
+
+
+def get_fleet(db: sqlite3.Connection, kind: ReadingKind, internal_ids: list[str], args: Mapping) -> str:
+    """Latest reading of every device of a kind (or those of `internal_ids`), in one query on its latest table.
+
+    With a `window` query parameter, also min/max/avg/count of each device's readings over the last `window` seconds,
+    read from the rollups.
+    """
+    window = args.get("window")
+    if window is not None:
+        try:
+            window = int(window)
+        except ValueError:
+            return json.dumps({"statusCode": 400, "error": "'window' must be an integer"})
+        if window < 1:
+            return json.dumps({"statusCode": 400, "error": f"Invalid window={window}. Must be >= 1 second"})
+
+    latest_table, value_col = LATEST_TABLES[kind.table]
+    stmt = (
+        f"SELECT d.id, d.internal_id, d.mac_address, d.info, l.timestamp, l.{value_col} "
+        f"FROM devices d LEFT JOIN {latest_table} l ON l.device_id = d.id"
+    )
+    if internal_ids:
+        stmt += f" WHERE d.internal_id IN ({','.join(['?'] * len(internal_ids))})"
+    rows = [
+        row
+        for row in db.execute(stmt + " ORDER BY d.id", internal_ids)
+        if parse_device_type(row[3]) == kind.device_type
+    ]
+
+    stats = {}
+    if window is not None:
+        from_epoch = timestamp_to_epoch(local_timestamp(int(time.time()))) - window
+        stats = window_stats(db, kind.table, [row[0] for row in rows if row[4] is not None], from_epoch)
+
+    devices = []
+    for device_id, internal_id, mac_address, _, timestamp, value in rows:
+        device = {
+            "device_id": device_id,
+            "internal_id": internal_id,
+            "macAddress": mac_address,
+            "timestamp": timestamp,
+            value_col: value,
+        }
+        if window is not None:
+            low, high, avg, count = stats.get(device_id, (None, None, None, 0))
+            device["stats"] = {"min": low, "max": high, "avg": avg, "count": count}
+        devices.append(device)
+
+    if message_log.enabled(logger):
+        logger.info(f"Retrieved latest {kind.table} of {len(devices)} devices with {internal_ids=}")
+    return json.dumps({"statusCode": 200, "windowSeconds": window, "devices": devices})
+
+
+def lookup_device(registry: DeviceRegistry, kind: ReadingKind, args: Mapping) -> tuple[int | None, str | None]:
+    """Device id of the 'macAddress' query parameter, or the error response."""
+    mac_address = args.get("macAddress")
+    if mac_address is None:
+        return None, json.dumps({"statusCode": 400, "error": "required 'macAddress' in params"})
+
+    device = registry.lookup(mac_address)
+    if device is None:
+        return None, json.dumps(
+            {"statusCode": 404, "error": f"{kind.device_label} with MAC_address={mac_address} not found"}
+        )
+    return device.id, None
+
+
+def get_readings(db: sqlite3.Connection, registry: DeviceRegistry, kind: ReadingKind, args: Mapping) -> str:
+    """GET readings of a device, `args` are the request query parameters."""
+    # Filter by mac address first
+    device_id, error = lookup_device(registry, kind, args)
+    if error is not None:
+        return error
+
+    # If no from-to range provided, return all readings otherwise filter
+    logger.debug(f"request arguments: {args}")
+    try:
+        rows, next_cursor, prev_cursor = query_readings_page(
+            db,
+            kind.table,
+            device_id,
+            args.get("readingsFrom"),
+            args.get("readingsTo"),
+            limit=parse_readings_limit(args.get("limit")),
+            before=args.get("before"),
+            after=args.get("after"),
+        )
+    except ValueError as e:
+        return json.dumps({"statusCode": 400, "error": str(e)})
+
+    if message_log.enabled(logger):
+        logger.info(f"Retrieved {len(rows)} readings for device_id={device_id}")
+    return json_response(
+        {
+            "statusCode": 200,
+            kind.response_key: readings_json(rows, kind.value_col),
+            "nextCursor": next_cursor,
+            "prevCursor": prev_cursor,
+        }
+    )
+
+
+def validate_reading(
+    kind: ReadingKind, data: dict, registry: DeviceRegistry, received_time: str | None = None
+) -> tuple[tuple | None, str | None]:
+    """Validate one submitted reading (POST body or MQTT payload).
+
+    Returns the (device_id, timestamp, value, seq) row to ingest, or the error response. With a `received_time` (MQTT
+    messages), a reading without a unix timestamp gets it instead of being rejected.
+    """
+    mac_address = data.get("macAddress")
+    if mac_address is None:
+        REJECTED["missing_mac"].inc()
+        return None, json.dumps({"statusCode": 400, "error": "'macAddress' required in body"})
+
+    # Device id from mac address, validating its type
+    start = time.perf_counter()
+    device = registry.lookup(mac_address, kind.device_type)
+    LOOKUP_SECONDS.observe(time.perf_counter() - start)
+    if device is None:
+        REJECTED["unknown_device"].inc()
+        return None, json.dumps(
+            {"statusCode": 404, "error": f"{kind.device_label} with MAC_address={mac_address} not found"}
+        )
+
+    timestamp, value, seq = data.get("timestamp"), data.get(kind.value_col), data.get("seq")
+    # The received time is not the node's, the reading is only keyed by its seq
+    received = received_time is not None and not is_device_clock(timestamp)
+    if received:
+        timestamp = received_time
+    if timestamp is None or value is None:
+        REJECTED["missing_field"].inc()
+        return None, json.dumps(
+            {"statusCode": 400, "error": f"Missing either of 'timestamp' or '{kind.value_col}' in body"}
+        )
+    # Data validation of timestamp and value. Unix timestamps and zero padded strings (i.e. the received time of MQTT
+    # messages) are stored as is, others are normalized by a strptime round trip
+    if is_device_clock(timestamp):
+        timestamp = local_timestamp(timestamp)
+    elif not is_valid_timestamp(timestamp):
+        try:
+            timestamp = datetime.strptime(timestamp, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d %H:%M:%S")
+        except (TypeError, ValueError):
+            REJECTED["invalid_timestamp"].inc()
+            return None, json.dumps(
+                {
+                    "statusCode": 400,
+                    "error": f"Invalid datetime format: {timestamp}. Required format: 'YYYY-MM-DD HH:MM:SS'",
+                }
+            )
+    try:
+        value = kind.convert(value)
+    except (TypeError, ValueError):
+        REJECTED["invalid_value"].inc()
+        return None, json.dumps(
+            {
+                "statusCode": 400,
+                "error": f"Invalid {kind.value_label} format. Could not convert {value} to {kind.convert.__name__}.",
+            }
+        )
+
+    if seq is not None and not is_seq(seq):
+        REJECTED["invalid_seq"].inc()
+        return None, json.dumps({"statusCode": 400, "error": f"Invalid seq: {seq}. Required a non negative integer"})
+
+    if message_log.enabled(logger):
+        logger.info(f"Queueing new reading for device_id={device.id} of {kind.value_col}={value}")
+    return (device.id, timestamp, value, reading_seq(seq, None if received else timestamp)), None
+
+
+def reading_accepted(device_id: int) -> str:
+    return json.dumps({"statusCode": 200, "device_id": device_id})
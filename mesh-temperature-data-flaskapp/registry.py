@@ -0,0 +1,150 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import database
+
+logger = logging.getLogger(__name__)
+
+GATEWAY = "gateway"
+TEMPERATURE = "temperature"
+
+
+def parse_device_type(info: str | None) -> str | None:
+    # Device type is encoded in the free-form 'info' column, i.e. NORVI_IIOT_GATEWAY or MESH_TEMPERATURE_SENSOR_1
+    info = (info or "").upper()
+    if "GATEWAY" in info:
+        return GATEWAY
+    if "TEMPERATURE" in info:
+        return TEMPERATURE
+    return None
+
+
+@dataclass(frozen=True, slots=True)
+class Device:
+    id: int
+    mac_address: str
+    device_type: str | None
+    row: dict  # full 'devices' row, as served by /api/devices
+
+
+class DeviceRegistry:
+    """Process-wide cache of the `devices` table keyed by MAC address.
+
+    The full table is loaded once and reloaded every `refresh_interval` seconds or after `invalidate()`.
+    Unknown MACs are looked up in the db once, then remembered as missing for `negative_ttl` seconds.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        refresh_interval: float = 60.0,
+        negative_ttl: float = 30.0,
+        negative_max_size: int = 10000,
+    ):
+        self.db_path = db_path
+        self.refresh_interval = refresh_interval
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+
+        self._by_mac: dict[str, Device] = {}
+        self._missing: OrderedDict[str, float] = OrderedDict()
+        self._loaded_at: float | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        return database.connect(self.db_path, readonly=True)
+
+    @staticmethod
+    def _to_device(cur: sqlite3.Cursor, row: tuple) -> Device:
+        device_row = {col[0]: value for col, value in zip(cur.description, row, strict=True)}
+        return Device(
+            id=device_row["id"],
+            mac_address=device_row["mac_address"],
+            device_type=parse_device_type(device_row.get("info")),
+            row=device_row,
+        )
+
+    def load(self) -> None:
+        db = self._connect()
+        try:
+            cur = db.execute("SELECT * FROM devices ORDER BY id")
+            by_mac = {}
+            for row in cur.fetchall():
+                device = self._to_device(cur, row)
+                by_mac[device.mac_address] = device
+        finally:
+            db.close()
+
+        with self._lock:
+            self._by_mac = by_mac
+            self._missing.clear()
+            self._loaded_at = time.monotonic()
+        logger.info(f"Loaded {len(by_mac)} devices in registry")
+
+    def invalidate(self) -> None:
+        # Next access reloads the whole table
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_fresh(self) -> None:
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            self.load()
+
+    def _lookup_missing(self, mac_address: str) -> Device | None:
+        now = time.monotonic()
+        with self._lock:
+            expires_at = self._missing.get(mac_address)
+            if expires_at is not None and expires_at > now:
+                return None
+
+        # Device may have been added since last load, check this single MAC
+        db = self._connect()
+        try:
+            cur = db.execute("SELECT * FROM devices WHERE mac_address = ?", (mac_address,))
+            row = cur.fetchone()
+            device = self._to_device(cur, row) if row is not None else None
+        finally:
+            db.close()
+
+        with self._lock:
+            if device is not None:
+                self._by_mac = {**self._by_mac, mac_address: device}
+                self._missing.pop(mac_address, None)
+            else:
+                self._missing[mac_address] = now + self.negative_ttl
+                self._missing.move_to_end(mac_address)
+                while len(self._missing) > self.negative_max_size:
+                    self._missing.popitem(last=False)
+                logger.debug(f"Unknown MAC_address={mac_address}, cached as missing for {self.negative_ttl}s")
+        return device
+
+    def is_cached(self, mac_address: str) -> bool:
+        """Whether `lookup` answers for this MAC from memory, without touching the db."""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self.refresh_interval:
+            return False
+        if mac_address in self._by_mac:
+            return True
+        expires_at = self._missing.get(mac_address)
+        return expires_at is not None and expires_at > time.monotonic()
+
+    def lookup(self, mac_address: str, device_type: str | None = None) -> Device | None:
+        """Device for a MAC address, optionally restricted to a device type (GATEWAY or TEMPERATURE)."""
+        self._ensure_fresh()
+        device = self._by_mac.get(mac_address)
+        if device is None:
+            device = self._lookup_missing(mac_address)
+        if device is None or (device_type is not None and device.device_type != device_type):
+            return None
+        return device
+
+    def devices(self, device_type: str | None = None) -> list[dict]:
+        self._ensure_fresh()
+        return [
+            device.row for device in self._by_mac.values() if device_type is None or device.device_type == device_type
+        ]
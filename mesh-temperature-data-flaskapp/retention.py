@@ -0,0 +1,29 @@
+"""Retention of raw readings partitions and rollups, as configured by the RETENTION_* settings."""
+
+import sqlite3
+
+from config import (
+    RETENTION_DAY_ROLLUPS_DAYS,
+    RETENTION_GATEWAY_READINGS_DAYS,
+    RETENTION_HOUR_ROLLUPS_DAYS,
+    RETENTION_MINUTE_ROLLUPS_DAYS,
+    RETENTION_SENSOR_TEMPERATURE_READINGS_DAYS,
+)
+from partitions import apply_retention
+from rollups import ROLLUP_RESOLUTIONS, ROLLUP_TABLES
+
+
+def run_retention(db: sqlite3.Connection) -> None:
+    apply_retention(
+        db,
+        raw_retention_days={
+            "gateway_readings": RETENTION_GATEWAY_READINGS_DAYS,
+            "sensor_temperature_readings": RETENTION_SENSOR_TEMPERATURE_READINGS_DAYS,
+        },
+        rollup_retention_days={
+            ROLLUP_RESOLUTIONS["minute"]: RETENTION_MINUTE_ROLLUPS_DAYS,
+            ROLLUP_RESOLUTIONS["hour"]: RETENTION_HOUR_ROLLUPS_DAYS,
+            ROLLUP_RESOLUTIONS["day"]: RETENTION_DAY_ROLLUPS_DAYS,
+        },
+        rollup_tables=[rollup_table for rollup_table, _ in ROLLUP_TABLES.values()],
+    )
@@ -0,0 +1,253 @@
+import logging
+import math
+import sqlite3
+from datetime import UTC, datetime
+from functools import lru_cache
+from itertools import pairwise
+
+from partitions import list_partitions
+
+logger = logging.getLogger(__name__)
+
+# Bucket widths maintained for each readings table, coarsest last
+ROLLUP_RESOLUTIONS = {"minute": 60, "hour": 3600, "day": 86400}
+
+# readings table -> (rollups table, value column)
+ROLLUP_TABLES = {
+    "gateway_readings": ("gateway_readings_rollups", "rssi"),
+    "sensor_temperature_readings": ("sensor_temperature_readings_rollups", "temperature"),
+}
+
+ROLLUP_COLUMNS = "device_id, resolution, bucket, count, sum, min, max, last, last_timestamp"
+
+
+@lru_cache(maxsize=4096)
+def _minute_epoch(minute_prefix: str) -> int:
+    return int(datetime.strptime(minute_prefix, "%Y-%m-%d %H:%M").replace(tzinfo=UTC).timestamp())
+
+
+def timestamp_to_epoch(timestamp: str) -> int:
+    """Epoch seconds of a 'YYYY-MM-DD HH:MM:SS' timestamp, read as UTC like SQLite's strftime('%s')."""
+    # Readings of a batch share few distinct minutes, only the seconds need parsing per reading
+    return _minute_epoch(timestamp[:16]) + int(timestamp[17:19] or 0)
+
+
+def create_rollup_tables(db: sqlite3.Connection) -> None:
+    for rollup_table, value_col in ROLLUP_TABLES.values():
+        value_type = "INTEGER" if value_col == "rssi" else "REAL"
+        db.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {rollup_table} (
+                device_id INTEGER NOT NULL REFERENCES devices(id),
+                resolution INTEGER NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                sum REAL NOT NULL,
+                min {value_type} NOT NULL,
+                max {value_type} NOT NULL,
+                last {value_type} NOT NULL,
+                last_timestamp DATETIME NOT NULL,
+                PRIMARY KEY (device_id, resolution, bucket)
+            ) WITHOUT ROWID
+            """
+        )
+
+
+def _merge_bucket(buckets: dict, key: tuple, agg: list) -> None:
+    current = buckets.get(key)
+    if current is None:
+        buckets[key] = agg.copy()
+        return
+    current[0] += agg[0]
+    current[1] += agg[1]
+    current[2] = min(current[2], agg[2])
+    current[3] = max(current[3], agg[3])
+    # Ties go to the reading inserted last, same as the backfill
+    if agg[5] >= current[5]:
+        current[4], current[5] = agg[4], agg[5]
+
+
+def rollup_batch(rows: list[tuple]) -> list[tuple]:
+    """Pre-aggregate (device_id, timestamp, value) readings into one row per (device_id, resolution, bucket)."""
+    # Readings are aggregated per finest resolution once, coarser buckets are then merged from those
+    resolutions = sorted(ROLLUP_RESOLUTIONS.values())
+    finest = resolutions[0]
+    buckets: dict[tuple, list] = {}
+    for device_id, timestamp, value in rows:
+        epoch = timestamp_to_epoch(timestamp)
+        key = (device_id, finest, epoch - epoch % finest)
+        agg = buckets.get(key)
+        if agg is None:
+            buckets[key] = [1, value, value, value, value, timestamp]
+            continue
+        agg[0] += 1
+        agg[1] += value
+        agg[2] = min(agg[2], value)
+        agg[3] = max(agg[3], value)
+        if timestamp >= agg[5]:
+            agg[4], agg[5] = value, timestamp
+
+    finest_buckets = list(buckets.items())
+    for resolution in resolutions[1:]:
+        for (device_id, _, bucket), agg in finest_buckets:
+            _merge_bucket(buckets, (device_id, resolution, bucket - bucket % resolution), agg)
+    return [(*key, *agg) for key, agg in buckets.items()]
+
+
+def apply_rollups(db: sqlite3.Connection, table: str, rows: list[tuple]) -> None:
+    """Merge a batch of (device_id, timestamp, value) readings into the rollups, inside the caller's transaction."""
+    rollup_table, _ = ROLLUP_TABLES[table]
+    db.executemany(
+        f"""
+        INSERT INTO {rollup_table} ({ROLLUP_COLUMNS})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (device_id, resolution, bucket) DO UPDATE SET
+            count = count + excluded.count,
+            sum = sum + excluded.sum,
+            min = MIN(min, excluded.min),
+            max = MAX(max, excluded.max),
+            last = CASE WHEN excluded.last_timestamp >= last_timestamp THEN excluded.last ELSE last END,
+            last_timestamp = MAX(last_timestamp, excluded.last_timestamp)
+        """,
+        rollup_batch(rows),
+    )
+
+
+def _raw_rollup_select(table: str, value_col: str, resolution: int) -> str:
+    # Rollup rows for one resolution computed from the raw readings of a partition, last value from the newest reading.
+    # Buckets are at most a day wide so they never straddle two monthly partitions
+    return f"""
+        SELECT g.device_id, {resolution:d}, g.bucket, g.count, g.sum, g.min, g.max,
+               (SELECT r.{value_col} FROM {table} r
+                WHERE r.device_id = g.device_id AND r.timestamp = g.last_timestamp
+                ORDER BY r.id DESC LIMIT 1),
+               g.last_timestamp
+        FROM (
+            SELECT device_id,
+                   (CAST(strftime('%s', timestamp) AS INTEGER) / {resolution:d}) * {resolution:d} AS bucket,
+                   COUNT(*) AS count, TOTAL({value_col}) AS sum, MIN({value_col}) AS min, MAX({value_col}) AS max,
+                   MAX(timestamp) AS last_timestamp
+            FROM {table}
+            WHERE device_id IS NOT NULL AND timestamp IS NOT NULL
+            GROUP BY device_id, bucket
+        ) g
+    """
+
+
+def backfill_rollups(db: sqlite3.Connection, table: str) -> None:
+    """Rebuild the rollups of a readings table from its raw readings, inside the caller's transaction."""
+    rollup_table, value_col = ROLLUP_TABLES[table]
+    db.execute(f"DELETE FROM {rollup_table}")
+    for partition, _ in list_partitions(db, table):
+        for resolution in ROLLUP_RESOLUTIONS.values():
+            db.execute(
+                f"INSERT INTO {rollup_table} ({ROLLUP_COLUMNS}) " + _raw_rollup_select(partition, value_col, resolution)
+            )
+        logger.info(f"Backfilled rollups of {partition}")
+
+
+def verify_rollups(db: sqlite3.Connection, table: str) -> list[str]:
+    """Compare the maintained rollups with an aggregation of the raw readings, returns the mismatches found."""
+    rollup_table, value_col = ROLLUP_TABLES[table]
+    mismatches = []
+    for resolution in ROLLUP_RESOLUTIONS.values():
+        expected = {
+            row[:3]: row[3:]
+            for partition, _ in list_partitions(db, table)
+            for row in db.execute(_raw_rollup_select(partition, value_col, resolution))
+        }
+        actual = {
+            row[:3]: row[3:]
+            for row in db.execute(
+                f"SELECT {ROLLUP_COLUMNS} FROM {rollup_table} WHERE resolution = ?",
+                (resolution,),
+            )
+        }
+        for key in expected.keys() | actual.keys():
+            want, got = expected.get(key), actual.get(key)
+            if want is None or got is None:
+                mismatches.append(f"{rollup_table} bucket {key}: expected {want}, got {got}")
+                continue
+            sums_match = math.isclose(want[1], got[1], rel_tol=1e-9, abs_tol=1e-6)
+            if want[0] != got[0] or not sums_match or want[2:] != got[2:]:
+                mismatches.append(f"{rollup_table} bucket {key}: expected {want}, got {got}")
+    return mismatches
+
+
+def pick_resolution(bucket_seconds: int, from_epoch: int | None, to_epoch: int | None) -> int | None:
+    """Coarsest rollup resolution that exactly tiles the requested buckets and range, None if raw readings are needed.
+
+    `to_epoch` is inclusive, so a range ending at 23:59:59 is aligned on days.
+    """
+    for resolution in sorted(ROLLUP_RESOLUTIONS.values(), reverse=True):
+        if bucket_seconds % resolution:
+            continue
+        if from_epoch is not None and from_epoch % resolution:
+            continue
+        if to_epoch is not None and (to_epoch + 1) % resolution:
+            continue
+        return resolution
+    return None
+
+
+def snap_bucket_seconds(bucket_seconds: int) -> int:
+    # Round a computed bucket width up to a multiple of the coarsest resolution it spans, so rollups can serve it
+    for resolution in sorted(ROLLUP_RESOLUTIONS.values(), reverse=True):
+        if bucket_seconds >= resolution:
+            return math.ceil(bucket_seconds / resolution) * resolution
+    return bucket_seconds
+
+
+def aggregate_from_rollups(
+    db: sqlite3.Connection,
+    table: str,
+    device_ids: list[int],
+    resolution: int,
+    from_epoch: int | None,
+    to_epoch: int | None,
+    bucket_seconds: int,
+) -> list[tuple]:
+    """(device_id, bucket, min, max, avg, count) rows like a raw GROUP BY, read from a rollup resolution."""
+    rollup_table, _ = ROLLUP_TABLES[table]
+    conditions = [f"device_id IN ({','.join(['?'] * len(device_ids))})", "resolution = ?"]
+    args: list = [*device_ids, resolution]
+    if from_epoch is not None:
+        conditions.append("bucket >= ?")
+        args.append(from_epoch)
+    if to_epoch is not None:
+        conditions.append("bucket <= ?")
+        args.append(to_epoch)
+    stmt = (
+        f"SELECT device_id, (bucket / ?) * ? AS out_bucket, MIN(min), MAX(max), SUM(sum) / SUM(count), SUM(count) "
+        f"FROM {rollup_table} WHERE {' AND '.join(conditions)} GROUP BY device_id, out_bucket "
+        f"ORDER BY device_id, out_bucket"
+    )
+    return db.execute(stmt, (bucket_seconds, bucket_seconds, *args)).fetchall()
+
+
+def window_stats(db: sqlite3.Connection, table: str, device_ids: list[int], from_epoch: int) -> dict[int, tuple]:
+    """(min, max, avg, count) per device of its readings from `from_epoch` on, rounded down to the minute.
+
+    The window is tiled with minute buckets up to the first whole hour, hour buckets up to the first whole day and
+    day buckets after, so a day long window reads at most ~80 rollup rows per device instead of 1440.
+    """
+    if not device_ids:
+        return {}
+    rollup_table, _ = ROLLUP_TABLES[table]
+    resolutions = sorted(ROLLUP_RESOLUTIONS.values())
+    segments = []
+    start = from_epoch - from_epoch % resolutions[0]
+    for resolution, coarser in pairwise(resolutions):
+        end = math.ceil(start / coarser) * coarser
+        segments.append((resolution, start, end))
+        start = end
+    # Coarsest resolution up to any reading to come
+    segments.append((resolutions[-1], start, 2**62))
+    stmt = (
+        f"WITH segments (resolution, start, end) AS (VALUES {', '.join(['(?, ?, ?)'] * len(segments))}) "
+        f"SELECT r.device_id, MIN(r.min), MAX(r.max), SUM(r.sum) / SUM(r.count), SUM(r.count) "
+        f"FROM segments s JOIN {rollup_table} r ON r.device_id IN ({','.join(['?'] * len(device_ids))}) "
+        f"AND r.resolution = s.resolution AND r.bucket >= s.start AND r.bucket < s.end GROUP BY r.device_id"
+    )
+    args = [value for segment in segments for value in segment]
+    return {row[0]: row[1:] for row in db.execute(stmt, (*args, *device_ids))}
@@ -0,0 +1,53 @@
+import json
+import math
+from collections.abc import Iterable, Sequence
+from json.encoder import encode_basestring
+
+
+class RawJSON(str):
+    """Already encoded JSON text (i.e. from readings_json), embedded as is by json_response()."""
+
+
+def json_str(value: str | None) -> str:
+    return "null" if value is None else encode_basestring(value)
+
+
+def json_number(value: float | None) -> str:
+    # repr() is what json.dumps uses for finite numbers, only inf needs its JSON spelling
+    if value is None:
+        return "null"
+    return repr(value) if math.isfinite(value) else json.dumps(value)
+
+
+def readings_json(rows: Iterable[tuple], value_col: str) -> RawJSON:
+    """JSON array of (id, device_id, timestamp, value, received_time) readings rows, timestamps as stored.
+
+    Formatted directly from the row tuples instead of a dict and json.dumps per row. Output is identical to
+    json.dumps of [{id, device_id, timestamp, <value_col>, received_time}, ...]
+    """
+    value_key = encode_basestring(value_col)
+    return RawJSON(
+        "["
+        + ", ".join(
+            f'{{"id": {reading_id}, "device_id": {json_number(device_id)}, "timestamp": {json_str(timestamp)}, '
+            f'{value_key}: {json_number(value)}, "received_time": {json_str(received_time)}}}'
+            for reading_id, device_id, timestamp, value, received_time in rows
+        )
+        + "]"
+    )
+
+
+def json_response(fields: dict) -> str:
+    """Same text as json.dumps(fields), with RawJSON values inserted without being encoded again."""
+    return (
+        "{"
+        + ", ".join(
+            f"{encode_basestring(key)}: {value if isinstance(value, RawJSON) else json.dumps(value)}"
+            for key, value in fields.items()
+        )
+        + "}"
+    )
+
+
+def rows_to_dicts(columns: Sequence[str], rows: Iterable[tuple]) -> list[dict]:
+    return [dict(zip(columns, row, strict=True)) for row in rows]
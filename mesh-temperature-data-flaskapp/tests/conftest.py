@@ -0,0 +1,48 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from ingest import IngestQueue
+from migrations import migrate
+
+INIT_SQL = Path(__file__).resolve().parents[2] / "sqlite" / "init.sql"
+
+# Devices of init.sql
+GATEWAY_ID = 1
+SENSOR_IDS = (2, 3)
+
+
+def create_db(path: str) -> None:
+    # Baseline schema and devices, schema version 0
+    db = sqlite3.connect(path)
+    db.executescript(INIT_SQL.read_text())
+    db.close()
+
+
+def ingest(db_path: str, readings: list[tuple]) -> dict:
+    """Write (table, device_id, timestamp, value[, seq]) readings through the ingest queue, returns its stats once drained."""
+    queue = IngestQueue(db_path, max_batch=64, flush_interval=0.01)
+    queue.start()
+    try:
+        for reading in readings:
+            queue.put(*reading)
+    finally:
+        queue.stop()
+    return queue.stats()
+
+
+@pytest.fixture
+def db_path(tmp_path: Path) -> str:
+    # Baseline schema migrated to the latest version
+    path = str(tmp_path / "db.sqlite")
+    create_db(path)
+    migrate(path)
+    return path
+
+
+@pytest.fixture
+def db(db_path: str):
+    db = sqlite3.connect(db_path)
+    yield db
+    db.close()
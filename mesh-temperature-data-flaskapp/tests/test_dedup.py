@@ -0,0 +1,82 @@
+import sqlite3
+
+from conftest import SENSOR_IDS, create_db, ingest
+
+from bulk import validate_readings
+from ingest import IngestQueue
+from migrations import migrate
+from partitions import list_partitions
+from payloads import local_timestamp, reading_seq
+
+TEMPERATURE = "sensor_temperature_readings"
+
+
+def stored_readings(db: sqlite3.Connection) -> list[tuple]:
+    return sorted(
+        row
+        for partition, _ in list_partitions(db, TEMPERATURE)
+        for row in db.execute(f"SELECT device_id, timestamp, temperature, seq FROM {partition}")
+    )
+
+
+def upload(db_path: str, items: list[dict]) -> int:
+    # Bulk upload of JSON readings, returns how many were inserted
+    rows, errors = validate_readings(items, "temperature", float, {"AA": SENSOR_IDS[0]}.get)
+    assert errors == []
+    queue = IngestQueue(db_path, max_batch=64, flush_interval=0.01)
+    queue.start()
+    try:
+        return queue.put_many(TEMPERATURE, rows)
+    finally:
+        queue.stop()
+
+
+def test_replayed_seq_stored_once(db_path, db):
+    # QoS 1 redelivery of received-time readings: same seq, a later received time
+    first = [(TEMPERATURE, SENSOR_IDS[0], f"2026-01-15 00:00:0{seq}", 20.0, seq) for seq in range(5)]
+    replay = [(TEMPERATURE, SENSOR_IDS[0], f"2026-01-15 00:01:0{seq}", 20.0, seq) for seq in range(5)]
+    stats = ingest(db_path, first + replay)
+
+    assert stats["flushed"] == 5
+    assert stats["duplicates"] == 5
+    assert stored_readings(db) == [(SENSOR_IDS[0], ts, value, seq) for _, _, ts, value, seq in first]
+
+
+def test_received_time_readings_of_a_second_all_stored(db_path, db):
+    # Without a seq nor a device clock nothing tells readings apart, none are dropped
+    stats = ingest(db_path, [(TEMPERATURE, SENSOR_IDS[0], "2026-01-15 00:00:00", 20.0 + i) for i in range(3)])
+
+    assert stats["flushed"] == 3
+    assert len(stored_readings(db)) == 3
+
+
+def test_uploaded_again_as_strings_is_duplicate(db_path, db):
+    epochs = [1768435200 + i for i in range(3)]
+    items = [{"macAddress": "AA", "timestamp": epoch, "temperature": 20.0} for epoch in epochs]
+    assert upload(db_path, items) == 3
+
+    # An export of those readings, string timestamps, uploaded again
+    exported = [{"macAddress": "AA", "timestamp": local_timestamp(epoch), "temperature": 20.0} for epoch in epochs]
+    assert upload(db_path, exported) == 0
+    assert [row[3] for row in stored_readings(db)] == [reading_seq(None, local_timestamp(epoch)) for epoch in epochs]
+
+
+def test_migration_keys_stored_readings(tmp_path):
+    # A reading stored before migration 7, without a seq
+    path = str(tmp_path / "db.sqlite")
+    create_db(path)
+    db = sqlite3.connect(path)
+    with db:
+        db.execute(
+            f"INSERT INTO {TEMPERATURE} (device_id, timestamp, temperature) VALUES (?, ?, ?)",
+            (SENSOR_IDS[0], "2026-01-15 00:00:00", 20.0),
+        )
+    db.close()
+    migrate(path, target_version=6)
+    migrate(path)
+
+    # The stored reading is keyed by its timestamp, uploading it again is a duplicate
+    assert upload(path, [{"macAddress": "AA", "timestamp": "2026-01-15 00:00:00", "temperature": 20.0}]) == 0
+    # The same second without a key is stored again, the index on (device_id, timestamp) is no longer unique
+    stats = ingest(path, [(TEMPERATURE, SENSOR_IDS[0], "2026-01-15 00:00:00", 21.0)])
+    assert stats["flushed"] == 1
@@ -0,0 +1,44 @@
+import sqlite3
+
+from conftest import SENSOR_IDS, create_db, ingest
+
+from migrations import migrate
+from partitions import list_partitions
+
+TEMPERATURE = "sensor_temperature_readings"
+
+
+def stored_ids(db: sqlite3.Connection, table: str) -> list[int]:
+    return [row[0] for partition, _ in list_partitions(db, table) for row in db.execute(f"SELECT id FROM {partition}")]
+
+
+def test_reading_ids_unique_across_partitions(db_path, db):
+    # Each month in its own flush, the last one back into an existing partition
+    for day in ("2026-01-15", "2026-02-15", "2026-03-15", "2026-01-20"):
+        ingest(db_path, [(TEMPERATURE, SENSOR_IDS[0], f"{day} 00:00:0{i}", 20.0) for i in range(5)])
+
+    ids = stored_ids(db, TEMPERATURE)
+    assert len(ids) == 20
+    assert len(set(ids)) == len(ids)
+    assert [month for _, month in list_partitions(db, TEMPERATURE)] == ["2026-01", "2026-02", "2026-03"]
+
+
+def test_ids_continue_after_partitioned_readings(tmp_path):
+    # Readings stored before the move to partitions keep their ids, new ones are numbered after them
+    path = str(tmp_path / "db.sqlite")
+    create_db(path)
+    db = sqlite3.connect(path)
+    with db:
+        db.executemany(
+            f"INSERT INTO {TEMPERATURE} (device_id, timestamp, temperature) VALUES (?, ?, ?)",
+            [(SENSOR_IDS[0], f"2026-0{month}-01 00:00:00", 20.0) for month in (1, 2)],
+        )
+    db.close()
+    migrate(path)
+    ingest(path, [(TEMPERATURE, SENSOR_IDS[1], f"2026-0{month}-02 00:00:00", 21.0) for month in (1, 2, 3)])
+
+    db = sqlite3.connect(path)
+    try:
+        assert sorted(stored_ids(db, TEMPERATURE)) == [1, 2, 3, 4, 5]
+    finally:
+        db.close()
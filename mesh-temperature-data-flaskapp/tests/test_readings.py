@@ -0,0 +1,26 @@
+from conftest import SENSOR_IDS, ingest
+
+from readings import query_readings_page
+
+TEMPERATURE = "sensor_temperature_readings"
+
+
+def test_pages_walk_every_reading_once(db_path, db):
+    # Readings over three monthly partitions, pages straddle them
+    timestamps = [f"2026-0{month}-01 00:00:0{second}" for month in (1, 2, 3) for second in range(3)]
+    ingest(db_path, [(TEMPERATURE, SENSOR_IDS[0], timestamp, 20.0) for timestamp in timestamps])
+
+    pages, cursor = [], None
+    while True:
+        rows, next_cursor, prev_cursor = query_readings_page(db, TEMPERATURE, SENSOR_IDS[0], limit=2, before=cursor)
+        pages.append(rows)
+        if next_cursor is None:
+            break
+        cursor = next_cursor
+    ids = [row[0] for rows in pages for row in rows]
+    assert len(ids) == len(set(ids)) == len(timestamps)
+    assert [row[2] for rows in pages for row in rows] == sorted(timestamps, reverse=True)
+
+    # Back from the last page with its 'after' cursor
+    newer, _, _ = query_readings_page(db, TEMPERATURE, SENSOR_IDS[0], limit=2, after=prev_cursor)
+    assert newer == pages[-2]
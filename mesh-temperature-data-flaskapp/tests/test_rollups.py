@@ -0,0 +1,35 @@
+import random
+from datetime import datetime, timedelta
+
+from conftest import GATEWAY_ID, SENSOR_IDS, ingest
+
+from rollups import ROLLUP_TABLES, verify_rollups
+
+START = datetime(2026, 1, 31, 22, 0, 0)
+
+
+def test_ingested_rollups_match_raw_aggregation(db_path, db):
+    rng = random.Random(7)
+    # Out of order readings across a day and month boundary, flushed in several batches merging into the same buckets
+    readings = []
+    for _ in range(500):
+        timestamp = (START + timedelta(seconds=rng.randrange(4 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+        readings.append(("gateway_readings", GATEWAY_ID, timestamp, rng.randint(-90, -30)))
+        timestamp = (START + timedelta(seconds=rng.randrange(4 * 3600))).strftime("%Y-%m-%d %H:%M:%S")
+        readings.append(
+            ("sensor_temperature_readings", rng.choice(SENSOR_IDS), timestamp, round(rng.uniform(15, 30), 2))
+        )
+
+    assert ingest(db_path, readings)["flushErrors"] == 0
+    for table, (rollup_table, _) in ROLLUP_TABLES.items():
+        assert db.execute(f"SELECT COUNT(*) FROM {rollup_table}").fetchone()[0] > 0
+        assert verify_rollups(db, table) == []
+
+
+def test_verify_reports_rollups_out_of_step(db_path, db):
+    ingest(db_path, [("gateway_readings", GATEWAY_ID, "2026-01-31 22:00:00", -50)])
+    rollup_table, _ = ROLLUP_TABLES["gateway_readings"]
+    with db:
+        db.execute(f"UPDATE {rollup_table} SET count = count + 1")
+
+    assert len(verify_rollups(db, "gateway_readings")) == 3